@@ -1,11 +1,19 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from datetime import datetime, timedelta
 from services.user_service import UserService
+from services.sync_state_service import SyncStateService
+from utils.event_bus import event_bus, EVENT_SUBSCRIPTION_CHANGED, EVENT_OUTBOX_CHANGED, EVENT_MIGRATION_CHANGED
 from services.server_service import ServerService
 from services.subscription_service import SubscriptionService
+from services.reconcile_service import ReconcileService
+from services.status_cache import server_status_cache
+from services.circuit_breaker import circuit_breakers
+from services.metrics_service import server_metrics
+from services.vpn_link_service import VpnLinkService
+from services.migration_service import MigrationService
 from database.connection import db_manager
-from utils.helpers import seconds_to_human_readable
-import math
+from config import Config
+from utils.helpers import seconds_to_human_readable, now_timestamp, to_timestamp, format_timestamp
 import random
 import string
 import logging
@@ -24,14 +32,14 @@ def index():
     """Главная страница админ-панели"""
     try:
         # Получаем статистику
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
 
             # Общая статистика
             cursor.execute("SELECT COUNT(*) FROM users")
             total_users = cursor.fetchone()[0]
 
-            cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end > ?", (datetime.now(),))
+            cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end > ?", (now_timestamp(),))
             active_users = cursor.fetchone()[0]
 
             cursor.execute("SELECT COUNT(*) FROM servers")
@@ -64,7 +72,7 @@ def index():
             server = dict(server_row)
 
             if server['is_active']:
-                status = ServerService.get_server_status(server)
+                status = server_status_cache.get(server)
                 is_online = not status.get('error')
                 cpu_usage = 'N/A'
                 memory_usage = 'N/A'
@@ -97,13 +105,13 @@ def index():
         notifications = []
 
         # Проверяем истекающие подписки
-        tomorrow = datetime.now() + timedelta(hours=24)
-        with db_manager.get_connection() as conn:
+        now = now_timestamp()
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT COUNT(*) FROM users 
-                WHERE subscription_end BETWEEN ? AND ? AND subscription_end > ?
-            """, (datetime.now(), tomorrow, datetime.now()))
+                WHERE subscription_end > ? AND subscription_end <= ?
+            """, (now, now + 24 * 3600))
             expiring_count = cursor.fetchone()[0]
 
             if expiring_count > 0:
@@ -142,109 +150,49 @@ def index():
 
 @admin_bp.route('/users')
 def users_list():
-    """Список пользователей с пагинацией и фильтрами"""
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
+    """Список пользователей с постраничным выводом по курсору и фильтрами"""
     search = request.args.get('search', '')
     status_filter = request.args.get('status', '')
     server_filter = request.args.get('server', '')
+    after = request.args.get('after')
+    before = request.args.get('before')
+    server_id = int(server_filter) if server_filter.isdigit() else None
 
     try:
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
+        page = UserService.list_users(search, status_filter, server_id, after=after, before=before,
+                                      limit=Config.USERS_PAGE_SIZE)
 
-            # Строим запрос с фильтрами
-            where_conditions = []
-            params = []
-
-            if search:
-                where_conditions.append("(u.telegram_id LIKE ? OR u.email LIKE ?)")
-                params.extend([f'%{search}%', f'%{search}%'])
-
-            if status_filter == 'active':
-                where_conditions.append("u.subscription_end > ?")
-                params.append(datetime.now())
-            elif status_filter == 'expired':
-                where_conditions.append("u.subscription_end <= ?")
-                params.append(datetime.now())
-
-            if server_filter:
-                where_conditions.append("u.server_id = ?")
-                params.append(server_filter)
-
-            where_clause = " AND ".join(where_conditions)
-            if where_clause:
-                where_clause = "WHERE " + where_clause
-
-            # Подсчет общего количества
-            count_query = f"""
-                SELECT COUNT(*) FROM users u
-                LEFT JOIN servers s ON u.server_id = s.id
-                {where_clause}
-            """
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()[0]
-
-            # Получение пользователей для текущей страницы
-            offset = (page - 1) * per_page
-            users_query = f"""
-                SELECT u.*, s.name as server_name, s.domain as server_domain
-                FROM users u
-                LEFT JOIN servers s ON u.server_id = s.id
-                {where_clause}
-                ORDER BY u.created_at DESC
-                LIMIT ? OFFSET ?
-            """
-            cursor.execute(users_query, params + [per_page, offset])
-            users = cursor.fetchall()
-
-            # Добавляем расчет времени до истечения
-            now = datetime.now()
-            users_with_time = []
-            for user in users:
-                user_dict = dict(user)
-                user_dict['is_subscription_active'] = user_dict['subscription_end'] > now
-                user_dict['time_left_seconds'] = max(0, int((user_dict['subscription_end'] - now).total_seconds()))
-                users_with_time.append(user_dict)
-
-            # Статистика для отображения
-            cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end > ?", (now,))
-            active_count = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end <= ?", (now,))
-            expired_count = cursor.fetchone()[0]
-
-            # Истекают в ближайшие 24 часа
-            tomorrow = now + timedelta(hours=24)
-            cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end BETWEEN ? AND ?", (now, tomorrow))
-            expiring_soon = cursor.fetchone()[0]
-
-            # Получаем серверы для фильтра
+        # Добавляем расчет времени до истечения
+        now = now_timestamp()
+        for user in page['users']:
+            user['time_left_seconds'] = max(0, user['subscription_end'] - now)
+
+        # Итоги из счетчиков серверов или кэша - без COUNT(*) на каждый запрос
+        total = UserService.count_users(search, status_filter, server_id)
+        users_stats = UserService.get_subscription_stats()
+
+        # Получаем серверы для фильтра
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("SELECT id, name FROM servers WHERE is_active = TRUE ORDER BY name")
             servers = cursor.fetchall()
 
-        # Пагинация
-        pages = math.ceil(total / per_page)
+        # Ссылки на соседние страницы сохраняют фильтры
+        filters = {key: value for key, value in (('search', search), ('status', status_filter),
+                                                 ('server', server_filter)) if value}
         pagination = {
-            'page': page,
-            'pages': pages,
-            'per_page': per_page,
             'total': total,
-            'has_prev': page > 1,
-            'has_next': page < pages,
-            'prev_num': page - 1 if page > 1 else None,
-            'next_num': page + 1 if page < pages else None,
-            'iter_pages': lambda: range(max(1, page - 2), min(pages + 1, page + 3))
-        }
-
-        users_stats = {
-            'active_count': active_count,
-            'expired_count': expired_count,
-            'expiring_soon': expiring_soon
+            'per_page': Config.USERS_PAGE_SIZE,
+            'is_first': page['prev_cursor'] is None,
+            'first_url': url_for('admin.users_list', **filters),
+            'prev_url': url_for('admin.users_list', before=page['prev_cursor'], **filters)
+            if page['prev_cursor'] else None,
+            'next_url': url_for('admin.users_list', after=page['next_cursor'], **filters)
+            if page['next_cursor'] else None
         }
 
         return render_template('users/list.html',
-                               users=users_with_time,
+                               users=page['users'],
                                pagination=pagination,
                                users_stats=users_stats,
                                servers=servers)
@@ -272,11 +220,10 @@ def user_details(user_id):
                 vpn_config = config
 
         # Добавляем время до истечения в секундах
-        now = datetime.now()
-        user['time_left_seconds'] = max(0, int((user['subscription_end'] - now).total_seconds()))
+        user['time_left_seconds'] = max(0, user['subscription_end'] - now_timestamp())
 
         # Получаем историю активности
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT action, details, timestamp FROM user_activity_log 
@@ -320,13 +267,8 @@ def add_user():
             flash(f'Ошибка создания пользователя: {message}', 'error')
 
     # Получаем серверы для выбора
+    # (число пользователей сервера хранится в servers.user_count)
     servers = ServerService.get_active_servers()
-    for server in servers:
-        # Подсчитываем пользователей на каждом сервере
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users WHERE server_id = ?", (server['id'],))
-            server['user_count'] = cursor.fetchone()[0]
 
     return render_template('users/add.html', servers=servers)
 
@@ -341,8 +283,7 @@ def extend_user_page(user_id):
             return redirect(url_for('admin.users_list'))
 
         # Добавляем время до истечения в секундах
-        now = datetime.now()
-        user['time_left_seconds'] = max(0, int((user['subscription_end'] - now).total_seconds()))
+        user['time_left_seconds'] = max(0, user['subscription_end'] - now_timestamp())
 
         # Получаем доступные промокоды
         available_promocodes = SubscriptionService.get_active_promocodes()
@@ -410,7 +351,8 @@ def set_user_subscription_end_date(user_id):
             return redirect(url_for('admin.user_details', user_id=user_id))
 
         # Проверяем, что дата в будущем
-        if end_date <= datetime.now():
+        end_timestamp = to_timestamp(end_date)
+        if end_timestamp <= now_timestamp():
             flash('Дата окончания должна быть в будущем', 'error')
             return redirect(url_for('admin.user_details', user_id=user_id))
 
@@ -423,9 +365,9 @@ def set_user_subscription_end_date(user_id):
         with db_manager.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                UPDATE users SET subscription_end = ?, updated_at = CURRENT_TIMESTAMP
+                UPDATE users SET subscription_end = ?, updated_at = ?
                 WHERE id = ?
-            """, (end_date, user_id))
+            """, (end_timestamp, now_timestamp(), user_id))
 
             # Логируем изменение
             cursor.execute("""
@@ -433,8 +375,12 @@ def set_user_subscription_end_date(user_id):
                 VALUES (?, ?, ?)
             """, (user_id, "SUBSCRIPTION_SET_DATE", f"Set end date to: {end_date}"))
 
+            SyncStateService.mark_dirty(cursor, user_id, SyncStateService.desired_state_for(end_timestamp))
+
             conn.commit()
 
+        event_bus.publish(EVENT_SUBSCRIPTION_CHANGED, user_id=user_id)
+
         flash(f'Дата окончания подписки установлена: {end_date.strftime("%d.%m.%Y %H:%M")}', 'success')
 
     except Exception as e:
@@ -505,9 +451,9 @@ def reset_user_subscription(user_id):
         with db_manager.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                UPDATE users SET subscription_end = ?, updated_at = CURRENT_TIMESTAMP
+                UPDATE users SET subscription_end = ?, updated_at = ?
                 WHERE id = ?
-            """, (datetime.now(), user_id))
+            """, (now_timestamp(), now_timestamp(), user_id))
 
             # Логируем действие
             cursor.execute("""
@@ -515,8 +461,12 @@ def reset_user_subscription(user_id):
                 VALUES (?, ?, ?)
             """, (user_id, "SUBSCRIPTION_RESET", "Subscription reset by admin"))
 
+            SyncStateService.mark_dirty(cursor, user_id, SyncStateService.STATE_INACTIVE)
+
             conn.commit()
 
+        event_bus.publish(EVENT_SUBSCRIPTION_CHANGED, user_id=user_id)
+
         flash('Подписка пользователя обнулена', 'success')
 
     except Exception as e:
@@ -540,16 +490,11 @@ def servers_list():
         for server in servers:
             # Получаем статус сервера
             if server['is_active']:
-                status = ServerService.get_server_status(server)
+                status = server_status_cache.get(server)
                 server['status'] = status
             else:
                 server['status'] = {'error': 'Сервер отключен'}
-
-            # Подсчитываем пользователей
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM users WHERE server_id = ?", (server['id'],))
-                server['user_count'] = cursor.fetchone()[0]
+            server['breaker'] = circuit_breakers.snapshot(server['id'])
 
         # Статистика серверов
         online_count = sum(1 for s in servers if s['is_active'] and not s['status'].get('error'))
@@ -592,13 +537,18 @@ def add_server():
         domain = request.form.get('domain', '').strip()
         api_url = request.form.get('api_url', '').strip()
         api_token = request.form.get('api_token', '').strip()
+        capacity = request.form.get('capacity', type=int) or 0
 
         # Валидация
         if not all([name, domain, api_url, api_token]):
             flash('Все поля обязательны для заполнения', 'error')
             return render_template('servers/add.html')
 
-        success, message = ServerService.create_server(name, domain, api_url, api_token)
+        if capacity < 0:
+            flash('Емкость сервера не может быть отрицательной', 'error')
+            return render_template('servers/add.html')
+
+        success, message = ServerService.create_server(name, domain, api_url, api_token, capacity)
 
         if success:
             flash(f'Сервер успешно добавлен: {message}', 'success')
@@ -618,11 +568,11 @@ def server_details(server_id):
             flash('Сервер не найден', 'error')
             return redirect(url_for('admin.servers_list'))
 
-        # Получаем статус сервера
-        status = ServerService.get_server_status(server)
+        # Получаем статус сервера из кэша
+        status = server_status_cache.get(server)
 
         # Получаем пользователей на сервере
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 SELECT u.*, (u.subscription_end > ?) as is_subscription_active
@@ -630,15 +580,19 @@ def server_details(server_id):
                 WHERE u.server_id = ?
                 ORDER BY u.subscription_end DESC
                 LIMIT 50
-            """, (datetime.now(), server_id))
+            """, (now_timestamp(), server_id))
             server_users = [dict(row) for row in cursor.fetchall()]
 
-            # Подсчитываем общее количество пользователей
-            cursor.execute("SELECT COUNT(*) FROM users WHERE server_id = ?", (server_id,))
-            server['user_count'] = cursor.fetchone()[0]
+        # Задержка и нагрузка по сохраненным метрикам, без обращения к серверу
+        metrics = server_metrics.get_summary(server_id)
+        metrics_history = server_metrics.get_history(server_id)
+        for point in metrics_history:
+            point['time'] = format_timestamp(point['bucket_start'], '%d.%m %H:%M')
 
-        # Время ответа (можно добавить измерение)
-        response_time = None
+        # Время ответа при последней проверке
+        response_time = server_status_cache.get_response_time(server_id)
+        if response_time is None and metrics:
+            response_time = metrics['latency_p50']
         current_time = datetime.now()
 
         return render_template('servers/status.html',
@@ -646,6 +600,9 @@ def server_details(server_id):
                                status=status,
                                server_users=server_users,
                                response_time=response_time,
+                               breaker=circuit_breakers.snapshot(server_id),
+                               metrics=metrics,
+                               metrics_history=metrics_history,
                                current_time=current_time)
 
     except Exception as e:
@@ -668,13 +625,18 @@ def edit_server(server_id):
             domain = request.form.get('domain', '').strip()
             api_url = request.form.get('api_url', '').strip()
             api_token = request.form.get('api_token', '').strip()
+            capacity = request.form.get('capacity', type=int)
 
             # Валидация
             if not all([name, domain, api_url, api_token]):
                 flash('Все поля обязательны для заполнения', 'error')
                 return render_template('servers/edit.html', server=server)
 
-            success, message = ServerService.update_server(server_id, name, domain, api_url, api_token)
+            if capacity is not None and capacity < 0:
+                flash('Емкость сервера не может быть отрицательной', 'error')
+                return render_template('servers/edit.html', server=server)
+
+            success, message = ServerService.update_server(server_id, name, domain, api_url, api_token, capacity)
 
             if success:
                 flash(f'Сервер успешно обновлен: {message}', 'success')
@@ -787,11 +749,149 @@ def test_server_connection():
         }), 500
 
 
+@admin_bp.route('/servers/<int:server_id>/reconcile', methods=['POST'])
+def reconcile_server(server_id):
+    """Сверка списка пользователей сервера с БД"""
+    try:
+        server = ServerService.get_server_by_id(server_id)
+        if not server:
+            return jsonify({"success": False, "error": "Сервер не найден"}), 404
+
+        result = ReconcileService.reconcile_server(server)
+        if result is None:
+            return jsonify({"success": False, "error": "Не удалось получить список пользователей сервера"}), 502
+
+        event_bus.publish(EVENT_OUTBOX_CHANGED, server_id=server_id)
+
+        return jsonify({
+            "success": True,
+            "message": f"На сервере {result['on_server']}, ожидается {result['expected']}: "
+                       f"добавление {result['added']}, удаление {result['removed']}"
+        })
+
+    except Exception as e:
+        logger.error(f"Ошибка сверки сервера {server_id}: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route('/servers/<int:server_id>/breaker/reset', methods=['POST'])
+def reset_server_breaker(server_id):
+    """Сброс автомата защиты запросов к серверу"""
+    try:
+        server = ServerService.get_server_by_id(server_id)
+        if not server:
+            return jsonify({"success": False, "error": "Сервер не найден"}), 404
+
+        circuit_breakers.get(server).reset()
+        logger.info(f"Автомат сервера {server['name']} сброшен вручную")
+        return jsonify({"success": True, "message": "Запросы к серверу разрешены"})
+
+    except Exception as e:
+        logger.error(f"Ошибка сброса автомата сервера {server_id}: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route('/servers/<int:server_id>/links/reset', methods=['POST'])
+def reset_server_links(server_id):
+    """Сброс сохраненных ссылок подключения (после перевыпуска ключей на сервере)"""
+    try:
+        if not VpnLinkService.invalidate_server(server_id):
+            return jsonify({"success": False, "error": "Сервер не найден"}), 404
+
+        logger.info(f"Сохраненные ссылки пользователей сервера {server_id} сброшены")
+        return jsonify({"success": True, "message": "Ссылки будут получены с сервера заново"})
+
+    except Exception as e:
+        logger.error(f"Ошибка сброса ссылок сервера {server_id}: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@admin_bp.route('/servers/migrations')
+def servers_migrations():
+    """Миграции пользователей между серверами"""
+    try:
+        servers = ServerService.get_all_servers()
+        migrations = MigrationService.get_migrations()
+        server_names = {server['id']: server['name'] for server in servers}
+        for migration in migrations:
+            migration['source_names'] = [server_names.get(server_id, f"#{server_id}")
+                                         for server_id in migration['source_servers']]
+
+        return render_template('servers/migrations.html', servers=servers, migrations=migrations)
+
+    except Exception as e:
+        logger.error(f"Ошибка загрузки миграций: {e}")
+        flash(f'Ошибка загрузки миграций: {str(e)}', 'error')
+        return redirect(url_for('admin.servers_list'))
+
+
+def _plan_migration_from_request():
+    """План миграции по параметрам JSON запроса"""
+    data = request.get_json() or {}
+    try:
+        sources = [int(server_id) for server_id in data.get('source_servers', [])]
+        targets = [int(server_id) for server_id in data.get('target_servers', [])]
+    except (TypeError, ValueError):
+        return False, "Некорректный список серверов", None
+
+    return MigrationService.plan(data.get('mode', MigrationService.MODE_REBALANCE), sources, targets or None)
+
+
+@admin_bp.route('/servers/migrations/plan', methods=['POST'])
+def plan_servers_migration():
+    """Предварительный расчет миграции (без изменений)"""
+    success, message, plan = _plan_migration_from_request()
+    if not success:
+        return jsonify({"success": False, "error": message}), 400
+
+    plan.pop('moves')
+    return jsonify({"success": True, "message": message, "plan": plan})
+
+
+@admin_bp.route('/servers/migrations', methods=['POST'])
+def start_servers_migration():
+    """Запуск миграции (план пересчитывается на момент запуска)"""
+    success, message, plan = _plan_migration_from_request()
+    if success:
+        success, message, migration_id = MigrationService.create(plan)
+    if not success:
+        return jsonify({"success": False, "error": message}), 400
+
+    event_bus.publish(EVENT_MIGRATION_CHANGED, migration_id=migration_id)
+    return jsonify({"success": True, "message": message, "migration_id": migration_id})
+
+
+@admin_bp.route('/servers/migrations/<int:migration_id>/<action>', methods=['POST'])
+def change_servers_migration(migration_id, action):
+    """Приостановка, возобновление или отмена миграции"""
+    statuses = {
+        'pause': MigrationService.STATUS_PAUSED,
+        'resume': MigrationService.STATUS_RUNNING,
+        'cancel': MigrationService.STATUS_CANCELLED
+    }
+    if action not in statuses:
+        return jsonify({"success": False, "error": "Неизвестное действие"}), 404
+
+    success, message = MigrationService.set_status(migration_id, statuses[action])
+    if not success:
+        return jsonify({"success": False, "error": message}), 400
+
+    event_bus.publish(EVENT_MIGRATION_CHANGED, migration_id=migration_id)
+    return jsonify({"success": True, "message": message})
+
+
 @admin_bp.route('/servers/refresh-statuses', methods=['POST'])
 def refresh_servers_statuses():
     """Обновление статусов всех серверов"""
     try:
-        return jsonify({"success": True, "message": "Статусы обновлены"})
+        # Параллельная проверка всех активных серверов в обход кэша
+        online, offline = server_status_cache.refresh(ServerService.get_active_servers())
+        return jsonify({
+            "success": True,
+            "message": "Статусы обновлены",
+            "online": online,
+            "offline": offline
+        })
     except Exception as e:
         logger.error(f"Ошибка обновления статусов серверов: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -987,7 +1087,7 @@ def toggle_promocode_status(promocode_id):
 def promocode_details(promocode_id):
     """Получение детальной информации о промокоде"""
     try:
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
 
             # Получаем промокод
@@ -999,7 +1099,7 @@ def promocode_details(promocode_id):
 
             promocode = dict(promocode)
             promocode['duration_human'] = seconds_to_human_readable(promocode['duration_seconds'])
-            promocode['created_at'] = promocode['created_at'].strftime('%d.%m.%Y %H:%M:%S')
+            promocode['created_at'] = format_timestamp(promocode['created_at'])
 
             # Получаем историю активаций
             cursor.execute("""
@@ -1014,7 +1114,7 @@ def promocode_details(promocode_id):
             activations = []
             for row in cursor.fetchall():
                 activation = dict(row)
-                activation['activated_at'] = activation['activated_at'].strftime('%d.%m.%Y %H:%M:%S')
+                activation['activated_at'] = format_timestamp(activation['activated_at'])
                 activations.append(activation)
 
         return jsonify({
@@ -1072,4 +1172,10 @@ def utility_processor():
         'timedelta': timedelta,
         'seconds_to_human_readable': seconds_to_human_readable,
         'current_time': datetime.now()
-    }
\ No newline at end of file
+    }
+
+
+@admin_bp.app_template_filter('format_timestamp')
+def format_timestamp_filter(value, fmt: str = '%d.%m.%Y %H:%M:%S'):
+    """Дата из БД (секунды Unix) в шаблоне: {{ user.created_at|format_timestamp('%d.%m.%Y') }}"""
+    return format_timestamp(value, fmt)
\ No newline at end of file
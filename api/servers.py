@@ -1,6 +1,11 @@
 from flask import Blueprint, request, jsonify
 from services.server_service import ServerService
+from services.reconcile_service import ReconcileService
+from services.status_cache import server_status_cache
+from services.circuit_breaker import circuit_breakers
+from utils.event_bus import event_bus, EVENT_OUTBOX_CHANGED
 from utils.validators import validate_server_data
+from utils.helpers import decode_timestamps
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,18 +19,12 @@ def get_all_servers():
     try:
         servers = ServerService.get_all_servers()
 
-        # Добавляем статистику для каждого сервера
+        # Добавляем статистику для каждого сервера (статус из кэша)
         for server in servers:
-            status = ServerService.get_server_status(server)
+            decode_timestamps(server)
+            status = server_status_cache.get(server)
             server['status'] = status
 
-            # Подсчитываем количество пользователей на сервере
-            from database.connection import db_manager
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM users WHERE server_id = ?", (server['id'],))
-                server['user_count'] = cursor.fetchone()[0]
-
         return jsonify({
             "success": True,
             "servers": servers
@@ -43,7 +42,7 @@ def get_all_servers():
 def get_active_servers():
     """Получение списка активных серверов"""
     try:
-        servers = ServerService.get_active_servers()
+        servers = [decode_timestamps(server) for server in ServerService.get_active_servers()]
 
         return jsonify({
             "success": True,
@@ -70,16 +69,11 @@ def get_server(server_id):
                 "error": "Сервер не найден"
             }), 404
 
-        # Получаем статус сервера
-        status = ServerService.get_server_status(server)
+        # Получаем статус сервера из кэша
+        decode_timestamps(server)
+        status = server_status_cache.get(server)
         server['status'] = status
-
-        # Подсчитываем количество пользователей
-        from database.connection import db_manager
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users WHERE server_id = ?", (server_id,))
-            server['user_count'] = cursor.fetchone()[0]
+        server['breaker'] = circuit_breakers.snapshot(server_id)
 
         return jsonify({
             "success": True,
@@ -118,7 +112,14 @@ def create_server():
                 "error": validation_message
             }), 400
 
-        success, message = ServerService.create_server(name, domain, api_url, api_token)
+        capacity = data.get('capacity')
+        if capacity is not None and (not isinstance(capacity, int) or capacity < 0):
+            return jsonify({
+                "success": False,
+                "error": "Емкость сервера должна быть неотрицательным целым числом"
+            }), 400
+
+        success, message = ServerService.create_server(name, domain, api_url, api_token, capacity or 0)
 
         if success:
             return jsonify({
@@ -163,7 +164,14 @@ def update_server(server_id):
                 "error": validation_message
             }), 400
 
-        success, message = ServerService.update_server(server_id, name, domain, api_url, api_token)
+        capacity = data.get('capacity')
+        if capacity is not None and (not isinstance(capacity, int) or capacity < 0):
+            return jsonify({
+                "success": False,
+                "error": "Емкость сервера должна быть неотрицательным целым числом"
+            }), 400
+
+        success, message = ServerService.update_server(server_id, name, domain, api_url, api_token, capacity)
 
         if success:
             return jsonify({
@@ -246,7 +254,9 @@ def get_server_status(server_id):
                 "error": "Сервер не найден"
             }), 404
 
-        status = ServerService.get_server_status(server)
+        # Явный запрос статуса - проверяем сервер и обновляем кэш
+        server_status_cache.refresh([server])
+        status = server_status_cache.get(server)
 
         return jsonify({
             "success": True,
@@ -263,6 +273,45 @@ def get_server_status(server_id):
         }), 500
 
 
+@servers_bp.route('/<int:server_id>/reconcile', methods=['POST'])
+def reconcile_server(server_id):
+    """Сверка списка пользователей сервера с БД"""
+    try:
+        server = ServerService.get_server_by_id(server_id)
+
+        if not server:
+            return jsonify({
+                "success": False,
+                "error": "Сервер не найден"
+            }), 404
+
+        result = ReconcileService.reconcile_server(server)
+
+        if result is None:
+            return jsonify({
+                "success": False,
+                "error": "Не удалось получить список пользователей сервера"
+            }), 502
+
+        event_bus.publish(EVENT_OUTBOX_CHANGED, server_id=server_id)
+
+        return jsonify({
+            "success": True,
+            "server_id": server_id,
+            "on_server": result['on_server'],
+            "expected": result['expected'],
+            "added": result['added'],
+            "removed": result['removed']
+        })
+
+    except Exception as e:
+        logger.error(f"Ошибка сверки сервера: {e}")
+        return jsonify({
+            "success": False,
+            "error": "Внутренняя ошибка сервера"
+        }), 500
+
+
 @servers_bp.route('/least-loaded', methods=['GET'])
 def get_least_loaded_server():
     """Получение наименее загруженного сервера"""
@@ -277,7 +326,7 @@ def get_least_loaded_server():
 
         return jsonify({
             "success": True,
-            "server": server
+            "server": decode_timestamps(server)
         })
 
     except Exception as e:
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from services.subscription_service import SubscriptionService
 from utils.validators import validate_promocode_data, validate_telegram_id
-from utils.helpers import seconds_to_human_readable
+from utils.helpers import seconds_to_human_readable, decode_timestamps
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,6 +17,7 @@ def get_all_promocodes():
 
         # Добавляем человекочитаемую продолжительность
         for promo in promocodes:
+            decode_timestamps(promo)
             promo['duration_human'] = seconds_to_human_readable(promo['duration_seconds'])
             promo['remaining_activations'] = promo['max_activations'] - promo['current_activations']
 
@@ -41,6 +42,7 @@ def get_active_promocodes():
 
         # Добавляем человекочитаемую продолжительность
         for promo in promocodes:
+            decode_timestamps(promo)
             promo['duration_human'] = seconds_to_human_readable(promo['duration_seconds'])
             promo['remaining_activations'] = promo['max_activations'] - promo['current_activations']
 
@@ -212,6 +214,7 @@ def get_user_subscription_history(telegram_id):
 
         # Добавляем человекочитаемую продолжительность
         for record in history:
+            decode_timestamps(record)
             record['duration_human'] = seconds_to_human_readable(record['duration_seconds'])
 
         return jsonify({
@@ -234,7 +237,7 @@ def validate_promocode(code):
         code = code.strip().upper()
 
         from database.connection import db_manager
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT * FROM promocodes 
@@ -2,6 +2,8 @@ from flask import Blueprint, request, jsonify
 from services.user_service import UserService
 from services.subscription_service import SubscriptionService
 from utils.validators import validate_telegram_id, validate_subscription_duration
+from utils.helpers import from_timestamp, decode_timestamps, decode_cursor
+from config import Config
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,6 +11,65 @@ logger = logging.getLogger(__name__)
 users_bp = Blueprint('users', __name__, url_prefix='/api/users')
 
 
+@users_bp.route('/', methods=['GET'])
+def list_users():
+    """Постраничный список пользователей (новые первыми).
+
+    Параметры: limit, cursor (next_cursor предыдущего ответа), status
+    (active/expired), server (ID сервера), search (Telegram ID / email).
+    total - итог по фильтрам из счетчиков или кэша, может немного отставать.
+    """
+    try:
+        limit = request.args.get('limit', Config.USERS_API_PAGE_SIZE, type=int)
+        cursor = request.args.get('cursor')
+        status = request.args.get('status', '')
+        server_id = request.args.get('server', type=int)
+        search = request.args.get('search', '').strip()
+
+        if not 1 <= limit <= Config.USERS_API_MAX_PAGE_SIZE:
+            return jsonify({
+                "success": False,
+                "error": f"limit должен быть от 1 до {Config.USERS_API_MAX_PAGE_SIZE}"
+            }), 400
+
+        if cursor and decode_cursor(cursor) is None:
+            return jsonify({
+                "success": False,
+                "error": "Некорректный курсор"
+            }), 400
+
+        if status not in ('', 'active', 'expired'):
+            return jsonify({
+                "success": False,
+                "error": "Некорректный статус"
+            }), 400
+
+        page = UserService.list_users(search, status, server_id, after=cursor, limit=limit)
+
+        return jsonify({
+            "success": True,
+            "users": [{
+                "id": user['id'],
+                "telegram_id": user['telegram_id'],
+                "email": user['email'],
+                "server_id": user['server_id'],
+                "server_name": user.get('server_name'),
+                "subscription_end": from_timestamp(user['subscription_end']).isoformat(),
+                "is_subscription_active": user['is_subscription_active'],
+                "created_at": from_timestamp(user['created_at']).isoformat()
+            } for user in page['users']],
+            "next_cursor": page['next_cursor'],
+            "total": UserService.count_users(search, status, server_id)
+        })
+
+    except Exception as e:
+        logger.error(f"Ошибка получения списка пользователей: {e}")
+        return jsonify({
+            "success": False,
+            "error": "Внутренняя ошибка сервера"
+        }), 500
+
+
 @users_bp.route('/check/<telegram_id>', methods=['GET'])
 def check_user_exists(telegram_id):
     """Проверка существования пользователя"""
@@ -67,7 +128,7 @@ def register_user():
             return jsonify({
                 "success": True,
                 "message": message,
-                "user": user_data
+                "user": decode_timestamps(user_data)
             })
         else:
             return jsonify({
@@ -113,12 +174,12 @@ def get_user_info(telegram_id):
             "user": {
                 "telegram_id": user['telegram_id'],
                 "email": user['email'],
-                "subscription_end": user['subscription_end'].isoformat(),
+                "subscription_end": from_timestamp(user['subscription_end']).isoformat(),
                 "is_subscription_active": user['is_subscription_active'],
                 "server_name": user.get('server_name'),
                 "server_domain": user.get('server_domain'),
                 "vpn_config": vpn_config,
-                "created_at": user['created_at'].isoformat()
+                "created_at": from_timestamp(user['created_at']).isoformat()
             }
         })
 
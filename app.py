@@ -57,6 +57,18 @@ def create_app():
     except ImportError as e:
         logging.error(f"Ошибка импорта маршрутов: {e}")
 
+    # Соединение с БД берется из пула при первом обращении и возвращается после запроса
+    from database.connection import db_manager
+    from database.migrations import SchemaMigrator
+
+    @app.before_request
+    def hold_db_connection():
+        db_manager.begin_scope()
+
+    @app.teardown_request
+    def release_db_connection(error=None):
+        db_manager.end_scope()
+
     @app.route('/')
     def index():
         """Перенаправление на админ-панель"""
@@ -69,7 +81,9 @@ def create_app():
             "service": "VPN Admin Panel",
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
-            "version": "2.0"
+            "version": "2.0",
+            "database_pool": db_manager.get_pool_stats(),
+            "schema": SchemaMigrator.get_status()
         })
 
     @app.errorhandler(404)
@@ -116,17 +130,54 @@ def init_database():
 
 
 def start_monitoring():
-    """Запуск мониторинга подписок"""
+    """Запуск мониторинга подписок и автосписаний.
+
+    Можно вызывать в каждом процессе: задачи выполняет только процесс,
+    удерживающий аренду лидерства, остальные подхватывают их при его падении.
+    """
     try:
+        from background.leader import leader_elector
         from background.subscription_monitor import subscription_monitor
-        subscription_monitor.start()
-        logging.info("Мониторинг подписок запущен")
+        from background.migration_runner import migration_runner
+        from payments.base import scheduler
+
+        def on_elected():
+            subscription_monitor.start()
+            migration_runner.start()
+            scheduler.resume()
+
+        def on_demoted():
+            scheduler.pause()
+            migration_runner.stop()
+            subscription_monitor.stop()
+
+        leader_elector.add_callbacks(
+            on_elected=on_elected,
+            on_demoted=on_demoted,
+            # Задачи, добавленные другими процессами, попадают в общее хранилище - перечитываем его
+            on_heartbeat=scheduler.wakeup
+        )
+        leader_elector.start()
+        logging.info("Выбор ведущего процесса для мониторинга запущен")
         return True
     except Exception as e:
         logging.error(f"Ошибка запуска мониторинга: {e}")
         return False
 
 
+def start_status_prober():
+    """Запуск фоновой проверки статусов серверов и сохранения метрик (в каждом процессе)"""
+    try:
+        from background.status_prober import server_status_prober
+        from background.metrics_flusher import metrics_flusher
+        server_status_prober.start()
+        metrics_flusher.start()
+        return True
+    except Exception as e:
+        logging.error(f"Ошибка запуска проверки статусов серверов: {e}")
+        return False
+
+
 def main():
     """Главная функция запуска сервиса"""
     try:
@@ -153,6 +204,10 @@ def main():
         if not start_monitoring():
             logger.warning("Мониторинг подписок не запущен, но сервис продолжит работу")
 
+        # Запуск фоновой проверки статусов серверов
+        if not start_status_prober():
+            logger.warning("Проверка статусов серверов не запущена, статусы будут обновляться по запросу")
+
         # Получаем конфигурацию
         try:
             from config import Config
@@ -187,14 +242,22 @@ def main():
         import traceback
         traceback.print_exc()
     finally:
-        # Остановка мониторинга
+        # Остановка мониторинга с освобождением аренды
         try:
-            from background.subscription_monitor import subscription_monitor
-            subscription_monitor.stop()
+            from background.leader import leader_elector
+            leader_elector.stop()
             logger.info("Мониторинг подписок остановлен")
         except:
             pass
 
+        try:
+            from background.status_prober import server_status_prober
+            from background.metrics_flusher import metrics_flusher
+            server_status_prober.stop()
+            metrics_flusher.stop()
+        except:
+            pass
+
         logger.info("VPN Admin Panel остановлен")
         logger.info("=" * 50)
 
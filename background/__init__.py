@@ -3,5 +3,14 @@
 """
 
 from .subscription_monitor import subscription_monitor, SubscriptionMonitor
+from .node_dispatcher import NodeDispatcher
+from .outbox_processor import OutboxProcessor
+from .leader import leader_elector, LeaderElector
+from .shard_workers import ShardPool
+from .status_prober import server_status_prober, ServerStatusProber
+from .metrics_flusher import metrics_flusher, MetricsFlusher
+from .migration_runner import migration_runner, MigrationRunner
 
-__all__ = ['subscription_monitor', 'SubscriptionMonitor']
\ No newline at end of file
+__all__ = ['subscription_monitor', 'SubscriptionMonitor', 'NodeDispatcher', 'OutboxProcessor',
+           'leader_elector', 'LeaderElector', 'ShardPool', 'server_status_prober', 'ServerStatusProber',
+           'metrics_flusher', 'MetricsFlusher', 'migration_runner', 'MigrationRunner']
\ No newline at end of file
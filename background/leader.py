@@ -0,0 +1,137 @@
+import os
+import socket
+import time
+import uuid
+import threading
+from typing import Callable, List
+from database.connection import db_manager
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """Выбор ведущего процесса через аренду в общей БД.
+
+    Каждый процесс периодически пытается захватить или продлить строку аренды.
+    Захватить можно только свободную или просроченную аренду, поэтому фоновые
+    задачи выполняются ровно в одном процессе, а при его падении переходят
+    к другому через LEADER_LEASE_TTL секунд.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._on_elected: List[Callable] = []
+        self._on_demoted: List[Callable] = []
+        self._on_heartbeat: List[Callable] = []
+
+    def add_callbacks(self, on_elected: Callable = None, on_demoted: Callable = None,
+                      on_heartbeat: Callable = None):
+        """Регистрация действий при получении и потере лидерства"""
+        if on_elected:
+            self._on_elected.append(on_elected)
+        if on_demoted:
+            self._on_demoted.append(on_demoted)
+        if on_heartbeat:
+            self._on_heartbeat.append(on_heartbeat)
+
+    def start(self):
+        """Запуск участия в выборах"""
+        if self.running:
+            logger.warning("Выбор ведущего процесса уже запущен")
+            return
+
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._election_loop, daemon=True)
+        self.thread.start()
+        logger.info(f"Процесс {self.holder_id} участвует в выборе ведущего ({self.name})")
+
+    def stop(self):
+        """Остановка участия в выборах с освобождением аренды"""
+        self.running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+        if self.is_leader:
+            self._demote()
+            self._release()
+
+    def _election_loop(self):
+        """Цикл захвата и продления аренды"""
+        while self.running:
+            try:
+                acquired = self._try_acquire()
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды {self.name}: {e}")
+                acquired = False
+
+            if acquired and not self.is_leader:
+                self._elect()
+            elif not acquired and self.is_leader:
+                self._demote()
+            elif acquired:
+                self._run_callbacks(self._on_heartbeat)
+
+            self._stop_event.wait(Config.LEADER_HEARTBEAT_INTERVAL)
+
+    def _try_acquire(self) -> bool:
+        """Захват свободной или просроченной аренды либо продление своей"""
+        now = time.time()
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO leader_leases (name, holder, expires_at, heartbeat_at, acquired_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    holder = excluded.holder,
+                    expires_at = excluded.expires_at,
+                    heartbeat_at = excluded.heartbeat_at,
+                    acquired_at = CASE WHEN leader_leases.holder = excluded.holder
+                                       THEN leader_leases.acquired_at ELSE excluded.acquired_at END
+                WHERE leader_leases.holder = excluded.holder OR leader_leases.expires_at < excluded.heartbeat_at
+                RETURNING holder
+            ''', (self.name, self.holder_id, now + Config.LEADER_LEASE_TTL, now, now))
+            acquired = cursor.fetchone() is not None
+            conn.commit()
+            return acquired
+
+    def _release(self):
+        """Освобождение аренды, чтобы другой процесс захватил ее без ожидания"""
+        try:
+            with db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM leader_leases WHERE name = ? AND holder = ?",
+                               (self.name, self.holder_id))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка освобождения аренды {self.name}: {e}")
+
+    def _elect(self):
+        self.is_leader = True
+        logger.info(f"Процесс {self.holder_id} стал ведущим ({self.name})")
+        self._run_callbacks(self._on_elected)
+
+    def _demote(self):
+        self.is_leader = False
+        logger.warning(f"Процесс {self.holder_id} больше не ведущий ({self.name})")
+        self._run_callbacks(self._on_demoted)
+
+    @staticmethod
+    def _run_callbacks(callbacks: List[Callable]):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка обработчика смены ведущего процесса: {e}")
+
+
+# Глобальный экземпляр: фоновые задачи сервиса выполняет один процесс
+leader_elector = LeaderElector('background')
@@ -0,0 +1,49 @@
+import threading
+from services.metrics_service import server_metrics
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsFlusher:
+    """Периодическое сохранение метрик серверов из буферов процесса в БД"""
+
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Запуск сохранения метрик"""
+        if self.running:
+            return
+
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Остановка с сохранением накопленных метрик"""
+        self.running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(Config.METRICS_FLUSH_INTERVAL):
+            try:
+                server_metrics.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения метрик серверов: {e}")
+
+        # При остановке сохраняем и незавершенную минуту: после нее буферы процесса теряются
+        try:
+            server_metrics.flush(include_current=True)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения метрик серверов при остановке: {e}")
+
+
+# Глобальный экземпляр сохранения метрик
+metrics_flusher = MetricsFlusher()
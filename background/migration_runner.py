@@ -0,0 +1,175 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from services.migration_service import MigrationService
+from services.outbox_service import OutboxService
+from services.server_placement import server_placement
+from services.server_service import ServerService
+from services.sync_state_service import SyncStateService
+from services.user_service import UserService
+from services.vpn_link_service import VpnLinkService
+from database.connection import db_manager
+from utils.event_bus import event_bus, EVENT_MIGRATION_CHANGED
+from utils.helpers import now_timestamp
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationRunner:
+    """Выполнение переносов пользователей между серверами (в ведущем процессе).
+
+    Перенос: добавление на целевой сервер, смена server_id, удаление с
+    исходного сервера. Одновременных запросов к одному серверу не больше
+    MIGRATION_NODE_CONCURRENCY, статус миграции проверяется перед каждой
+    пачкой, поэтому пауза и отмена вступают в силу после текущей пачки.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self._wakeup = threading.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._node_slots: Dict[int, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запуск выполнения миграций"""
+        if self.running:
+            return
+
+        self.running = True
+        self._wakeup.clear()
+        self._executor = ThreadPoolExecutor(max_workers=Config.MIGRATION_WORKERS, thread_name_prefix="migration")
+        event_bus.subscribe(EVENT_MIGRATION_CHANGED, self._on_event)
+        self.thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.thread.start()
+        logger.info("Выполнение миграций запущено")
+
+    def stop(self):
+        """Остановка после текущей пачки переносов"""
+        self.running = False
+        event_bus.unsubscribe(EVENT_MIGRATION_CHANGED, self._on_event)
+        self._wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=30)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        logger.info("Выполнение миграций остановлено")
+
+    def _on_event(self, event: str, **data):
+        self._wakeup.set()
+
+    def _run_loop(self):
+        while self.running:
+            delay = Config.MIGRATION_POLL_INTERVAL
+            try:
+                migration = MigrationService.get_next_running()
+                if migration:
+                    delay = self._run_batch(migration)
+            except Exception as e:
+                logger.error(f"Ошибка выполнения миграции: {e}")
+
+            if delay:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+
+    def _run_batch(self, migration: Dict) -> float:
+        """Выполнение пачки переносов. Возвращает паузу до следующего прохода"""
+        moves = MigrationService.claim_moves(migration['id'], Config.MIGRATION_BATCH_SIZE)
+        if not moves:
+            if MigrationService.complete_if_done(migration['id']):
+                logger.info(f"Миграция {migration['id']} завершена")
+            return 0
+
+        servers = {}
+        for server_id in {move['to_server_id'] for move in moves} | {move['from_server_id'] for move in moves}:
+            servers[server_id] = ServerService.get_server_by_id(server_id)
+
+        results = list(self._executor.map(lambda move: self._move_user(move, servers), moves))
+
+        moved = sum(1 for status in results if status == MigrationService.MOVE_DONE)
+        logger.info(f"Миграция {migration['id']}: перенесено {moved} из {len(moves)}")
+
+        # Ни одного успешного переноса - серверы, вероятно, недоступны, повторим позже
+        if moved == 0 and MigrationService.MOVE_SKIPPED not in results:
+            return Config.MIGRATION_RETRY_DELAY
+        return 0
+
+    def _move_user(self, move: Dict, servers: Dict[int, Optional[Dict]]) -> str:
+        """Перенос одного пользователя. Возвращает итоговый статус переноса"""
+        try:
+            status, error = self._apply_move(move, servers)
+        except Exception as e:
+            status, error = MigrationService.MOVE_PENDING, str(e)
+
+        try:
+            MigrationService.finish_move(move, status, error)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения результата переноса {move['id']}: {e}")
+        return status
+
+    def _apply_move(self, move: Dict, servers: Dict[int, Optional[Dict]]):
+        user = UserService.get_user_by_id(move['user_id'])
+        if not user or user['server_id'] != move['from_server_id']:
+            return MigrationService.MOVE_SKIPPED, "Пользователь удален или уже перенесен"
+
+        target = servers.get(move['to_server_id'])
+        if not target or not target['is_active']:
+            return MigrationService.MOVE_PENDING, f"Целевой сервер {move['to_server_id']} недоступен"
+
+        active = user['is_subscription_active']
+        vpn_data = None
+        if active:
+            with self._node_slot(target['id']):
+                vpn_data = ServerService.ensure_user_on_vpn_server(target, user['uuid'], user['email'])
+            if not vpn_data:
+                return MigrationService.MOVE_PENDING, f"Не удалось добавить пользователя на сервер {target['name']}"
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET server_id = ?, updated_at = ? WHERE id = ? AND server_id = ?",
+                           (target['id'], now_timestamp(), user['id'], move['from_server_id']))
+            if cursor.rowcount == 0:
+                conn.commit()
+                return MigrationService.MOVE_SKIPPED, "Пользователь перенесен другим процессом"
+
+            cursor.execute('''
+                INSERT INTO user_activity_log (user_id, action, details)
+                VALUES (?, ?, ?)
+            ''', (user['id'], "USER_MIGRATED", f"Server {move['from_server_id']} -> {target['name']}"))
+            conn.commit()
+
+        server_placement.move(move['from_server_id'], target['id'])
+
+        if active:
+            SyncStateService.record_state(user['id'], target['id'], SyncStateService.STATE_ACTIVE, user['uuid'])
+            VpnLinkService.save(user['id'], target['id'], user['uuid'], vpn_data)
+
+            source = servers.get(move['from_server_id'])
+            removed = False
+            if source:
+                with self._node_slot(source['id']):
+                    removed = ServerService.remove_user_from_vpn_server(source, user['uuid'])
+
+            # Не удалось удалить сразу - удаление повторит очередь операций
+            if not removed:
+                OutboxService.enqueue_many([(None, move['from_server_id'], user['uuid'], user['email'],
+                                             OutboxService.OP_REMOVE)])
+
+        return MigrationService.MOVE_DONE, None
+
+    def _node_slot(self, server_id: int) -> threading.BoundedSemaphore:
+        """Ограничитель одновременных запросов миграции к серверу"""
+        with self._lock:
+            slot = self._node_slots.get(server_id)
+            if slot is None:
+                slot = threading.BoundedSemaphore(Config.MIGRATION_NODE_CONCURRENCY)
+                self._node_slots[server_id] = slot
+            return slot
+
+
+# Глобальный экземпляр выполнения миграций
+migration_runner = MigrationRunner()
@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class NodeDispatcher:
+    """Параллельное выполнение операций с VPN серверами.
+
+    У каждого сервера свой пул потоков с ограниченным числом воркеров,
+    поэтому медленный сервер не занимает потоки остальных серверов.
+    Операции одного сервера выполняются параллельно (до NODE_MAX_CONCURRENCY)
+    и завершаются в произвольном порядке: очередность операций с одним
+    пользователем обеспечивает не диспетчер, а очередь vpn_outbox (одна
+    операция на пару сервер/UUID, захваченная операция не выдается повторно).
+    """
+
+    def __init__(self):
+        self._executors: Dict[Optional[int], ThreadPoolExecutor] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_concurrency(server_id: Optional[int]) -> int:
+        """Лимит одновременных запросов к серверу"""
+        return Config.NODE_CONCURRENCY_OVERRIDES.get(server_id, Config.NODE_MAX_CONCURRENCY)
+
+    def _get_executor(self, server_id: Optional[int]) -> ThreadPoolExecutor:
+        """Получение (или создание) пула потоков сервера"""
+        with self._lock:
+            executor = self._executors.get(server_id)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=self.get_concurrency(server_id),
+                    thread_name_prefix=f"node-{server_id}"
+                )
+                self._executors[server_id] = executor
+            return executor
+
+    def submit(self, server_id: Optional[int], func: Callable, *args) -> Future:
+        """Постановка операции в очередь сервера"""
+        return self._get_executor(server_id).submit(func, *args)
+
+    def run_batch(self, operations: Iterable[Tuple[Optional[int], Callable, tuple]],
+                  deadline: float = None) -> Tuple[int, int]:
+        """Выполнение пачки операций с ожиданием не дольше deadline секунд.
+
+        Возвращает (завершено, не успело завершиться). Незавершенные операции
+        продолжают выполняться в фоне.
+        """
+        futures = [self.submit(server_id, func, *args) for server_id, func, args in operations]
+        if not futures:
+            return 0, 0
+
+        timeout = Config.NODE_TICK_DEADLINE if deadline is None else deadline
+        done, not_done = wait(futures, timeout=timeout)
+
+        for future in done:
+            if future.exception():
+                logger.error(f"Ошибка операции с VPN сервером: {future.exception()}")
+
+        if not_done:
+            logger.warning(f"{len(not_done)} операций с VPN серверами не завершились за {timeout} с, "
+                           f"продолжаются в фоне")
+
+        return len(done), len(not_done)
+
+    def shutdown(self):
+        """Остановка всех пулов без ожидания текущих операций"""
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,146 @@
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+from background.node_dispatcher import NodeDispatcher
+from services.outbox_service import OutboxService
+from services.server_service import ServerService
+from services.sync_state_service import SyncStateService
+from services.vpn_link_service import VpnLinkService
+from database.connection import db_manager
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxProcessor:
+    """Выполнение операций из очереди vpn_outbox на VPN серверах"""
+
+    def __init__(self, on_server_idle: Callable = None):
+        self._dispatcher = NodeDispatcher()
+        self._busy_servers: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._on_server_idle = on_server_idle
+
+        # Серверы, операции которых выполняет этот процесс (None - все серверы)
+        self.owned_servers: Optional[List[int]] = None
+
+    def drain(self) -> int:
+        """Захват готовых операций и их выполнение по серверам.
+
+        Серверы, у которых еще выполняются операции прошлого прохода,
+        пропускаются - их очередь будет захвачена после освобождения.
+        """
+        operations = OutboxService.claim_due(Config.OUTBOX_BATCH_SIZE, self._get_busy_servers(),
+                                             self.owned_servers)
+        if not operations:
+            return 0
+
+        with self._lock:
+            for operation in operations:
+                self._busy_servers[operation['server_id']] = self._busy_servers.get(operation['server_id'], 0) + 1
+
+        self._dispatcher.run_batch(
+            (operation['server_id'], self._execute, (operation,)) for operation in operations
+        )
+        return len(operations)
+
+    def seconds_until_next(self) -> Optional[float]:
+        """Время до ближайшей операции, которую можно захватить"""
+        next_at = OutboxService.next_attempt_at(self._get_busy_servers(), self.owned_servers)
+        if next_at is None:
+            return None
+        return max(0.0, next_at - time.time())
+
+    def shutdown(self):
+        """Остановка пулов выполнения"""
+        self._dispatcher.shutdown()
+
+        # Отмененные операции не освободят свои серверы, их захватят заново после аренды
+        with self._lock:
+            self._busy_servers.clear()
+
+    def _get_busy_servers(self):
+        with self._lock:
+            return list(self._busy_servers)
+
+    def _execute(self, operation: Dict):
+        """Выполнение одной операции с фиксацией результата в очереди"""
+        try:
+            error = self._apply(operation)
+        except Exception as e:
+            error = str(e)
+
+        try:
+            if error:
+                OutboxService.fail(operation, error)
+            else:
+                OutboxService.complete(operation)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения результата операции {operation['id']}: {e}")
+        finally:
+            with self._lock:
+                self._busy_servers[operation['server_id']] -= 1
+                server_idle = self._busy_servers[operation['server_id']] == 0
+                if server_idle:
+                    del self._busy_servers[operation['server_id']]
+
+            if server_idle and self._on_server_idle:
+                self._on_server_idle()
+
+    def _apply(self, operation: Dict) -> Optional[str]:
+        """Применение операции на сервере. Возвращает текст ошибки или None"""
+        server = ServerService.get_server_by_id(operation['server_id'])
+        if not server:
+            logger.warning(f"Сервер {operation['server_id']} удален, операция "
+                           f"{operation['operation']} для {operation['user_uuid']} отменена")
+            return None
+
+        user_uuid = operation['user_uuid']
+
+        if operation['operation'] == OutboxService.OP_ADD:
+            # Проверяем наличие пользователя на сервере
+            vpn_data = ServerService.get_user_from_vpn_server(server, user_uuid)
+            if vpn_data:
+                logger.debug(f"Пользователь {operation['email']} уже активен на сервере {server['name']}")
+            else:
+                vpn_data = ServerService.add_user_to_vpn_server(server, user_uuid, operation['email'])
+                if not vpn_data:
+                    return f"Не удалось добавить пользователя на сервер {server['name']}"
+
+                logger.info(f"Активирован пользователь {operation['email']} на сервере {server['name']}")
+                self._log_user_activity(operation['user_id'], "VPN_ACTIVATED", f"Added to server {server['name']}")
+
+            SyncStateService.record_state(operation['user_id'], server['id'],
+                                          SyncStateService.STATE_ACTIVE, user_uuid)
+            VpnLinkService.save(operation['user_id'], server['id'], user_uuid, vpn_data)
+        else:
+            if not ServerService.remove_user_from_vpn_server(server, user_uuid):
+                return f"Не удалось удалить пользователя с сервера {server['name']}"
+
+            if operation['user_id'] is not None:
+                if SyncStateService.record_removal(operation['user_id'], server['id'], user_uuid):
+                    logger.info(f"Удаленный пользователь {user_uuid} убран с сервера {server['name']}")
+                else:
+                    logger.info(f"Деактивирован пользователь {user_uuid} на сервере {server['name']}")
+                    self._log_user_activity(operation['user_id'], "VPN_DEACTIVATED",
+                                            f"Removed from server {server['name']}")
+
+        return None
+
+    @staticmethod
+    def _log_user_activity(user_id: Optional[int], action: str, details: str):
+        """Логирование активности пользователя в БД"""
+        if user_id is None:
+            return
+
+        try:
+            with db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO user_activity_log (user_id, action, details)
+                    VALUES (?, ?, ?)
+                ''', (user_id, action, details))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка логирования активности: {e}")
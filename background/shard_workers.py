@@ -0,0 +1,137 @@
+import time
+import logging
+import multiprocessing
+from typing import List
+from background.outbox_processor import OutboxProcessor
+from background.metrics_flusher import metrics_flusher
+from database.connection import db_manager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ShardPool:
+    """Выполнение очереди vpn_outbox в отдельных процессах.
+
+    Серверы делятся между процессами-воркерами: каждый воркер выполняет
+    операции только своих серверов, со своим подключением к БД и своими
+    пулами потоков/HTTP, поэтому медленные серверы не упираются в GIL
+    процесса монитора. Интерфейс совпадает с OutboxProcessor.
+    """
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self._context = multiprocessing.get_context('spawn')
+        self._workers: List = [None] * processes
+        self._wakeup_events: List = [None] * processes
+        self._stop_event = None
+
+    def drain(self) -> int:
+        """Запуск (при необходимости) воркеров и их пробуждение"""
+        self._ensure_workers()
+        for event in self._wakeup_events:
+            event.set()
+        return 0
+
+    def seconds_until_next(self):
+        """Повторы операций отслеживают сами воркеры"""
+        return None
+
+    def shutdown(self):
+        """Остановка воркеров"""
+        if self._stop_event is None:
+            return
+
+        self._stop_event.set()
+        for event in self._wakeup_events:
+            if event is not None:
+                event.set()
+
+        for process in self._workers:
+            if process is None:
+                continue
+            process.join(timeout=10)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не завершился, принудительная остановка")
+                process.terminate()
+
+        self._workers = [None] * self.processes
+        self._wakeup_events = [None] * self.processes
+        self._stop_event = None
+
+    def _ensure_workers(self):
+        """Запуск недостающих или упавших воркеров"""
+        if self._stop_event is None:
+            self._stop_event = self._context.Event()
+
+        for index in range(self.processes):
+            process = self._workers[index]
+            if process is not None and process.is_alive():
+                continue
+
+            if process is not None:
+                logger.error(f"Воркер {process.name} завершился с кодом {process.exitcode}, перезапуск")
+
+            self._wakeup_events[index] = self._context.Event()
+            process = self._context.Process(
+                target=run_shard_worker,
+                args=(index, self.processes, db_manager.db_path,
+                      self._wakeup_events[index], self._stop_event),
+                name=f"outbox-shard-{index}",
+                daemon=True
+            )
+            process.start()
+            self._workers[index] = process
+            logger.info(f"Запущен воркер {process.name} (pid {process.pid})")
+
+
+def get_shard_servers(index: int, count: int) -> List[int]:
+    """Серверы, закрепленные за воркером: id сервера по модулю числа воркеров.
+
+    Закрепление зависит только от id, поэтому добавление или удаление сервера
+    не переносит остальные серверы на другие воркеры (иначе до перечитывания
+    списка два воркера могли бы выполнять операции одного сервера).
+    """
+    with db_manager.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM servers WHERE id % ? = ? ORDER BY id", (count, index))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def run_shard_worker(index: int, count: int, db_path: str, wakeup_event, stop_event):
+    """Основной цикл процесса-воркера"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    db_manager.db_path = db_path
+    parent = multiprocessing.parent_process()
+
+    outbox = OutboxProcessor(on_server_idle=wakeup_event.set)
+    metrics_flusher.start()
+    last_refresh = 0.0
+
+    # Без родителя воркер не ведущий процесс - завершаемся вместе с ним
+    while not stop_event.is_set() and (parent is None or parent.is_alive()):
+        try:
+            # Новые и удаленные серверы подхватываются при перечитывании списка
+            if time.time() - last_refresh >= Config.SHARD_REFRESH_INTERVAL:
+                outbox.owned_servers = get_shard_servers(index, count)
+                last_refresh = time.time()
+
+            outbox.drain()
+
+            timeout = min(Config.SUBSCRIPTION_MAX_SLEEP, last_refresh + Config.SHARD_REFRESH_INTERVAL - time.time())
+            next_operation = outbox.seconds_until_next()
+            if next_operation is not None:
+                timeout = min(timeout, next_operation)
+
+            wakeup_event.wait(max(0.0, timeout))
+            wakeup_event.clear()
+        except Exception as e:
+            logger.error(f"Ошибка в цикле воркера {index}: {e}")
+            stop_event.wait(Config.SUBSCRIPTION_CHECK_INTERVAL * 2)
+
+    outbox.shutdown()
+    metrics_flusher.stop()
+    db_manager.close_all()
@@ -0,0 +1,54 @@
+import threading
+from services.server_service import ServerService
+from services.status_cache import server_status_cache
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ServerStatusProber:
+    """Периодическое обновление кэша статусов серверов.
+
+    Кэш хранится в памяти процесса, поэтому опрос запускается в каждом
+    процессе веб-сервера, а не только в ведущем.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Запуск фонового опроса"""
+        if self.running:
+            logger.warning("Опрос статусов серверов уже запущен")
+            return
+
+        self.running = True
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._probe_loop, daemon=True)
+        self.thread.start()
+        logger.info("Опрос статусов серверов запущен")
+
+    def stop(self):
+        """Остановка фонового опроса"""
+        self.running = False
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        logger.info("Опрос статусов серверов остановлен")
+
+    def _probe_loop(self):
+        while self.running:
+            try:
+                online, offline = server_status_cache.refresh(ServerService.get_active_servers())
+                logger.debug(f"Статусы серверов обновлены: {online} онлайн, {offline} оффлайн")
+            except Exception as e:
+                logger.error(f"Ошибка обновления статусов серверов: {e}")
+
+            self._stop_event.wait(Config.SERVER_STATUS_REFRESH_INTERVAL)
+
+
+# Глобальный экземпляр фонового опроса
+server_status_prober = ServerStatusProber()
@@ -1,10 +1,19 @@
 import time
+import heapq
+import queue
 import threading
-from datetime import datetime
-from typing import Set
+from typing import Dict, Iterable, List, Optional, Tuple
+from background.outbox_processor import OutboxProcessor
+from background.shard_workers import ShardPool
 from services.user_service import UserService
 from services.server_service import ServerService
+from services.outbox_service import OutboxService
+from services.reconcile_service import ReconcileService
+from services.sync_state_service import SyncStateService
 from database.connection import db_manager
+from utils.event_bus import event_bus, EVENT_SUBSCRIPTION_CHANGED, EVENT_OUTBOX_CHANGED
+from utils.helpers import now_timestamp
+from utils.id_bitmap import IdBitmap
 from config import Config
 import logging
 
@@ -17,8 +26,28 @@ class SubscriptionMonitor:
     def __init__(self):
         self.running = False
         self.thread = None
-        self._active_users_cache: Set[int] = set()
-        self._last_check = datetime.now()
+        self._active_users_cache = IdBitmap()
+        self._last_check = now_timestamp()
+
+        # Очередь ближайших окончаний подписок (режим 'schedule')
+        self._expiry_heap: List[Tuple[float, int]] = []
+        self._deadlines: Dict[int, float] = {}
+        self._wakeup = threading.Event()
+        self._last_resync = 0.0
+
+        # Сверка серверов выполняется в отдельном потоке (список клиентов сервера
+        # может загружаться десятки секунд), результаты применяет цикл мониторинга.
+        # Первая сверка - через RECONCILE_INTERVAL после запуска
+        self._last_reconcile = time.time()
+        self._reconcile_thread = None
+        self._reconcile_results = queue.SimpleQueue()
+
+        # Операции с VPN серверами выполняются через очередь vpn_outbox,
+        # при MONITOR_WORKER_PROCESSES > 0 - в процессах-воркерах по группам серверов
+        if Config.MONITOR_WORKER_PROCESSES > 0:
+            self._outbox = ShardPool(Config.MONITOR_WORKER_PROCESSES)
+        else:
+            self._outbox = OutboxProcessor(on_server_idle=self.wakeup)
 
     def start(self):
         """Запуск мониторинга"""
@@ -26,7 +55,13 @@ class SubscriptionMonitor:
             logger.warning("Мониторинг уже запущен")
             return
 
+        # Дожидаемся завершения прохода, начатого до предыдущей остановки
+        if self.thread and self.thread.is_alive():
+            self.thread.join()
+
         self.running = True
+        event_bus.subscribe(EVENT_SUBSCRIPTION_CHANGED, self._on_event)
+        event_bus.subscribe(EVENT_OUTBOX_CHANGED, self._on_event)
         self.thread = threading.Thread(target=self._monitor_loop, daemon=True)
         self.thread.start()
         logger.info("Мониторинг подписок запущен")
@@ -34,128 +69,303 @@ class SubscriptionMonitor:
     def stop(self):
         """Остановка мониторинга"""
         self.running = False
+        event_bus.unsubscribe(EVENT_SUBSCRIPTION_CHANGED, self._on_event)
+        event_bus.unsubscribe(EVENT_OUTBOX_CHANGED, self._on_event)
+        self._wakeup.set()
         if self.thread:
             self.thread.join(timeout=5)
+        self._outbox.shutdown()
         logger.info("Мониторинг подписок остановлен")
 
+    def wakeup(self):
+        """Немедленная обработка помеченных пользователей (будит планировщик)"""
+        self._wakeup.set()
+
+    def _on_event(self, event: str, **data):
+        """Обработчик шины событий: изменения подписок обрабатываются без ожидания"""
+        self.wakeup()
+
+    def _wait_for_event(self, timeout: float):
+        """Сон до события шины или истечения timeout.
+
+        Шина работает внутри процесса, поэтому пометки, сделанные другими
+        процессами, отслеживаются дешевой проверкой раз в SUBSCRIPTION_DIRTY_POLL_INTERVAL.
+        """
+        deadline = time.monotonic() + timeout
+        poll_interval = Config.SUBSCRIPTION_DIRTY_POLL_INTERVAL
+
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self._wakeup.wait(min(remaining, poll_interval) if poll_interval else remaining):
+                break
+            if poll_interval and SyncStateService.has_dirty_users():
+                break
+
+        self._wakeup.clear()
+
     def _monitor_loop(self):
         """Основной цикл мониторинга"""
+        self._warm_start()
+
+        if Config.SUBSCRIPTION_MONITOR_MODE == 'schedule':
+            self._schedule_loop()
+        else:
+            self._poll_loop()
+
+    def _warm_start(self):
+        """Восстановление кэша активных пользователей из сохраненного состояния"""
+        try:
+            self._active_users_cache = SyncStateService.get_applied_active_user_ids()
+            logger.info(f"Восстановлено состояние {len(self._active_users_cache)} активных пользователей")
+        except Exception as e:
+            logger.error(f"Ошибка восстановления состояния пользователей: {e}")
+
+    def _schedule_loop(self):
+        """Цикл мониторинга по очереди окончаний подписок"""
+        logger.info("Начат цикл мониторинга подписок (режим очереди окончаний)")
+
+        while self.running:
+            try:
+                if time.time() - self._last_resync >= Config.SUBSCRIPTION_RESYNC_INTERVAL:
+                    self._resync_schedule()
+                if time.time() - self._last_reconcile >= Config.RECONCILE_INTERVAL:
+                    self._start_reconcile()
+                self._apply_reconcile_results()
+
+                self._process_dirty_users()
+                self._process_due_expirations()
+                self._outbox.drain()
+
+                self._wait_for_event(self._seconds_until_next_event())
+            except Exception as e:
+                logger.error(f"Ошибка в цикле мониторинга: {e}")
+                time.sleep(Config.SUBSCRIPTION_CHECK_INTERVAL * 2)
+
+    def _poll_loop(self):
+        """Цикл мониторинга с полным опросом таблицы пользователей"""
         logger.info("Начат цикл мониторинга подписок")
 
         while self.running:
             try:
+                self._process_dirty_users()
                 self._check_subscriptions()
-                time.sleep(Config.SUBSCRIPTION_CHECK_INTERVAL)
+                if time.time() - self._last_reconcile >= Config.RECONCILE_INTERVAL:
+                    self._start_reconcile()
+                self._apply_reconcile_results()
+                self._outbox.drain()
+                self._wakeup.wait(Config.SUBSCRIPTION_CHECK_INTERVAL)
+                self._wakeup.clear()
             except Exception as e:
                 logger.error(f"Ошибка в цикле мониторинга: {e}")
                 time.sleep(Config.SUBSCRIPTION_CHECK_INTERVAL * 2)  # Увеличиваем интервал при ошибке
 
-    def _check_subscriptions(self):
-        """Проверка состояния подписок и синхронизация с VPN серверами"""
-        try:
-            current_time = datetime.now()
+    def _check_subscriptions(self, deadlines: List[Tuple[float, int]] = None):
+        """Проверка состояния подписок и синхронизация с VPN серверами.
 
-            # Получаем пользователей с активными подписками
-            active_users = UserService.get_users_by_subscription_status(active=True)
-            current_active_ids = {user['id'] for user in active_users}
+        Из БД потоково читаются только id активных пользователей (и срок окончания
+        в epoch, если нужен список deadlines), данные пользователей загружаются
+        только для изменившихся.
+        """
+        current_time = now_timestamp()
+        current_active = IdBitmap()
 
-            # Получаем пользователей с истекшими подписками
-            expired_users = UserService.get_users_by_subscription_status(active=False)
-            current_expired_ids = {user['id'] for user in expired_users}
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # Кортежи вместо sqlite3.Row - меньше объектов на строку
+            cursor.execute('''
+                SELECT id, subscription_end
+                FROM users
+                WHERE subscription_end > ?
+            ''', (current_time,))
+            for user_id, end_epoch in cursor:
+                current_active.add(user_id)
+                if deadlines is not None:
+                    deadlines.append((end_epoch, user_id))
 
-            # Находим изменения статуса
-            newly_active = current_active_ids - self._active_users_cache
-            newly_expired = self._active_users_cache & current_expired_ids
+        # Находим изменения статуса (удаленных пользователей обрабатывает путь пометок)
+        newly_active = list(current_active.difference(self._active_users_cache))
+        newly_expired = list(self._active_users_cache.difference(current_active))
 
-            # Обрабатываем новых активных пользователей
-            for user in active_users:
-                if user['id'] in newly_active:
-                    self._handle_user_activation(user)
+        # Ставим операции для новых активных и истекших пользователей в очередь
+        operations = [self._build_operation(user, OutboxService.OP_ADD)
+                      for user in UserService.get_users_sync_info(newly_active)]
+        operations += [self._build_operation(user, OutboxService.OP_REMOVE)
+                       for user in UserService.get_users_sync_info(newly_expired)]
+        self._enqueue(operations)
 
-            # Обрабатываем истекших пользователей
-            for user in expired_users:
-                if user['id'] in newly_expired:
-                    self._handle_user_deactivation(user)
+        # Обновляем кэш
+        self._active_users_cache = current_active
 
-            # Обновляем кэш
-            self._active_users_cache = current_active_ids
+        # Логируем статистику каждые 60 секунд
+        if current_time - self._last_check >= 60:
+            with db_manager.get_connection() as conn:
+                total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            logger.info(f"Статус подписок: {len(current_active)} активных, "
+                        f"{total - len(current_active)} истекших пользователей")
+            self._last_check = current_time
 
-            # Логируем статистику каждые 60 секунд
-            if (current_time - self._last_check).total_seconds() >= 60:
-                logger.info(f"Статус подписок: {len(current_active_ids)} активных, "
-                            f"{len(current_expired_ids)} истекших пользователей")
-                self._last_check = current_time
+    def _resync_schedule(self):
+        """Полная сверка подписок и перестроение очереди окончаний"""
+        now = time.time()
+        heap = []
+        self._check_subscriptions(heap)
 
-        except Exception as e:
-            logger.error(f"Ошибка проверки подписок: {e}")
+        heapq.heapify(heap)
+        self._expiry_heap = heap
+        self._deadlines = {user_id: deadline for deadline, user_id in heap}
+        self._last_resync = now
+        logger.info(f"Очередь окончаний подписок перестроена: {len(heap)} активных пользователей")
 
-    def _handle_user_activation(self, user: dict):
-        """Обработка активации пользователя"""
-        try:
-            if not user.get('server_id'):
-                logger.warning(f"Пользователь {user['telegram_id']} не имеет назначенного сервера")
+    def _start_reconcile(self):
+        """Запуск сверки серверов в фоновом потоке (если предыдущая завершилась)"""
+        self._last_reconcile = time.time()
+        if self._reconcile_thread and self._reconcile_thread.is_alive():
+            logger.warning("Предыдущая сверка серверов еще выполняется, пропуск")
+            return
+
+        self._reconcile_thread = threading.Thread(target=self._reconcile_servers, name="reconcile", daemon=True)
+        self._reconcile_thread.start()
+
+    def _reconcile_servers(self):
+        """Сверка списков пользователей всех активных серверов с БД (фоновый поток)"""
+        for server in ServerService.get_active_servers():
+            if not self.running:
+                return
+            try:
+                result = ReconcileService.reconcile_server(server)
+                if result is not None:
+                    self._reconcile_results.put(result)
+                    self.wakeup()
+            except Exception as e:
+                logger.error(f"Ошибка сверки сервера {server['name']}: {e}")
+
+    def _apply_reconcile_results(self):
+        """Учет результатов сверки в кэше активных пользователей (в потоке мониторинга)"""
+        while True:
+            try:
+                result = self._reconcile_results.get_nowait()
+            except queue.Empty:
                 return
 
-            server = {
-                'name': user.get('server_name', 'Unknown'),
-                'api_url': user['api_url'],
-                'api_token': user['api_token']
-            }
-
-            # Проверяем наличие пользователя на сервере
-            vpn_user = ServerService.get_user_from_vpn_server(server, user['uuid'])
-
-            if not vpn_user:
-                # Добавляем пользователя на сервер
-                result = ServerService.add_user_to_vpn_server(server, user['uuid'], user['email'])
-                if result:
-                    logger.info(f"Активирован пользователь {user['email']} на сервере {server['name']}")
-                    self._log_user_activity(user['id'], "VPN_ACTIVATED", f"Added to server {server['name']}")
+            # Пользователи сервера теперь либо на нем, либо в очереди на добавление
+            self._active_users_cache.difference_update(result['user_ids'])
+            self._active_users_cache.update(result['active_user_ids'])
+
+    def _schedule_expiry(self, user_id: int, subscription_end: int):
+        """Постановка окончания подписки пользователя в очередь"""
+        deadline = float(subscription_end)
+        self._deadlines[user_id] = deadline
+        heapq.heappush(self._expiry_heap, (deadline, user_id))
+
+    def _seconds_until_next_event(self) -> float:
+        """Время сна до ближайшего окончания подписки, повтора операции или плановой сверки"""
+        now = time.time()
+        timeout = min(Config.SUBSCRIPTION_MAX_SLEEP,
+                      self._last_resync + Config.SUBSCRIPTION_RESYNC_INTERVAL - now,
+                      self._last_reconcile + Config.RECONCILE_INTERVAL - now)
+        if self._expiry_heap:
+            timeout = min(timeout, self._expiry_heap[0][0] - now)
+
+        outbox_timeout = self._outbox.seconds_until_next()
+        if outbox_timeout is not None:
+            timeout = min(timeout, outbox_timeout)
+
+        return max(0.0, timeout)
+
+    def _process_dirty_users(self):
+        """Обработка пользователей, помеченных при изменении подписки"""
+        rows = SyncStateService.take_dirty_users(Config.SYNC_DIRTY_BATCH_SIZE)
+
+        operations = []
+        for row in rows:
+            if row['desired_state'] == SyncStateService.STATE_DELETED:
+                self._active_users_cache.discard(row['user_id'])
+                self._deadlines.pop(row['user_id'], None)
+
+                if row['applied_server_id'] and row['user_uuid']:
+                    operations.append((row['user_id'], row['applied_server_id'], row['user_uuid'],
+                                       None, OutboxService.OP_REMOVE))
                 else:
-                    logger.error(f"Не удалось активировать пользователя {user['email']} на сервере {server['name']}")
+                    SyncStateService.delete_state(row['user_id'])
             else:
-                logger.debug(f"Пользователь {user['email']} уже активен на сервере {server['name']}")
+                operations.append(self._sync_user(row['user_id'], row))
 
-        except Exception as e:
-            logger.error(f"Ошибка активации пользователя {user.get('telegram_id', 'unknown')}: {e}")
+        self._enqueue(operations)
 
-    def _handle_user_deactivation(self, user: dict):
-        """Обработка деактивации пользователя"""
-        try:
-            if not user.get('server_id'):
-                return
+        # Пачка заполнена целиком - остальные помеченные обработаем без ожидания
+        if len(rows) >= Config.SYNC_DIRTY_BATCH_SIZE:
+            self._wakeup.set()
 
-            server = {
-                'name': user.get('server_name', 'Unknown'),
-                'api_url': user['api_url'],
-                'api_token': user['api_token']
-            }
+    def _process_due_expirations(self):
+        """Обработка подписок, срок которых наступил"""
+        now = time.time()
+        operations = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            deadline, user_id = heapq.heappop(self._expiry_heap)
 
-            # Удаляем пользователя с сервера
-            success = ServerService.remove_user_from_vpn_server(server, user['uuid'])
+            # Запись устарела: подписка была изменена после постановки в очередь
+            if self._deadlines.get(user_id) != deadline:
+                continue
 
-            if success:
-                logger.info(f"Деактивирован пользователь {user['email']} на сервере {server['name']}")
-                self._log_user_activity(user['id'], "VPN_DEACTIVATED", f"Removed from server {server['name']}")
-            else:
-                logger.warning(f"Не удалось деактивировать пользователя {user['email']} на сервере {server['name']}")
+            del self._deadlines[user_id]
+            operations.append(self._sync_user(user_id))
 
-        except Exception as e:
-            logger.error(f"Ошибка деактивации пользователя {user.get('telegram_id', 'unknown')}: {e}")
+        self._enqueue(operations)
 
-    def _log_user_activity(self, user_id: int, action: str, details: str):
-        """Логирование активности пользователя в БД"""
+    def _sync_user(self, user_id: int, state: Dict = None) -> Optional[Tuple]:
+        """Определение операции на VPN сервере, нужной пользователю по его подписке"""
         try:
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO user_activity_log (user_id, action, details)
-                    VALUES (?, ?, ?)
-                ''', (user_id, action, details))
-                conn.commit()
+            user = UserService.get_user_by_id(user_id)
+            if not user:
+                self._active_users_cache.discard(user_id)
+                self._deadlines.pop(user_id, None)
+                return None
+
+            if user['is_subscription_active']:
+                self._schedule_expiry(user_id, user['subscription_end'])
+                if user_id not in self._active_users_cache:
+                    self._active_users_cache.add(user_id)
+
+                    # Пользователь уже добавлен на свой сервер - запрос к серверу не нужен
+                    if (state and state['applied_state'] == SyncStateService.STATE_ACTIVE
+                            and state['applied_server_id'] == user['server_id']):
+                        return None
+                    return self._build_operation(user, OutboxService.OP_ADD)
+            else:
+                self._deadlines.pop(user_id, None)
+                if state is None:
+                    state = SyncStateService.get_state(user_id)
+
+                # Пользователь мог быть добавлен в обход кэша (например, ручной сверкой сервера)
+                applied_active = state and state['applied_state'] == SyncStateService.STATE_ACTIVE
+                if user_id in self._active_users_cache or applied_active:
+                    self._active_users_cache.discard(user_id)
+                    return self._build_operation(user, OutboxService.OP_REMOVE)
+
         except Exception as e:
-            logger.error(f"Ошибка логирования активности: {e}")
+            logger.error(f"Ошибка синхронизации пользователя {user_id}: {e}")
+
+        return None
+
+    @staticmethod
+    def _build_operation(user: dict, operation: str) -> Optional[Tuple]:
+        """Операция очереди vpn_outbox для пользователя"""
+        if not user.get('server_id'):
+            if operation == OutboxService.OP_ADD:
+                logger.warning(f"Пользователь {user['telegram_id']} не имеет назначенного сервера")
+            return None
+
+        return user['id'], user['server_id'], user['uuid'], user['email'], operation
+
+    @staticmethod
+    def _enqueue(operations: Iterable[Optional[Tuple]]):
+        """Постановка операций в очередь vpn_outbox"""
+        operations = [operation for operation in operations if operation]
+        if operations:
+            OutboxService.enqueue_many(operations)
 
 
 # Глобальный экземпляр монитора - это то, что было пропущено!
-subscription_monitor = SubscriptionMonitor()
\ No newline at end of file
+subscription_monitor = SubscriptionMonitor()
@@ -7,10 +7,87 @@ class Config:
 
     # База данных
     DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'vpn_service.db')
+    DATABASE_POOL_SIZE = 32  # Максимум открытых соединений с БД для записи
+    DATABASE_READ_POOL_SIZE = (os.cpu_count() or 2) * 4  # Максимум соединений только для чтения
+    DATABASE_POOL_TIMEOUT = 30  # Ожидание свободного соединения, секунды
+    DATABASE_BUSY_TIMEOUT = 5000  # Ожидание блокировки записи, мс
+    DATABASE_MMAP_SIZE = 256 * 1024 * 1024  # Отображение файла БД в память, байты (0 - отключено)
+    DATABASE_CACHE_SIZE = -64000  # Кэш страниц на соединение (отрицательное - в КиБ)
+    DATABASE_AUTO_MIGRATE = True  # Применять миграции схемы при запуске (иначе только предупреждение)
+
+    # Список пользователей (постраничный вывод по курсору)
+    USERS_PAGE_SIZE = 20  # Пользователей на странице админки
+    USERS_API_PAGE_SIZE = 50  # Размер страницы API по умолчанию
+    USERS_API_MAX_PAGE_SIZE = 200  # Максимальный размер страницы API
+    USERS_COUNT_CACHE_TTL = 60  # Кэширование итогов по фильтрам, секунды
 
     # Настройки мониторинга подписок
     SUBSCRIPTION_CHECK_INTERVAL = 1  # Проверка каждую секунду
     SUBSCRIPTION_BUFFER_SECONDS = 5  # Буфер для обработки
+    # Режим мониторинга: 'schedule' - очередь ближайших окончаний подписок,
+    # 'poll' - полный опрос таблицы каждые SUBSCRIPTION_CHECK_INTERVAL секунд
+    SUBSCRIPTION_MONITOR_MODE = 'schedule'
+    SUBSCRIPTION_MAX_SLEEP = 300  # Страховочный интервал: изменения приходят через шину событий
+    SUBSCRIPTION_DIRTY_POLL_INTERVAL = 5  # Проверка пометок от других процессов (0 - отключить)
+    SUBSCRIPTION_RESYNC_INTERVAL = 3600  # Полная сверка для режима 'schedule'
+    SYNC_DIRTY_BATCH_SIZE = 500  # Помеченных пользователей за один проход монитора
+
+    # Параллельная работа с VPN серверами
+    NODE_MAX_CONCURRENCY = 8  # Одновременных запросов к одному серверу
+    NODE_CONCURRENCY_OVERRIDES = {}  # Лимиты для отдельных серверов: {server_id: лимит}
+    NODE_TICK_DEADLINE = 15  # Сколько секунд проход монитора ждет ответы серверов
+    NODE_HTTP_POOL_SIZE = NODE_MAX_CONCURRENCY  # Keep-alive соединений к одному серверу
+    NODE_HTTP_CONNECT_TIMEOUT = 5  # Таймаут подключения к API сервера
+    NODE_HTTP_DEFAULT_TIMEOUT = 10  # Таймаут ответа API сервера
+    NODE_HTTP_TIMEOUTS = {'list': 30}  # Таймауты ответа для отдельных методов API
+    NODE_ASYNC_MAX_CONNECTIONS = 100  # Общий лимит соединений асинхронного клиента ко всем серверам
+    SERVER_STATUS_REFRESH_INTERVAL = 30  # Периодичность фоновой проверки статусов серверов
+    SERVER_STATUS_STALE_AFTER = 90  # Статус старше считается устаревшим
+    # Автомат защиты запросов к серверу (circuit breaker)
+    BREAKER_WINDOW = 20  # Сколько последних запросов учитывается
+    BREAKER_MIN_CALLS = 5  # Минимум запросов в окне для размыкания
+    BREAKER_ERROR_RATE = 0.5  # Доля ошибок для размыкания
+    BREAKER_SLOW_CALL_SECONDS = 5  # Ответ дольше считается медленным
+    BREAKER_SLOW_CALL_RATE = 0.8  # Доля медленных ответов для размыкания
+    BREAKER_OPEN_SECONDS = 30  # Время до пробного запроса
+    BREAKER_HALF_OPEN_CALLS = 1  # Одновременных пробных запросов
+    # Распределение пользователей по серверам
+    SERVER_DEFAULT_CAPACITY = 1000  # Емкость сервера, если не задана
+    PLACEMENT_REFRESH_INTERVAL = 30  # Перечитывание рейтинга серверов из БД
+    PLACEMENT_CPU_WEIGHT = 1.0  # Влияние загрузки CPU на рейтинг (0 - не учитывать)
+
+    # Перенос пользователей между серверами
+    MIGRATION_BATCH_SIZE = 200  # Переносов за один проход
+    MIGRATION_WORKERS = 32  # Потоков выполнения переносов
+    MIGRATION_NODE_CONCURRENCY = 4  # Одновременных запросов переноса к одному серверу
+    MIGRATION_MAX_ATTEMPTS = 5  # Попыток переноса пользователя до отметки об ошибке
+    MIGRATION_RETRY_DELAY = 30  # Пауза, если проход завершился без единого успешного переноса
+    MIGRATION_POLL_INTERVAL = 5  # Проверка новых и возобновленных миграций
+    MIGRATION_DEFAULT_LATENCY_MS = 300  # Оценочное время запроса к серверу без собранных метрик
+    MIGRATION_REBALANCE_TOLERANCE = 0.05  # Допустимое отклонение заполненности сервера от средней
+
+    # Метрики серверов
+    METRICS_RING_SIZE = 4096  # Отсчетов в кольцевом буфере сервера
+    METRICS_FLUSH_INTERVAL = 60  # Периодичность сохранения минутных значений
+    METRICS_MINUTE_RETENTION = 2 * 86400  # Хранение минутных значений
+    METRICS_HOUR_RETENTION = 90 * 86400  # Хранение часовых значений
+
+    # Очередь операций с VPN серверами
+    OUTBOX_BATCH_SIZE = 200  # Операций за один проход
+    OUTBOX_LEASE_SECONDS = 300  # Аренда захваченной операции (на случай падения процесса)
+    OUTBOX_RETRY_BASE_SECONDS = 5  # Первая задержка повтора, далее удваивается
+    OUTBOX_RETRY_MAX_SECONDS = 3600  # Максимальная задержка повтора
+    MONITOR_WORKER_PROCESSES = 0  # Процессов для операций с серверами (0 - в процессе монитора)
+    SHARD_REFRESH_INTERVAL = 30  # Как часто воркер перечитывает список своих серверов
+
+    # Сверка списков пользователей на VPN серверах с БД
+    RECONCILE_INTERVAL = 6 * 3600  # Периодичность полной сверки серверов
+    RECONCILE_BATCH_SIZE = 500  # Операций в одной транзакции постановки в очередь
+    RECONCILE_REMOVE_UNKNOWN = True  # Удалять с серверов клиентов, UUID которых нет в БД
+
+    # Выбор ведущего процесса для мониторинга и автосписаний
+    LEADER_LEASE_TTL = 30  # Срок аренды без продления (время переключения при падении)
+    LEADER_HEARTBEAT_INTERVAL = 10  # Периодичность продления аренды
 
     # Настройки логирования
     LOG_LEVEL = 'INFO'
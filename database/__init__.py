@@ -4,5 +4,6 @@
 
 from .connection import db_manager, DatabaseManager
 from .models import DatabaseInitializer
+from .migrations import SchemaMigrator
 
-__all__ = ['db_manager', 'DatabaseManager', 'DatabaseInitializer']
\ No newline at end of file
+__all__ = ['db_manager', 'DatabaseManager', 'DatabaseInitializer', 'SchemaMigrator']
\ No newline at end of file
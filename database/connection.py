@@ -1,65 +1,258 @@
+import os
 import sqlite3
 import threading
+import time
 from contextlib import contextmanager
 from datetime import datetime
+from typing import Dict, List
+from urllib.parse import quote
 from config import Config
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class ConnectionPool:
+    """Ограниченный пул соединений SQLite с учетом времени ожидания"""
+
+    def __init__(self, name: str, connect, size: int):
+        self.name = name
+        self.size = size
+        self._connect = connect
+        self._idle: List[sqlite3.Connection] = []
+        self._created = 0
+        self._available = threading.Condition(threading.Lock())
+        self._stats = {'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'timeouts': 0}
+
+    def checkout(self) -> sqlite3.Connection:
+        """Выдача свободного соединения, создание нового или ожидание освобождения"""
+        with self._available:
+            self._stats['checkouts'] += 1
+            if not self._idle and self._created >= self.size:
+                started = time.monotonic()
+                self._stats['waits'] += 1
+                ready = self._available.wait_for(lambda: self._idle or self._created < self.size,
+                                                 timeout=Config.DATABASE_POOL_TIMEOUT)
+                waited = time.monotonic() - started
+                self._stats['wait_seconds'] += waited
+                self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+                if not ready:
+                    self._stats['timeouts'] += 1
+                    raise sqlite3.OperationalError(f"Нет свободных соединений с БД ({self.name}) "
+                                                   f"за {Config.DATABASE_POOL_TIMEOUT} с (пул {self.size})")
+                if waited > 1:
+                    logger.warning(f"Ожидание соединения с БД ({self.name}) {waited:.1f} с: "
+                                   f"пул из {self.size} занят")
+
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        try:
+            return self._connect()
+        except Exception:
+            self._discard()
+            raise
+
+    def release(self, connection: sqlite3.Connection):
+        """Возврат соединения в пул"""
+        try:
+            # Незафиксированные изменения не переходят к следующему владельцу соединения
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            connection.close()
+            self._discard()
+            return
+
+        with self._available:
+            self._idle.append(connection)
+            self._available.notify()
+
+    def close_all(self):
+        """Закрытие свободных соединений"""
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for connection in idle:
+            connection.close()
+
+    def get_stats(self) -> Dict:
+        """Состояние пула и время ожидания свободных соединений"""
+        with self._available:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self.size,
+                'open': self._created,
+                'idle': len(self._idle),
+                'in_use': self._created - len(self._idle)
+            })
+        stats['avg_wait_ms'] = round(stats['wait_seconds'] / stats['waits'] * 1000, 1) if stats['waits'] else 0
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 3)
+        return stats
+
+    def _discard(self):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+
 class DatabaseManager:
-    """Менеджер подключений к базе данных с поддержкой threading"""
+    """Менеджер подключений к базе данных: пулы соединений для записи и для чтения.
 
-    def __init__(self, db_path=None):
+    Соединение выдается потоку на время блока get_connection (вложенные
+    блоки получают то же соединение) и возвращается в пул при выходе из
+    внешнего блока. В запросе Flask соединения удерживаются до конца
+    запроса (begin_scope/end_scope). В режиме WAL чтение не блокирует
+    запись, поэтому запросы только на чтение (get_read_connection) идут
+    через отдельный пул соединений только для чтения.
+    """
+
+    def __init__(self, db_path=None, pool_size: int = None, read_pool_size: int = None):
         self.db_path = db_path or Config.DATABASE_PATH
+        self._write_pool = ConnectionPool('запись', self._connect_read_write, pool_size or Config.DATABASE_POOL_SIZE)
+        self._read_pool = ConnectionPool('чтение', self._connect_read_only,
+                                         read_pool_size or Config.DATABASE_READ_POOL_SIZE)
         self._local = threading.local()
         self._setup_adapters()
 
+    @property
+    def pool_size(self) -> int:
+        return self._write_pool.size
+
     def _setup_adapters(self):
-        """Настройка адаптеров для работы с datetime"""
+        """Настройка адаптеров для работы с datetime.
 
-        def adapt_datetime(dt):
-            return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        Даты хранятся в БД целыми секундами Unix и читаются без конвертеров
+        (строки разбираются на стороне SQLite). datetime, переданный
+        параметром запроса, записывается как секунды Unix.
+        """
 
-        def convert_datetime(s):
-            try:
-                return datetime.strptime(s.decode('utf-8'), '%Y-%m-%d %H:%M:%S.%f')
-            except ValueError:
-                try:
-                    return datetime.strptime(s.decode('utf-8'), '%Y-%m-%d %H:%M:%S')
-                except:
-                    return datetime.now()
+        def adapt_datetime(dt):
+            return int(dt.timestamp())
 
         sqlite3.register_adapter(datetime, adapt_datetime)
-        sqlite3.register_converter("timestamp", convert_datetime)
 
     @contextmanager
     def get_connection(self):
-        """Получение соединения с автоматическим закрытием"""
-        if not hasattr(self._local, 'connection'):
-            self._local.connection = sqlite3.connect(
-                self.db_path,
-                detect_types=sqlite3.PARSE_DECLTYPES,
-                timeout=30.0
-            )
-            self._local.connection.row_factory = sqlite3.Row
+        """Получение соединения для чтения и записи"""
+        with self._hold(self._write_pool) as connection:
+            yield connection
 
+    @contextmanager
+    def get_read_connection(self):
+        """Получение соединения только для чтения.
+
+        Внутри блока get_connection возвращает соединение для записи, чтобы
+        видеть еще не зафиксированные изменения своей транзакции.
+        """
+        held = self._held(self._write_pool)
+        if held is not None:
+            with self._hold(self._write_pool) as connection:
+                yield connection
+        else:
+            with self._hold(self._read_pool) as connection:
+                yield connection
+
+    def begin_scope(self):
+        """Удержание соединений потока до end_scope (на время запроса)"""
+        self._local.scoped = True
+
+    def end_scope(self):
+        """Возврат удерживаемых соединений в пулы"""
+        self._local.scoped = False
+        for pool in (self._write_pool, self._read_pool):
+            state = self._state(pool)
+            if state['connection'] is not None and state['depth'] == 0:
+                self._release(pool, state)
+
+    def close_connection(self):
+        """Возврат соединений текущего потока в пулы"""
+        self.end_scope()
+
+    def close_all(self):
+        """Закрытие свободных соединений пулов (при остановке процесса)"""
+        self.close_connection()
+        self._write_pool.close_all()
+        self._read_pool.close_all()
+
+    def get_pool_stats(self) -> Dict:
+        """Состояние пулов и время ожидания свободных соединений"""
+        stats = self._write_pool.get_stats()
+        stats['read'] = self._read_pool.get_stats()
+        return stats
+
+    @contextmanager
+    def _hold(self, pool: ConnectionPool):
+        state = self._state(pool)
+        if state['connection'] is None:
+            state['connection'] = pool.checkout()
+            state['depth'] = 0
+
+        connection = state['connection']
+        state['depth'] += 1
         try:
-            yield self._local.connection
+            yield connection
         except Exception as e:
-            self._local.connection.rollback()
+            connection.rollback()
             logger.error(f"Database error: {e}")
             raise
         finally:
-            pass  # Соединение остается открытым для повторного использования
+            state['depth'] -= 1
+            if state['depth'] == 0 and not getattr(self._local, 'scoped', False):
+                self._release(pool, state)
 
-    def close_connection(self):
-        """Закрытие соединения для текущего потока"""
-        if hasattr(self._local, 'connection'):
-            self._local.connection.close()
-            delattr(self._local, 'connection')
+    def _held(self, pool: ConnectionPool):
+        state = self._state(pool)
+        return state['connection'] if state['depth'] else None
+
+    def _state(self, pool: ConnectionPool) -> Dict:
+        """Соединение потока из пула и глубина вложенных блоков"""
+        states = getattr(self._local, 'states', None)
+        if states is None:
+            states = self._local.states = {}
+        state = states.get(pool.name)
+        if state is None:
+            state = states[pool.name] = {'connection': None, 'depth': 0}
+        return state
+
+    @staticmethod
+    def _release(pool: ConnectionPool, state: Dict):
+        connection, state['connection'] = state['connection'], None
+        pool.release(connection)
+
+    def _connect_read_write(self) -> sqlite3.Connection:
+        connection = self._open(self.db_path)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def _connect_read_only(self) -> sqlite3.Connection:
+        # Файл БД и журнал WAL создает соединение для записи
+        if not os.path.exists(self.db_path):
+            with self.get_connection():
+                pass
+
+        connection = self._open(f"file:{quote(os.path.abspath(self.db_path))}?mode=ro", uri=True)
+        connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    @staticmethod
+    def _open(database: str, uri: bool = False) -> sqlite3.Connection:
+        """Новое соединение с настройками производительности"""
+        connection = sqlite3.connect(
+            database,
+            timeout=Config.DATABASE_BUSY_TIMEOUT / 1000,
+            check_same_thread=False,
+            uri=uri
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute(f"PRAGMA busy_timeout = {int(Config.DATABASE_BUSY_TIMEOUT)}")
+        connection.execute(f"PRAGMA mmap_size = {int(Config.DATABASE_MMAP_SIZE)}")
+        connection.execute(f"PRAGMA cache_size = {int(Config.DATABASE_CACHE_SIZE)}")
+        return connection
 
 
 # Глобальный экземпляр менеджера БД
-db_manager = DatabaseManager()
\ No newline at end of file
+db_manager = DatabaseManager()
@@ -0,0 +1,241 @@
+"""
+Версионные миграции схемы БД.
+
+Миграции нумеруются по порядку и применяются по одной, каждая в своей
+транзакции (BEGIN IMMEDIATE - процессы, запущенные одновременно,
+применяют их по очереди). Примененные версии записываются в таблицу
+schema_migrations. Новая миграция - функция cursor -> None,
+зарегистрированная декоратором @migration со следующим номером.
+
+Состояние и применение из командной строки: python -m tools.migrate
+"""
+
+import re
+import time
+from typing import Callable, Dict, List, Tuple
+from database.connection import db_manager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Даты хранятся целыми секундами Unix; значение по умолчанию - текущее время
+NOW_EPOCH_SQL = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+# (версия, описание, функция)
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+
+def migration(version: int, description: str):
+    """Регистрация миграции схемы"""
+
+    def register(apply: Callable) -> Callable:
+        if MIGRATIONS and version != MIGRATIONS[-1][0] + 1:
+            raise ValueError(f"Миграция {version} ({description}): ожидался номер {MIGRATIONS[-1][0] + 1}")
+        MIGRATIONS.append((version, description, apply))
+        return apply
+
+    return register
+
+
+class SchemaMigrator:
+    """Применение и проверка версионных миграций схемы"""
+
+    @staticmethod
+    def get_applied_versions(cursor) -> set:
+        """Номера примененных миграций"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_migrations'")
+        if not cursor.fetchone():
+            return set()
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def get_pending() -> List[Tuple[int, str]]:
+        """Миграции, еще не примененные к БД: [(версия, описание)]"""
+        with db_manager.get_read_connection() as conn:
+            applied = SchemaMigrator.get_applied_versions(conn.cursor())
+        return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+    @staticmethod
+    def get_status() -> Dict:
+        """Версия схемы и ожидающие миграции (для /health)"""
+        with db_manager.get_read_connection() as conn:
+            applied = SchemaMigrator.get_applied_versions(conn.cursor())
+        return {
+            'version': max(applied, default=0),
+            'latest': MIGRATIONS[-1][0] if MIGRATIONS else 0,
+            'pending': [version for version, _, _ in MIGRATIONS if version not in applied]
+        }
+
+    @staticmethod
+    def check() -> List[Tuple[int, str]]:
+        """Проверка при запуске: предупреждение об ожидающих миграциях"""
+        pending = SchemaMigrator.get_pending()
+        if pending:
+            logger.warning(f"Схема БД устарела, ожидают применения миграции: "
+                           f"{', '.join(f'{version} ({description})' for version, description in pending)}")
+        else:
+            logger.info(f"Схема БД актуальна (версия {MIGRATIONS[-1][0] if MIGRATIONS else 0})")
+        return pending
+
+    @staticmethod
+    def migrate(conn) -> int:
+        """Применение ожидающих миграций. Возвращает количество примененных"""
+        if conn.in_transaction:
+            conn.commit()
+
+        cursor = conn.cursor()
+        SchemaMigrator._create_table(cursor)
+        applied_count = 0
+        for version, description, apply in MIGRATIONS:
+            # Блокировка записи до проверки версии: другой процесс мог применить миграцию раньше
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if version in SchemaMigrator.get_applied_versions(cursor):
+                    conn.commit()
+                    continue
+
+                started = time.monotonic()
+                apply(cursor)
+                duration_ms = int((time.monotonic() - started) * 1000)
+                cursor.execute('''
+                    INSERT INTO schema_migrations (version, description, applied_at, duration_ms)
+                    VALUES (?, ?, ?, ?)
+                ''', (version, description, int(time.time()), duration_ms))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Ошибка миграции схемы {version} ({description}): {e}")
+                raise
+
+            applied_count += 1
+            logger.info(f"Применена миграция схемы {version}: {description} ({duration_ms} мс)")
+
+        return applied_count
+
+    @staticmethod
+    def _create_table(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at INTEGER NOT NULL,
+                duration_ms INTEGER
+            )
+        ''')
+
+
+# ============================================================================
+# МИГРАЦИИ
+# ============================================================================
+
+@migration(1, "Даты в секундах Unix вместо строк TIMESTAMP")
+def _timestamps_to_epoch(cursor):
+    """Перевод колонок TIMESTAMP (строки дат) в целые секунды Unix.
+
+    Тип колонки в SQLite не меняется через ALTER TABLE, поэтому таблица
+    пересобирается: создается копия с колонками INTEGER, данные переносятся
+    с преобразованием, старая таблица удаляется, ее индексы и триггеры
+    создаются заново.
+    """
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' AND sql LIKE '%TIMESTAMP%'")
+    for table, sql in cursor.fetchall():
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [dict(row) for row in cursor.fetchall()]
+        legacy = [column for column in columns if column['type'].upper() == 'TIMESTAMP']
+        if legacy:
+            _rebuild_with_epoch_columns(cursor, table, sql, columns, legacy)
+
+
+def _rebuild_with_epoch_columns(cursor, table: str, sql: str, columns: list, legacy: list):
+    """Пересборка таблицы с колонками дат в секундах Unix"""
+    started = time.monotonic()
+    new_table = f"{table}__epoch"
+
+    new_sql = sql.replace('TIMESTAMP DEFAULT CURRENT_TIMESTAMP', f'INTEGER DEFAULT {NOW_EPOCH_SQL}')
+    new_sql = re.sub(r'\bTIMESTAMP\b', 'INTEGER', new_sql)
+    new_sql = re.sub(r'^\s*CREATE TABLE\s+(IF NOT EXISTS\s+)?["`]?\w+["`]?', f'CREATE TABLE {new_table}', new_sql)
+
+    def to_epoch(column: dict) -> str:
+        name = f'"{column["name"]}"'
+        # Даты из Python записаны в локальном времени, CURRENT_TIMESTAMP - в UTC и без
+        # долей секунды (адаптер Python их всегда добавлял). Неразборчивые даты
+        # становятся NULL (0 для обязательных колонок)
+        utc_default = (column['dflt_value'] or '').upper() == 'CURRENT_TIMESTAMP'
+        expression = f"""CASE
+            WHEN typeof({name}) IN ('integer', 'real') THEN CAST({name} AS INTEGER)
+            WHEN {'1' if utc_default else '0'} AND {name} NOT LIKE '%.%' THEN CAST(strftime('%s', {name}) AS INTEGER)
+            ELSE CAST(strftime('%s', {name}, 'utc') AS INTEGER)
+        END"""
+        return f"COALESCE({expression}, 0)" if column['notnull'] else expression
+
+    for column in legacy:
+        cursor.execute(f"""
+            SELECT COUNT(*) FROM {table}
+            WHERE typeof("{column['name']}") = 'text' AND strftime('%s', "{column['name']}") IS NULL
+        """)
+        invalid = cursor.fetchone()[0]
+        if invalid:
+            logger.warning(f"{table}.{column['name']}: {invalid} неразборчивых дат будут сброшены")
+
+    names = ", ".join(f'"{column["name"]}"' for column in columns)
+    values = ", ".join(to_epoch(column) if column in legacy else f'"{column["name"]}"' for column in columns)
+
+    # Индексы и триггеры удаляются вместе с таблицей
+    cursor.execute("SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') "
+                   "AND sql IS NOT NULL", (table,))
+    dependents = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    sequence = cursor.fetchone()
+
+    cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+    cursor.execute(new_sql)
+    cursor.execute(f"INSERT INTO {new_table} ({names}) SELECT {values} FROM {table}")
+    moved = cursor.rowcount
+    cursor.execute(f"DROP TABLE {table}")
+    # Триггеры других таблиц могут ссылаться на еще не пересобранные таблицы -
+    # переименование без разбора всей схемы
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+    finally:
+        cursor.execute("PRAGMA legacy_alter_table = OFF")
+
+    for dependent_sql in dependents:
+        cursor.execute(dependent_sql)
+
+    # AUTOINCREMENT не должен повторно выдать id удаленных строк
+    if sequence:
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table))
+        if not cursor.rowcount:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, sequence[0]))
+
+    logger.info(f"Таблица {table}: даты ({', '.join(column['name'] for column in legacy)}) "
+                f"переведены в секунды Unix, строк {moved}, {time.monotonic() - started:.1f} с")
+
+
+@migration(2, "Индекс payments(payment_id) для обновления статуса платежа")
+def _index_payments_payment_id(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_payment_id ON payments(payment_id)')
+
+
+@migration(3, "Индекс user_activity_log(user_id, timestamp) для истории пользователя")
+def _index_activity_log_user_time(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_activity_log_user_time ON user_activity_log(user_id, timestamp)')
+
+
+@migration(4, "Индекс promocode_activations(user_id) для истории промокодов пользователя")
+def _index_promocode_activations_user(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_promocode_activations_user_id ON promocode_activations(user_id)')
+
+
+@migration(5, "Индекс users(created_at) для сортировки списка пользователей")
+def _index_users_created_at(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)')
+
+
+@migration(6, "users.created_at без NULL для постраничного вывода по (created_at, id)")
+def _users_created_at_not_null(cursor):
+    # Сравнение (created_at, id) < (?, ?) с NULL ложно - такие строки выпали бы из списка
+    cursor.execute("UPDATE users SET created_at = 0 WHERE created_at IS NULL")
@@ -1,5 +1,6 @@
-from datetime import datetime, timedelta
 from database.connection import db_manager
+from database.migrations import NOW_EPOCH_SQL, SchemaMigrator
+from config import Config
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,7 +16,7 @@ class DatabaseInitializer:
             cursor = conn.cursor()
 
             # Таблица серверов
-            cursor.execute('''
+            cursor.execute(f'''
                 CREATE TABLE IF NOT EXISTS servers (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     name TEXT NOT NULL UNIQUE,
@@ -23,29 +24,37 @@ class DatabaseInitializer:
                     api_url TEXT NOT NULL,
                     api_token TEXT NOT NULL,
                     is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    capacity INTEGER DEFAULT 0,
+                    user_count INTEGER DEFAULT 0,
+                    links_version INTEGER DEFAULT 0,
+                    created_at INTEGER DEFAULT {NOW_EPOCH_SQL}
                 )
             ''')
+            DatabaseInitializer._ensure_columns(cursor, 'servers', {
+                'capacity': 'INTEGER DEFAULT 0',
+                'user_count': 'INTEGER DEFAULT 0',
+                'links_version': 'INTEGER DEFAULT 0',
+            })
 
             # Таблица пользователей
-            cursor.execute('''
+            cursor.execute(f'''
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     telegram_id TEXT NOT NULL UNIQUE,
                     email TEXT NOT NULL UNIQUE,
                     uuid TEXT NOT NULL UNIQUE,
                     server_id INTEGER,
-                    subscription_end TIMESTAMP NOT NULL,
+                    subscription_end INTEGER NOT NULL,
                     is_active BOOLEAN DEFAULT TRUE,
                     is_refuse_payment BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at INTEGER DEFAULT {NOW_EPOCH_SQL},
+                    updated_at INTEGER DEFAULT {NOW_EPOCH_SQL},
                     FOREIGN KEY (server_id) REFERENCES servers(id)
                 )
             ''')
 
             # Таблица промокодов
-            cursor.execute('''
+            cursor.execute(f'''
                 CREATE TABLE IF NOT EXISTS promocodes (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     code TEXT NOT NULL UNIQUE,
@@ -53,17 +62,17 @@ class DatabaseInitializer:
                     max_activations INTEGER NOT NULL,
                     current_activations INTEGER DEFAULT 0,
                     is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at INTEGER DEFAULT {NOW_EPOCH_SQL}
                 )
             ''')
 
             # Таблица активаций промокодов
-            cursor.execute('''
+            cursor.execute(f'''
                 CREATE TABLE IF NOT EXISTS promocode_activations (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     promocode_id INTEGER NOT NULL,
                     user_id INTEGER NOT NULL,
-                    activated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    activated_at INTEGER DEFAULT {NOW_EPOCH_SQL},
                     FOREIGN KEY (promocode_id) REFERENCES promocodes(id),
                     FOREIGN KEY (user_id) REFERENCES users(id),
                     UNIQUE(promocode_id, user_id)
@@ -71,23 +80,23 @@ class DatabaseInitializer:
             ''')
 
             # Таблица истории активности пользователей
-            cursor.execute('''
+            cursor.execute(f'''
                 CREATE TABLE IF NOT EXISTS user_activity_log (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     action TEXT NOT NULL,
                     details TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    timestamp INTEGER DEFAULT {NOW_EPOCH_SQL},
                     FOREIGN KEY (user_id) REFERENCES users(id)
                 )
             ''')
 
             # Таблица оплат
-            cursor.execute('''
+            cursor.execute(f'''
                 CREATE TABLE IF NOT EXISTS payments (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at INTEGER DEFAULT {NOW_EPOCH_SQL},
+                    updated_at INTEGER DEFAULT {NOW_EPOCH_SQL},
                     user_id INTEGER NOT NULL,
                     payment_id TEXT NOT NULL,
                     status TEXT NOT NULL,
@@ -97,17 +106,187 @@ class DatabaseInitializer:
                 );
             ''')
 
+            # Таблица состояния пользователей на VPN серверах: желаемое и примененное монитором
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS user_vpn_state (
+                    user_id INTEGER PRIMARY KEY,
+                    applied_server_id INTEGER,
+                    applied_state TEXT NOT NULL,
+                    synced_at INTEGER DEFAULT {NOW_EPOCH_SQL},
+                    user_uuid TEXT,
+                    desired_state TEXT,
+                    dirty BOOLEAN DEFAULT FALSE,
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    FOREIGN KEY (applied_server_id) REFERENCES servers(id)
+                )
+            ''')
+            DatabaseInitializer._ensure_columns(cursor, 'user_vpn_state', {
+                'user_uuid': 'TEXT',
+                'desired_state': 'TEXT',
+                'dirty': 'BOOLEAN DEFAULT FALSE',
+            })
+
+            # Ссылки подключения, полученные от VPN сервера при добавлении пользователя
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_vpn_links (
+                    user_id INTEGER PRIMARY KEY,
+                    server_id INTEGER NOT NULL,
+                    user_uuid TEXT NOT NULL,
+                    link_xtls TEXT,
+                    link_ws TEXT,
+                    link TEXT,
+                    links_version INTEGER DEFAULT 0,
+                    refreshed_at REAL NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )
+            ''')
+
+            # Очередь операций с VPN серверами (повторяется до успеха с экспоненциальной задержкой)
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS vpn_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    server_id INTEGER NOT NULL,
+                    user_uuid TEXT NOT NULL,
+                    email TEXT,
+                    operation TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    locked_until REAL DEFAULT 0,
+                    revision INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    created_at INTEGER DEFAULT {NOW_EPOCH_SQL},
+                    FOREIGN KEY (server_id) REFERENCES servers(id),
+                    UNIQUE(server_id, user_uuid)
+                )
+            ''')
+
+            # Метрики серверов: минутные и часовые значения задержки и нагрузки
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS server_metrics (
+                    server_id INTEGER NOT NULL,
+                    resolution INTEGER NOT NULL,
+                    bucket_start INTEGER NOT NULL,
+                    calls INTEGER DEFAULT 0,
+                    errors INTEGER DEFAULT 0,
+                    latency_p50 REAL,
+                    latency_p95 REAL,
+                    latency_max REAL,
+                    cpu_avg REAL,
+                    memory_avg REAL,
+                    load_samples INTEGER DEFAULT 0,
+                    PRIMARY KEY (server_id, resolution, bucket_start)
+                )
+            ''')
+
+            # Миграции пользователей между серверами и их переносы
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS migrations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    mode TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    source_servers TEXT NOT NULL,
+                    total INTEGER DEFAULT 0,
+                    moved INTEGER DEFAULT 0,
+                    skipped INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    estimate_seconds REAL,
+                    last_error TEXT,
+                    created_at INTEGER DEFAULT {NOW_EPOCH_SQL},
+                    started_at INTEGER,
+                    finished_at INTEGER
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS migration_moves (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    migration_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    from_server_id INTEGER NOT NULL,
+                    to_server_id INTEGER NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    FOREIGN KEY (migration_id) REFERENCES migrations(id)
+                )
+            ''')
+
+            # Аренда лидерства: фоновые задачи выполняет только один процесс
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS leader_leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    heartbeat_at REAL NOT NULL,
+                    acquired_at REAL NOT NULL
+                )
+            ''')
+
             # Создание индексов для оптимизации
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON users(subscription_end)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_server_id ON users(server_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_promocodes_code ON promocodes(code)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_vpn_state_dirty ON user_vpn_state(user_id) WHERE dirty = 1')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_vpn_outbox_next_attempt ON vpn_outbox(next_attempt_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_migration_moves_pending ON migration_moves(migration_id, attempts, id) '
+                           "WHERE status = 'pending'")
+
+            DatabaseInitializer._create_server_counters(cursor)
 
             conn.commit()
+
+            # Дальнейшие изменения схемы - версионные миграции (database/migrations.py)
+            if Config.DATABASE_AUTO_MIGRATE:
+                SchemaMigrator.migrate(conn)
+            SchemaMigrator.check()
+
             DatabaseInitializer._create_default_data(cursor, conn)
 
             logger.info("База данных успешно инициализирована")
 
+    @staticmethod
+    def _create_server_counters(cursor):
+        """Триггеры, поддерживающие servers.user_count, и пересчет счетчиков"""
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_server_count_insert
+            AFTER INSERT ON users WHEN NEW.server_id IS NOT NULL
+            BEGIN
+                UPDATE servers SET user_count = user_count + 1 WHERE id = NEW.server_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_server_count_delete
+            AFTER DELETE ON users WHEN OLD.server_id IS NOT NULL
+            BEGIN
+                UPDATE servers SET user_count = user_count - 1 WHERE id = OLD.server_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_server_count_update
+            AFTER UPDATE OF server_id ON users WHEN OLD.server_id IS NOT NEW.server_id
+            BEGIN
+                UPDATE servers SET user_count = user_count - 1 WHERE id = OLD.server_id;
+                UPDATE servers SET user_count = user_count + 1 WHERE id = NEW.server_id;
+            END
+        ''')
+
+        # Счетчики могли разойтись, если пользователей меняли до появления триггеров
+        cursor.execute('''
+            UPDATE servers SET user_count = (SELECT COUNT(*) FROM users WHERE users.server_id = servers.id)
+        ''')
+
+    @staticmethod
+    def _ensure_columns(cursor, table: str, columns: dict):
+        """Добавление недостающих колонок в существующую таблицу"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row['name'] for row in cursor.fetchall()}
+
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                logger.info(f"Добавлена колонка {table}.{name}")
+
     @staticmethod
     def _create_default_data(cursor, conn):
         """Создание данных по умолчанию"""
@@ -16,12 +16,18 @@ Configuration.account_id = Config.YOOKASSA_SHOP_ID
 Configuration.secret_key = Config.YOOKASSA_SECRET_KEY
 
 # планировщик с отдельной бд
+# Запускается на паузе: задачи добавляет любой процесс, а выполняет только ведущий (background/leader.py)
 scheduler = BackgroundScheduler(
     jobstores={
         'default': SQLAlchemyJobStore(url='sqlite:///jobs.db')
+    },
+    job_defaults={
+        # Списание, пропущенное во время смены ведущего процесса, выполняется с опозданием
+        'misfire_grace_time': None,
+        'coalesce': True
     }
 )
-scheduler.start()
+scheduler.start(paused=True)
 
 
 class PaymentYK:
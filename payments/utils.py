@@ -1,5 +1,8 @@
 from database.connection import db_manager
-from datetime import datetime, timedelta
+from services.sync_state_service import SyncStateService
+from utils.event_bus import event_bus, EVENT_SUBSCRIPTION_CHANGED
+from utils.helpers import now_timestamp, from_timestamp
+from datetime import datetime
 
 import logging
 
@@ -12,7 +15,7 @@ class PaymentDB:
     @staticmethod
     def get_user(user_id: int) -> dict | None:
         """Получение данных пользователя"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM users where id = ?", (user_id, ))
             row = cursor.fetchone()
@@ -33,9 +36,9 @@ class PaymentDB:
             cursor = conn.execute(
                 '''
                 INSERT INTO payments (user_id, payment_id, status, duration_days, amount, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
                 ''',
-                (user_id, payment_id, status, duration_days, amount)
+                (user_id, payment_id, status, duration_days, amount, now_timestamp(), now_timestamp())
             )
             conn.commit()
 
@@ -49,10 +52,10 @@ class PaymentDB:
             cursor = conn.execute(
                 '''
                 UPDATE payments
-                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                SET status = ?, updated_at = ?
                 WHERE payment_id = ?
                 ''',
-                (status, payment_id)
+                (status, now_timestamp(), payment_id)
             )
             conn.commit()
 
@@ -66,10 +69,10 @@ class PaymentDB:
             conn.execute(
                 '''
                 UPDATE users
-                SET is_refuse_payment = ?, updated_at = CURRENT_TIMESTAMP
+                SET is_refuse_payment = ?, updated_at = ?
                 WHERE id = ?
                 ''',
-                (is_refuse, user_id)
+                (is_refuse, now_timestamp(), user_id)
             )
             conn.commit()
 
@@ -79,7 +82,7 @@ class PaymentDB:
         Продлевает подписку пользователя.
         Если подписка уже истекла — стартует с текущего момента.
         Если подписка ещё активна — прибавляет срок к существующей дате.
-        Возвращает новый срок подписки в ISO-формате.
+        Возвращает новый срок подписки.
         """
         with db_manager.get_connection() as conn:
             cursor = conn.cursor()
@@ -94,21 +97,19 @@ class PaymentDB:
                 raise ValueError(f"У пользователя id={user_id} неактивен аккаунт (is_active=0)")
 
             # 3. Считаем новую дату окончания подписки
-            now = datetime.now()
-            if subscription_end < now:
-                new_end = now + timedelta(days=duration_days)
-            else:
-                new_end = subscription_end + timedelta(days=duration_days)
-
-            new_end_str = new_end.strftime('%Y-%m-%d %H:%M:%S')
+            now = now_timestamp()
+            new_end = max(subscription_end, now) + duration_days * 86400
 
             # 4. Обновляем в БД
             cursor.execute(
-                "UPDATE users SET subscription_end = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (new_end_str, user_id)
+                "UPDATE users SET subscription_end = ?, updated_at = ? WHERE id = ?",
+                (new_end, now, user_id)
             )
+            SyncStateService.mark_dirty(cursor, user_id, SyncStateService.desired_state_for(new_end))
             conn.commit()
-            return new_end
+
+        event_bus.publish(EVENT_SUBSCRIPTION_CHANGED, user_id=user_id)
+        return from_timestamp(new_end)
 
 
 
@@ -5,5 +5,20 @@
 from .user_service import UserService
 from .server_service import ServerService
 from .subscription_service import SubscriptionService
+from .sync_state_service import SyncStateService
+from .outbox_service import OutboxService
+from .reconcile_service import ReconcileService
+from .node_client import AsyncNodeClient, node_client
+from .status_cache import ServerStatusCache, server_status_cache
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_breakers
+from .metrics_service import ServerMetricsService, server_metrics
+from .server_placement import ServerPlacement, server_placement
+from .vpn_link_service import VpnLinkService
+from .migration_service import MigrationService
+from .count_cache import CountCache, user_count_cache
 
-__all__ = ['UserService', 'ServerService', 'SubscriptionService']
\ No newline at end of file
+__all__ = ['UserService', 'ServerService', 'SubscriptionService', 'SyncStateService', 'OutboxService',
+           'ReconcileService', 'AsyncNodeClient', 'node_client', 'ServerStatusCache', 'server_status_cache',
+           'CircuitBreaker', 'CircuitOpenError', 'circuit_breakers', 'ServerMetricsService', 'server_metrics',
+           'ServerPlacement', 'server_placement', 'VpnLinkService',
+           'MigrationService', 'CountCache', 'user_count_cache']
\ No newline at end of file
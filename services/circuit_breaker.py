@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from utils.helpers import server_key
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(ConnectionError):
+    """Запрос к серверу не выполнен: автомат сервера разомкнут"""
+
+
+class CircuitBreaker:
+    """Автомат защиты запросов к одному VPN серверу.
+
+    closed - запросы идут, учитываются ошибки и медленные ответы последних вызовов;
+    open - при высокой доле ошибок или медленных ответов запросы сразу отклоняются;
+    half_open - по истечении BREAKER_OPEN_SECONDS пропускается пробный запрос,
+    по его результату автомат замыкается или снова размыкается.
+
+    allow_request() выдает разрешение с номером состояния автомата, record()
+    учитывает результат только с разрешением текущего состояния: медленный
+    запрос, начатый до размыкания, не замыкает автомат вместо пробного.
+    """
+
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.STATE_CLOSED
+        self.opened_at = 0.0
+        self._calls = deque(maxlen=Config.BREAKER_WINDOW)  # (успех, медленный ответ)
+        self._trial_calls = 0
+        self._generation = 0  # Номер состояния: меняется при каждом переключении
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> Optional[Tuple[int, bool]]:
+        """Разрешение на запрос (номер состояния, пробный ли запрос) или None.
+
+        В half_open выдается ограниченное число пробных разрешений.
+        """
+        with self._lock:
+            if self.state == self.STATE_OPEN:
+                if time.time() - self.opened_at < Config.BREAKER_OPEN_SECONDS:
+                    return None
+                self._set_state(self.STATE_HALF_OPEN)
+                self._trial_calls = 0
+                logger.info(f"Автомат сервера {self.name}: пробный запрос")
+
+            if self.state == self.STATE_HALF_OPEN:
+                if self._trial_calls >= Config.BREAKER_HALF_OPEN_CALLS:
+                    return None
+                self._trial_calls += 1
+                return self._generation, True
+
+            return self._generation, False
+
+    def record(self, permit: Tuple[int, bool], success: bool, latency: float):
+        """Учет результата запроса, выполненного по разрешению allow_request()"""
+        slow = latency >= Config.BREAKER_SLOW_CALL_SECONDS
+        generation, is_trial = permit
+
+        with self._lock:
+            # Запрос начат в другом состоянии автомата - его результат уже не показателен
+            if generation != self._generation:
+                return
+
+            if is_trial:
+                if success and not slow:
+                    self._set_state(self.STATE_CLOSED)
+                    self._calls.clear()
+                    logger.info(f"Автомат сервера {self.name} замкнут: сервер отвечает")
+                else:
+                    self._open()
+                return
+
+            self._calls.append((success, slow))
+            if self.state == self.STATE_CLOSED and len(self._calls) >= Config.BREAKER_MIN_CALLS:
+                error_rate, slow_rate = self._rates()
+                if error_rate >= Config.BREAKER_ERROR_RATE or slow_rate >= Config.BREAKER_SLOW_CALL_RATE:
+                    self._open()
+
+    def reset(self):
+        """Принудительное замыкание автомата"""
+        with self._lock:
+            self._set_state(self.STATE_CLOSED)
+            self._calls.clear()
+
+    def snapshot(self) -> Dict:
+        """Состояние автомата для отображения"""
+        with self._lock:
+            error_rate, slow_rate = self._rates()
+            retry_in = None
+            if self.state == self.STATE_OPEN:
+                retry_in = max(0, round(self.opened_at + Config.BREAKER_OPEN_SECONDS - time.time()))
+
+            return {
+                'state': self.state,
+                'calls': len(self._calls),
+                'error_rate': round(error_rate * 100),
+                'slow_rate': round(slow_rate * 100),
+                # Оценка здоровья сервера 0-100 по последним запросам
+                'health': 0 if self.state == self.STATE_OPEN else round((1 - error_rate) * (1 - slow_rate / 2) * 100),
+                'retry_in': retry_in
+            }
+
+    def _rates(self):
+        if not self._calls:
+            return 0.0, 0.0
+        errors = sum(1 for success, _ in self._calls if not success)
+        slow = sum(1 for _, is_slow in self._calls if is_slow)
+        return errors / len(self._calls), slow / len(self._calls)
+
+    def _set_state(self, state: str):
+        self.state = state
+        self._generation += 1
+
+    def _open(self):
+        self._set_state(self.STATE_OPEN)
+        self.opened_at = time.time()
+        self._calls.clear()
+        logger.warning(f"Автомат сервера {self.name} разомкнут на {Config.BREAKER_OPEN_SECONDS} с")
+
+
+class CircuitBreakerRegistry:
+    """Автоматы защиты по серверам"""
+
+    def __init__(self):
+        self._breakers: Dict[object, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, server: Dict) -> CircuitBreaker:
+        """Автомат сервера (создается при первом обращении)"""
+        key = server_key(server)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(server.get('name') or server['api_url'])
+                self._breakers[key] = breaker
+            return breaker
+
+    def snapshot(self, server_id: int) -> Optional[Dict]:
+        """Состояние автомата сервера или None, если к серверу еще не было запросов"""
+        with self._lock:
+            breaker = self._breakers.get(server_id)
+        return breaker.snapshot() if breaker else None
+
+    def remove(self, server_id: int):
+        """Удаление автомата (после изменения или удаления сервера)"""
+        with self._lock:
+            self._breakers.pop(server_id, None)
+
+
+# Глобальный реестр автоматов защиты
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,51 @@
+import threading
+import time
+from typing import Callable, Dict, Hashable, Tuple
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CountCache:
+    """Кэш результатов COUNT(*) для списков с фильтрами.
+
+    Точное количество строк по произвольному фильтру требует полного
+    прохода по таблице, поэтому итоги для постраничного вывода
+    пересчитываются не чаще раза в USERS_COUNT_CACHE_TTL секунд на фильтр
+    и могут отставать от таблицы на это время.
+    """
+
+    # Предел записей: фильтры с поиском по произвольной строке не должны копиться
+    MAX_ENTRIES = 256
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[float, object]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], object]):
+        """Значение из кэша или результат compute() (сохраняется на время TTL)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        value = compute()
+
+        with self._lock:
+            if len(self._entries) >= self.MAX_ENTRIES:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.MAX_ENTRIES:
+                    self._entries.clear()
+            self._entries[key] = (now + Config.USERS_COUNT_CACHE_TTL, value)
+        return value
+
+    def invalidate(self):
+        """Сброс всех итогов (после добавления или удаления строк)"""
+        with self._lock:
+            self._entries.clear()
+
+
+# Глобальный кэш итогов списка пользователей (в памяти процесса)
+user_count_cache = CountCache()
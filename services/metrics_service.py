@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from database.connection import db_manager
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+RESOLUTION_MINUTE = 60
+RESOLUTION_HOUR = 3600
+
+
+# Взвешенное объединение минутных значений (перцентили - приближенно, по числу запросов)
+_AGGREGATE_COLUMNS = '''
+    SUM(calls), SUM(errors),
+    SUM(latency_p50 * calls) / NULLIF(SUM(CASE WHEN latency_p50 IS NOT NULL THEN calls END), 0),
+    SUM(latency_p95 * calls) / NULLIF(SUM(CASE WHEN latency_p95 IS NOT NULL THEN calls END), 0),
+    MAX(latency_max),
+    SUM(cpu_avg * load_samples) / NULLIF(SUM(CASE WHEN cpu_avg IS NOT NULL THEN load_samples END), 0),
+    SUM(memory_avg * load_samples) / NULLIF(SUM(CASE WHEN memory_avg IS NOT NULL THEN load_samples END), 0),
+    SUM(load_samples)
+'''
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[int(round(q * (len(sorted_values) - 1)))]
+
+
+class ServerMetricsService:
+    """Временные ряды задержки и нагрузки VPN серверов.
+
+    Каждый запрос к API сервера и каждая проверка статуса пишут отсчет в
+    кольцевой буфер сервера фиксированного размера (в памяти процесса).
+    Завершенные минуты сворачиваются в таблицу server_metrics, часовые
+    значения пересчитываются из минутных. Страницы читают только БД.
+    """
+
+    def __init__(self):
+        self._calls: Dict[int, deque] = {}  # (время, задержка мс, успех)
+        self._loads: Dict[int, deque] = {}  # (время, CPU %, память %)
+        self._flushed_until = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Сохранения выполняются по одному
+
+    def record_call(self, server: Dict, latency: float, success: bool):
+        """Отсчет запроса к API сервера (задержка в секундах)"""
+        if 'id' not in server:
+            return
+        self._buffer(self._calls, server['id']).append((time.time(), latency * 1000, success))
+
+    def record_status(self, server: Dict, status: Dict):
+        """Отсчет нагрузки сервера из ответа на проверку статуса"""
+        system = status.get('system') or {}
+        cpu = self._to_float(system.get('cpu', {}).get('percent'))
+        memory = self._to_float(system.get('memory', {}).get('percent'))
+        if 'id' not in server or (cpu is None and memory is None):
+            return
+        self._buffer(self._loads, server['id']).append((time.time(), cpu, memory))
+
+    def flush(self, include_current: bool = False):
+        """Сохранение завершенных минут из буферов и пересчет часовых значений.
+
+        include_current - сохранить и отсчеты текущей минуты (при остановке);
+        остаток минуты допишется в ту же строку следующим сохранением.
+        """
+        with self._flush_lock:
+            return self._flush(include_current)
+
+    def _flush(self, include_current: bool) -> int:
+        now = time.time()
+        minute_end = now if include_current else now // RESOLUTION_MINUTE * RESOLUTION_MINUTE
+
+        # Граница сохраненного сдвигается только после записи: при ошибке
+        # те же отсчеты войдут в следующее сохранение
+        with self._lock:
+            flushed_from = self._flushed_until
+            call_buffers = {server_id: list(buffer) for server_id, buffer in self._calls.items()}
+            load_buffers = {server_id: list(buffer) for server_id, buffer in self._loads.items()}
+
+        buckets = {}
+        for server_id, samples in call_buffers.items():
+            for timestamp, latency, success in samples:
+                if flushed_from <= timestamp < minute_end:
+                    bucket = buckets.setdefault((server_id, int(timestamp // RESOLUTION_MINUTE * RESOLUTION_MINUTE)),
+                                                ([], [], []))
+                    bucket[0].append(latency)
+                    if not success:
+                        bucket[1].append(1)
+        for server_id, samples in load_buffers.items():
+            for timestamp, cpu, memory in samples:
+                if flushed_from <= timestamp < minute_end:
+                    bucket = buckets.setdefault((server_id, int(timestamp // RESOLUTION_MINUTE * RESOLUTION_MINUTE)),
+                                                ([], [], []))
+                    bucket[2].append((cpu, memory))
+
+        rows = []
+        for (server_id, bucket_start), (latencies, errors, loads) in buckets.items():
+            latencies.sort()
+            cpu_values = [cpu for cpu, _ in loads if cpu is not None]
+            memory_values = [memory for _, memory in loads if memory is not None]
+            rows.append((
+                server_id, RESOLUTION_MINUTE, bucket_start, len(latencies), len(errors),
+                _percentile(latencies, 0.5), _percentile(latencies, 0.95), latencies[-1] if latencies else None,
+                sum(cpu_values) / len(cpu_values) if cpu_values else None,
+                sum(memory_values) / len(memory_values) if memory_values else None,
+                len(loads)
+            ))
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            # Минуту могли записать и другие процессы - объединяем со взвешиванием по числу отсчетов
+            cursor.executemany('''
+                INSERT INTO server_metrics (server_id, resolution, bucket_start, calls, errors,
+                                            latency_p50, latency_p95, latency_max, cpu_avg, memory_avg, load_samples)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(server_id, resolution, bucket_start) DO UPDATE SET
+                    latency_p50 = COALESCE((latency_p50 * calls + excluded.latency_p50 * excluded.calls)
+                                           / (calls + excluded.calls), latency_p50, excluded.latency_p50),
+                    latency_p95 = COALESCE((latency_p95 * calls + excluded.latency_p95 * excluded.calls)
+                                           / (calls + excluded.calls), latency_p95, excluded.latency_p95),
+                    latency_max = COALESCE(MAX(latency_max, excluded.latency_max), latency_max, excluded.latency_max),
+                    cpu_avg = COALESCE((cpu_avg * load_samples + excluded.cpu_avg * excluded.load_samples)
+                                       / (load_samples + excluded.load_samples), cpu_avg, excluded.cpu_avg),
+                    memory_avg = COALESCE((memory_avg * load_samples + excluded.memory_avg * excluded.load_samples)
+                                          / (load_samples + excluded.load_samples), memory_avg, excluded.memory_avg),
+                    calls = calls + excluded.calls,
+                    errors = errors + excluded.errors,
+                    load_samples = load_samples + excluded.load_samples
+            ''', rows)
+
+            # Текущий и предыдущий час пересчитываем целиком из минутных значений
+            hour_start = int(now // RESOLUTION_HOUR * RESOLUTION_HOUR) - RESOLUTION_HOUR
+            cursor.execute(f'''
+                INSERT INTO server_metrics (server_id, resolution, bucket_start, calls, errors,
+                                            latency_p50, latency_p95, latency_max, cpu_avg, memory_avg, load_samples)
+                SELECT server_id, ?, bucket_start / ? * ?, {_AGGREGATE_COLUMNS}
+                FROM server_metrics
+                WHERE resolution = ? AND bucket_start >= ?
+                GROUP BY server_id, bucket_start / ?
+                ON CONFLICT(server_id, resolution, bucket_start) DO UPDATE SET
+                    calls = excluded.calls, errors = excluded.errors,
+                    latency_p50 = excluded.latency_p50, latency_p95 = excluded.latency_p95,
+                    latency_max = excluded.latency_max, cpu_avg = excluded.cpu_avg,
+                    memory_avg = excluded.memory_avg, load_samples = excluded.load_samples
+            ''', (RESOLUTION_HOUR, RESOLUTION_HOUR, RESOLUTION_HOUR, RESOLUTION_MINUTE, hour_start, RESOLUTION_HOUR))
+
+            # Хранение: минутные значения - METRICS_MINUTE_RETENTION, часовые - METRICS_HOUR_RETENTION
+            cursor.execute("DELETE FROM server_metrics WHERE resolution = ? AND bucket_start < ?",
+                           (RESOLUTION_MINUTE, now - Config.METRICS_MINUTE_RETENTION))
+            cursor.execute("DELETE FROM server_metrics WHERE resolution = ? AND bucket_start < ?",
+                           (RESOLUTION_HOUR, now - Config.METRICS_HOUR_RETENTION))
+            conn.commit()
+
+        with self._lock:
+            self._flushed_until = minute_end
+
+        return len(rows)
+
+    @staticmethod
+    def get_summary(server_id: int, seconds: int = 3600) -> Optional[Dict]:
+        """Сводка по серверу за последние seconds секунд (из минутных значений)"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {_AGGREGATE_COLUMNS}
+                FROM server_metrics
+                WHERE server_id = ? AND resolution = ? AND bucket_start >= ?
+            ''', (server_id, RESOLUTION_MINUTE, time.time() - seconds))
+            row = cursor.fetchone()
+
+        if not row or row[0] is None:
+            return None
+
+        calls, errors, p50, p95, latency_max, cpu, memory, _ = row
+        return {
+            'calls': calls,
+            'error_rate': round(errors / calls * 100, 1) if calls else 0,
+            'latency_p50': round(p50) if p50 is not None else None,
+            'latency_p95': round(p95) if p95 is not None else None,
+            'latency_max': round(latency_max) if latency_max is not None else None,
+            'cpu_avg': round(cpu, 1) if cpu is not None else None,
+            'memory_avg': round(memory, 1) if memory is not None else None
+        }
+
+    @staticmethod
+    def get_history(server_id: int, resolution: int = RESOLUTION_HOUR, limit: int = 24) -> List[Dict]:
+        """Последние значения ряда сервера, от старых к новым"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT bucket_start, calls, errors, latency_p50, latency_p95, latency_max, cpu_avg, memory_avg
+                FROM server_metrics
+                WHERE server_id = ? AND resolution = ?
+                ORDER BY bucket_start DESC
+                LIMIT ?
+            ''', (server_id, resolution, limit))
+            return [dict(row) for row in reversed(cursor.fetchall())]
+
+    def _buffer(self, buffers: Dict[int, deque], server_id: int) -> deque:
+        buffer = buffers.get(server_id)
+        if buffer is None:
+            with self._lock:
+                buffer = buffers.setdefault(server_id, deque(maxlen=Config.METRICS_RING_SIZE))
+        return buffer
+
+    @staticmethod
+    def _to_float(value) -> Optional[float]:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+
+# Глобальный экземпляр (буферы в памяти процесса)
+server_metrics = ServerMetricsService()
@@ -0,0 +1,336 @@
+import heapq
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+from database.connection import db_manager
+from services.metrics_service import server_metrics
+from utils.helpers import now_timestamp
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationService:
+    """Планирование и учет переноса пользователей между VPN серверами.
+
+    План строится по заполненности серверов (пользователей на единицу
+    емкости), переносы сохраняются в migration_moves и выполняются в фоне
+    (background/migration_runner.py), поэтому миграцию можно приостановить
+    и продолжить, в том числе после перезапуска сервиса.
+    """
+
+    MODE_DRAIN = 'drain'
+    MODE_REBALANCE = 'rebalance'
+
+    STATUS_RUNNING = 'running'
+    STATUS_PAUSED = 'paused'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CANCELLED = 'cancelled'
+
+    MOVE_PENDING = 'pending'
+    MOVE_DONE = 'done'
+    MOVE_SKIPPED = 'skipped'
+    MOVE_FAILED = 'failed'
+
+    @staticmethod
+    def plan(mode: str, source_server_ids: Iterable[int] = (),
+             target_server_ids: Optional[Iterable[int]] = None) -> Tuple[bool, str, Optional[Dict]]:
+        """Построение плана миграции без изменений (dry-run).
+
+        drain - перенос всех пользователей с серверов-источников,
+        rebalance - выравнивание заполненности серверов (по умолчанию всех активных).
+        """
+        try:
+            source_ids = set(source_server_ids)
+            servers = {server['id']: server for server in MigrationService._get_servers()}
+
+            if mode == MigrationService.MODE_DRAIN:
+                if not source_ids:
+                    return False, "Не выбраны серверы для освобождения", None
+                candidates = set(target_server_ids) if target_server_ids else set(servers)
+                targets = [servers[server_id] for server_id in candidates - source_ids
+                           if server_id in servers and servers[server_id]['is_active']]
+                if not targets:
+                    return False, "Нет активных серверов для переноса пользователей", None
+
+                moves = []
+                for server_id in sorted(source_ids):
+                    if server_id not in servers:
+                        return False, f"Сервер {server_id} не найден", None
+                    users = MigrationService._get_server_users(server_id)
+                    moves.extend(MigrationService._assign(users, server_id, targets))
+                    servers[server_id]['planned_count'] -= len(users)
+
+            elif mode == MigrationService.MODE_REBALANCE:
+                pool_ids = source_ids | set(target_server_ids or ())
+                pool = [server for server in servers.values()
+                        if server['is_active'] and (not pool_ids or server['id'] in pool_ids)]
+                if len(pool) < 2:
+                    return False, "Для выравнивания нужно минимум два активных сервера", None
+                moves = MigrationService._plan_rebalance(pool)
+
+            else:
+                return False, f"Неизвестный режим миграции: {mode}", None
+
+            plan = MigrationService._describe(mode, sorted(source_ids), moves, servers)
+            return True, f"Запланировано переносов: {len(moves)}", plan
+
+        except Exception as e:
+            logger.error(f"Ошибка планирования миграции: {e}")
+            return False, str(e), None
+
+    @staticmethod
+    def create(plan: Dict) -> Tuple[bool, str, Optional[int]]:
+        """Сохранение плана и запуск миграции в фоне"""
+        if not plan['moves']:
+            return False, "Переносить некого", None
+
+        try:
+            with db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO migrations (mode, status, source_servers, total, estimate_seconds, started_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (plan['mode'], MigrationService.STATUS_RUNNING, json.dumps(plan['source_servers']),
+                      plan['total'], plan['estimate_seconds'], now_timestamp()))
+                migration_id = cursor.lastrowid
+
+                cursor.executemany('''
+                    INSERT INTO migration_moves (migration_id, user_id, from_server_id, to_server_id)
+                    VALUES (?, ?, ?, ?)
+                ''', ((migration_id, user_id, from_id, to_id) for user_id, from_id, to_id, _ in plan['moves']))
+                conn.commit()
+
+            logger.info(f"Создана миграция {migration_id} ({plan['mode']}): {plan['total']} переносов")
+            return True, f"Миграция запущена: {plan['total']} переносов", migration_id
+
+        except Exception as e:
+            logger.error(f"Ошибка создания миграции: {e}")
+            return False, str(e), None
+
+    @staticmethod
+    def set_status(migration_id: int, status: str) -> Tuple[bool, str]:
+        """Приостановка, возобновление или отмена незавершенной миграции"""
+        allowed = {
+            MigrationService.STATUS_PAUSED: (MigrationService.STATUS_RUNNING,),
+            MigrationService.STATUS_RUNNING: (MigrationService.STATUS_PAUSED,),
+            MigrationService.STATUS_CANCELLED: (MigrationService.STATUS_RUNNING, MigrationService.STATUS_PAUSED),
+        }
+        if status not in allowed:
+            return False, "Недопустимый статус миграции"
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE migrations SET status = ?,
+                    finished_at = CASE WHEN ? = ? THEN ? ELSE finished_at END
+                WHERE id = ? AND status IN ({",".join("?" * len(allowed[status]))})
+            ''', (status, status, MigrationService.STATUS_CANCELLED, now_timestamp(), migration_id,
+                  *allowed[status]))
+            conn.commit()
+
+            if cursor.rowcount == 0:
+                return False, "Миграция не найдена или уже в этом состоянии"
+
+        logger.info(f"Миграция {migration_id}: статус {status}")
+        return True, "Статус миграции изменен"
+
+    @staticmethod
+    def get_migrations(limit: int = 20) -> List[Dict]:
+        """Последние миграции с прогрессом"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM migrations ORDER BY id DESC LIMIT ?", (limit,))
+            migrations = [dict(row) for row in cursor.fetchall()]
+
+        for migration in migrations:
+            migration['source_servers'] = json.loads(migration['source_servers'])
+            processed = migration['moved'] + migration['skipped'] + migration['failed']
+            migration['progress'] = round(processed / migration['total'] * 100, 1) if migration['total'] else 100
+        return migrations
+
+    @staticmethod
+    def get_next_running() -> Optional[Dict]:
+        """Самая ранняя выполняющаяся миграция"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM migrations WHERE status = ? ORDER BY id LIMIT 1",
+                           (MigrationService.STATUS_RUNNING,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_draining_server_ids() -> set:
+        """Серверы, освобождаемые незавершенными миграциями (на них не размещаются новые пользователи)"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT source_servers FROM migrations WHERE mode = ? AND status IN (?, ?)",
+                           (MigrationService.MODE_DRAIN, MigrationService.STATUS_RUNNING,
+                            MigrationService.STATUS_PAUSED))
+            return {server_id for row in cursor.fetchall() for server_id in json.loads(row[0])}
+
+    @staticmethod
+    def claim_moves(migration_id: int, limit: int) -> List[Dict]:
+        """Очередная пачка ожидающих переносов (сначала с меньшим числом попыток)"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM migration_moves
+                WHERE migration_id = ? AND status = ?
+                ORDER BY attempts, id
+                LIMIT ?
+            ''', (migration_id, MigrationService.MOVE_PENDING, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def finish_move(move: Dict, status: str, error: str = None):
+        """Фиксация результата переноса и прогресса миграции"""
+        counter = {MigrationService.MOVE_DONE: 'moved', MigrationService.MOVE_SKIPPED: 'skipped',
+                   MigrationService.MOVE_FAILED: 'failed'}
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            if status == MigrationService.MOVE_PENDING:
+                # Повтор на следующем проходе, пока не исчерпаны попытки
+                attempts = move['attempts'] + 1
+                if attempts >= Config.MIGRATION_MAX_ATTEMPTS:
+                    status = MigrationService.MOVE_FAILED
+                cursor.execute("UPDATE migration_moves SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                               (status, attempts, error, move['id']))
+                if status == MigrationService.MOVE_FAILED:
+                    cursor.execute("UPDATE migrations SET failed = failed + 1, last_error = ? WHERE id = ?",
+                                   (error, move['migration_id']))
+            else:
+                cursor.execute("UPDATE migration_moves SET status = ?, last_error = ? WHERE id = ?",
+                               (status, error, move['id']))
+                cursor.execute(f"UPDATE migrations SET {counter[status]} = {counter[status]} + 1 WHERE id = ?",
+                               (move['migration_id'],))
+            conn.commit()
+
+    @staticmethod
+    def complete_if_done(migration_id: int) -> bool:
+        """Завершение миграции, если ожидающих переносов не осталось"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE migrations SET status = ?, finished_at = ?
+                WHERE id = ? AND status = ? AND NOT EXISTS (
+                    SELECT 1 FROM migration_moves WHERE migration_id = ? AND status = ?
+                )
+            ''', (MigrationService.STATUS_COMPLETED, now_timestamp(), migration_id,
+                  MigrationService.STATUS_RUNNING, migration_id, MigrationService.MOVE_PENDING))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    @staticmethod
+    def _get_servers() -> List[Dict]:
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, is_active, user_count, capacity FROM servers")
+            servers = [dict(row) for row in cursor.fetchall()]
+
+        for server in servers:
+            server['capacity'] = server['capacity'] or Config.SERVER_DEFAULT_CAPACITY
+            server['planned_count'] = server['user_count']
+        return servers
+
+    @staticmethod
+    def _get_server_users(server_id: int, limit: int = -1) -> List[Tuple[int, bool]]:
+        """Пользователи сервера (id, активна ли подписка), начиная с новых"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, subscription_end > ? FROM users
+                WHERE server_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (now_timestamp(), server_id, limit))
+            return [(row[0], bool(row[1])) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _assign(users: List[Tuple[int, bool]], from_server_id: int, targets: List[Dict],
+                limits: Dict[int, int] = None) -> List[Tuple[int, int, int, bool]]:
+        """Распределение пользователей по наименее заполненным серверам.
+
+        Заполненность целевых серверов учитывается по мере распределения
+        (поле planned_count), limits ограничивает число принимаемых сервером.
+        """
+        heap = [((target['planned_count'] + 1) / target['capacity'], target['id']) for target in targets
+                if limits is None or limits.get(target['id'], 0) > 0]
+        heapq.heapify(heap)
+        by_id = {target['id']: target for target in targets}
+
+        moves = []
+        for user_id, active in users:
+            if not heap:
+                break
+            _, target_id = heapq.heappop(heap)
+            target = by_id[target_id]
+            moves.append((user_id, from_server_id, target_id, active))
+            target['planned_count'] += 1
+
+            if limits is not None:
+                limits[target_id] -= 1
+                if limits[target_id] <= 0:
+                    continue
+            heapq.heappush(heap, ((target['planned_count'] + 1) / target['capacity'], target_id))
+        return moves
+
+    @staticmethod
+    def _plan_rebalance(pool: List[Dict]) -> List[Tuple[int, int, int, bool]]:
+        """Перенос излишка с переполненных серверов на недогруженные до средней заполненности"""
+        total_users = sum(server['planned_count'] for server in pool)
+        average_fill = total_users / sum(server['capacity'] for server in pool)
+        tolerance = Config.MIGRATION_REBALANCE_TOLERANCE
+
+        donors, limits = [], {}
+        for server in pool:
+            ideal = round(average_fill * server['capacity'])
+            fill = server['planned_count'] / server['capacity']
+            if fill > average_fill + tolerance:
+                donors.append((server, server['planned_count'] - ideal))
+            elif fill < average_fill - tolerance:
+                limits[server['id']] = ideal - server['planned_count']
+
+        receivers = [server for server in pool if server['id'] in limits]
+        moves = []
+        for donor, excess in donors:
+            users = MigrationService._get_server_users(donor['id'], excess)
+            donor_moves = MigrationService._assign(users, donor['id'], receivers, limits)
+            donor['planned_count'] -= len(donor_moves)
+            moves.extend(donor_moves)
+        return moves
+
+    @staticmethod
+    def _describe(mode: str, source_server_ids: List[int], moves: List[Tuple[int, int, int, bool]],
+                  servers: Dict[int, Dict]) -> Dict:
+        """Сводка плана: потоки между серверами, итоговая заполненность и оценка длительности"""
+        flows, node_requests = {}, {}
+        for _, from_id, to_id, active in moves:
+            flows[(from_id, to_id)] = flows.get((from_id, to_id), 0) + 1
+            if active:
+                # Добавление на целевой сервер и удаление с исходного
+                node_requests[to_id] = node_requests.get(to_id, 0) + 1
+                node_requests[from_id] = node_requests.get(from_id, 0) + 1
+
+        # Серверы работают параллельно, каждый - не более чем MIGRATION_NODE_CONCURRENCY запросов
+        estimate = 0.0
+        for server_id, requests_count in node_requests.items():
+            summary = server_metrics.get_summary(server_id)
+            latency_ms = (summary or {}).get('latency_p50') or Config.MIGRATION_DEFAULT_LATENCY_MS
+            estimate = max(estimate, requests_count * latency_ms / 1000 / Config.MIGRATION_NODE_CONCURRENCY)
+
+        return {
+            'mode': mode,
+            'source_servers': source_server_ids,
+            'total': len(moves),
+            'active_users': sum(1 for move in moves if move[3]),
+            'estimate_seconds': round(estimate),
+            'flows': [{'from_server_id': from_id, 'from_server': servers[from_id]['name'],
+                       'to_server_id': to_id, 'to_server': servers[to_id]['name'], 'count': count}
+                      for (from_id, to_id), count in sorted(flows.items())],
+            'servers': [{'id': server['id'], 'name': server['name'], 'capacity': server['capacity'],
+                         'user_count': server['user_count'], 'planned_count': server['planned_count']}
+                        for server in servers.values()],
+            'moves': moves
+        }
@@ -0,0 +1,280 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, Tuple
+import requests
+from services.circuit_breaker import CircuitOpenError, circuit_breakers
+from services.metrics_service import server_metrics
+from services.node_sessions import node_sessions, node_timeout
+from utils.helpers import server_key
+from config import Config
+import logging
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp необязателен (не входит в зависимости): без него - requests в пуле потоков
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncNodeClient:
+    """Асинхронный клиент API VPN серверов.
+
+    Операции с серверами - корутины, которые выполняются в собственном цикле
+    событий клиента (отдельный поток); синхронный код вызывает их через run().
+    По умолчанию HTTP запросы выполняются блокирующим requests через
+    keep-alive сессии серверов (node_sessions) в пуле из
+    NODE_ASYNC_MAX_CONNECTIONS потоков: один поток на выполняющийся запрос.
+    Если установлен необязательный aiohttp, запросы идут через его общий пул
+    соединений (TCPConnector) и выполняются конкурентно без пула потоков.
+
+    Одинаковые одновременные запросы пользователя (сервер, UUID) объединяются:
+    пока запрос выполняется, повторные вызовы ждут его результат, а не
+    отправляют новый (в том числе повторное добавление на сервер).
+    """
+
+    def __init__(self):
+        self._sessions: Dict[asyncio.AbstractEventLoop, Any] = {}
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def run(self, coro: Coroutine) -> Any:
+        """Выполнение корутины из синхронного кода с ожиданием результата"""
+        return self.submit(coro).result()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Запуск корутины из синхронного кода без ожидания результата"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    def close(self):
+        """Закрытие пула соединений и цикла событий клиента"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join(timeout=5)
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def aclose(self):
+        """Закрытие пула соединений текущего цикла событий"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def get_server_status(self, server: Dict) -> Dict:
+        """Получение статуса сервера через API"""
+        try:
+            status, data = await self._request(server, 'GET', '/api/server/status', 'status')
+
+            if status == 200:
+                return data
+            else:
+                return {"error": f"HTTP {status}"}
+
+        except CircuitOpenError:
+            return {"error": "Сервер недоступен (запросы временно отключены)"}
+        except ConnectionError:
+            return {"error": "Сервер недоступен"}
+        except TimeoutError:
+            return {"error": "Таймаут соединения"}
+        except Exception as e:
+            return {"error": f"Ошибка: {str(e)}"}
+
+    async def add_user_to_vpn_server(self, server: Dict, user_uuid: str, email: str) -> Optional[Dict]:
+        """Добавление пользователя на VPN сервер"""
+        return await self._single_flight(('provision', server_key(server), user_uuid),
+                                         lambda: self._add_user(server, user_uuid, email))
+
+    async def ensure_user_on_vpn_server(self, server: Dict, user_uuid: str, email: str) -> Optional[Dict]:
+        """Данные пользователя с VPN сервера; если его там нет - добавление"""
+        async def ensure():
+            data = await self.get_user_from_vpn_server(server, user_uuid)
+            return data or await self._add_user(server, user_uuid, email)
+
+        return await self._single_flight(('provision', server_key(server), user_uuid), ensure)
+
+    async def _add_user(self, server: Dict, user_uuid: str, email: str) -> Optional[Dict]:
+        try:
+            status, data = await self._request(server, 'POST', '/api/clients/generate', 'add', json={
+                "email": email,
+                "id": user_uuid,
+                "flow": "xtls-rprx-vision"
+            })
+
+            if status == 200:
+                logger.info(f"Пользователь {email} добавлен на сервер {server['name']}")
+                return data
+            else:
+                logger.error(f"Ошибка добавления пользователя {email}: HTTP {status}")
+                return None
+
+        except Exception as e:
+            logger.error(f"Исключение при добавлении пользователя {email}: {e}")
+            return None
+
+    async def remove_user_from_vpn_server(self, server: Dict, user_uuid: str) -> bool:
+        """Удаление пользователя с VPN сервера"""
+        try:
+            status, _ = await self._request(server, 'DELETE', f'/api/clients/{user_uuid}', 'remove')
+
+            # 404 - пользователя на сервере уже нет, результат тот же
+            success = status in (200, 404)
+            if success:
+                logger.info(f"Пользователь {user_uuid} удален с сервера {server['name']}")
+            else:
+                logger.error(f"Ошибка удаления пользователя {user_uuid}: HTTP {status}")
+
+            return success
+
+        except Exception as e:
+            logger.error(f"Исключение при удалении пользователя {user_uuid}: {e}")
+            return False
+
+    async def get_user_from_vpn_server(self, server: Dict, user_uuid: str) -> Optional[Dict]:
+        """Получение информации о пользователе с VPN сервера"""
+        return await self._single_flight(('get', server_key(server), user_uuid),
+                                         lambda: self._get_user(server, user_uuid))
+
+    async def _get_user(self, server: Dict, user_uuid: str) -> Optional[Dict]:
+        try:
+            status, data = await self._request(server, 'GET', f'/api/clients/{user_uuid}', 'get')
+            return data if status == 200 else None
+
+        except Exception as e:
+            logger.error(f"Исключение при получении пользователя {user_uuid}: {e}")
+            return None
+
+    async def list_vpn_server_clients(self, server: Dict) -> Optional[List[Dict]]:
+        """Получение полного списка пользователей VPN сервера"""
+        try:
+            status, data = await self._request(server, 'GET', '/api/clients', 'list')
+
+            if status != 200:
+                logger.error(f"Ошибка получения списка пользователей сервера {server['name']}: HTTP {status}")
+                return None
+
+            return data.get('clients', []) if isinstance(data, dict) else data
+
+        except Exception as e:
+            logger.error(f"Исключение при получении списка пользователей сервера {server['name']}: {e}")
+            return None
+
+    async def _single_flight(self, key: tuple, factory: Callable[[], Awaitable]) -> Any:
+        """Выполнение операции с объединением одновременных вызовов с тем же ключом"""
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Отмена одного из ожидающих не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    async def _request(self, server: Dict, method: str, path: str, api_method: str,
+                       json: Dict = None) -> Tuple[int, Any]:
+        """HTTP запрос к API сервера через автомат защиты сервера.
+
+        При разомкнутом автомате запрос не выполняется (CircuitOpenError),
+        ошибки, ответы 5xx и время ответа учитываются автоматом.
+        """
+        breaker = circuit_breakers.get(server)
+        permit = breaker.allow_request()
+        if permit is None:
+            raise CircuitOpenError(f"Запросы к серверу {server.get('name') or server['api_url']} временно отключены")
+
+        started = time.monotonic()
+        try:
+            status, data = await self._send(server, method, path, api_method, json)
+        except Exception:
+            self._record(server, breaker, permit, False, time.monotonic() - started)
+            raise
+
+        self._record(server, breaker, permit, status < 500, time.monotonic() - started)
+        return status, data
+
+    @staticmethod
+    def _record(server: Dict, breaker, permit: Tuple[int, bool], success: bool, latency: float):
+        """Учет результата запроса автоматом защиты и метриками сервера"""
+        breaker.record(permit, success, latency)
+        server_metrics.record_call(server, latency, success)
+
+    async def _send(self, server: Dict, method: str, path: str, api_method: str,
+                    json: Dict = None) -> Tuple[int, Any]:
+        """HTTP запрос к API сервера. Возвращает (код ответа, JSON при коде 200).
+
+        Ошибки соединения и таймауты приводятся к ConnectionError и TimeoutError.
+        """
+        url = f"{server['api_url']}{path}"
+        connect_timeout, read_timeout = node_timeout(api_method)
+
+        if aiohttp is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), self._request_sync, server, method, url, api_method, json
+            )
+
+        try:
+            async with self._get_session().request(
+                method, url,
+                headers={"X-API-Token": server['api_token']},
+                json=json,
+                timeout=aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+            ) as response:
+                data = await response.json(content_type=None) if response.status == 200 else None
+                return response.status, data
+        except aiohttp.ClientConnectionError as e:
+            raise ConnectionError(str(e)) from e
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(f"Таймаут запроса {method} {url}") from e
+
+    @staticmethod
+    def _request_sync(server: Dict, method: str, url: str, api_method: str, json: Dict = None) -> Tuple[int, Any]:
+        """Запрос через keep-alive сессию requests (если aiohttp не установлен)"""
+        try:
+            response = node_sessions.get(server).request(method, url, json=json, timeout=node_timeout(api_method))
+            return response.status_code, response.json() if response.status_code == 200 else None
+        except requests.exceptions.ConnectionError as e:
+            raise ConnectionError(str(e)) from e
+        except requests.exceptions.Timeout as e:
+            raise TimeoutError(str(e)) from e
+
+    def _get_session(self):
+        # Сессия aiohttp привязана к циклу событий: своя на каждый цикл, в котором вызывается клиент
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                limit=Config.NODE_ASYNC_MAX_CONNECTIONS,
+                limit_per_host=Config.NODE_HTTP_POOL_SIZE
+            ))
+            self._sessions[loop] = session
+        return session
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=Config.NODE_ASYNC_MAX_CONNECTIONS,
+                                                    thread_name_prefix="node-client")
+            return self._executor
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever,
+                                                     name="node-client-loop", daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+
+# Глобальный клиент: общий пул соединений для всего процесса
+node_client = AsyncNodeClient()
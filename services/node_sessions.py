@@ -0,0 +1,77 @@
+import threading
+from typing import Dict, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from utils.helpers import server_key
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class NodeSessionRegistry:
+    """Реестр HTTP сессий к API VPN серверов.
+
+    У каждого сервера своя сессия с пулом keep-alive соединений, поэтому
+    частые короткие запросы не открывают каждый раз новое TCP/TLS соединение.
+    Сессия пересоздается, если у сервера изменились api_url или api_token.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[object, Tuple[requests.Session, str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, server: Dict) -> requests.Session:
+        """Сессия для запросов к серверу"""
+        key = server_key(server)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry and entry[1:] == (server['api_url'], server['api_token']):
+                return entry[0]
+
+            if entry:
+                entry[0].close()
+
+            session = self._create_session(server)
+            self._sessions[key] = (session, server['api_url'], server['api_token'])
+            return session
+
+    def invalidate(self, server_id: int):
+        """Закрытие сессии сервера (после изменения или удаления)"""
+        with self._lock:
+            entry = self._sessions.pop(server_id, None)
+
+        if entry:
+            entry[0].close()
+            logger.info(f"Сессия сервера ID {server_id} закрыта")
+
+    def close_all(self):
+        """Закрытие всех сессий"""
+        with self._lock:
+            entries = list(self._sessions.values())
+            self._sessions.clear()
+
+        for session, _, _ in entries:
+            session.close()
+
+    @staticmethod
+    def _create_session(server: Dict) -> requests.Session:
+        session = requests.Session()
+        session.headers.update({"X-API-Token": server['api_token']})
+
+        # Повторы выполняет очередь vpn_outbox, на уровне HTTP их не делаем.
+        # При занятом пуле запрос ждет свободное соединение, а не открывает лишнее
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.NODE_HTTP_POOL_SIZE,
+                              max_retries=0, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+def node_timeout(method: str) -> Tuple[float, float]:
+    """Таймауты (подключение, чтение) для метода API сервера"""
+    return Config.NODE_HTTP_CONNECT_TIMEOUT, Config.NODE_HTTP_TIMEOUTS.get(method, Config.NODE_HTTP_DEFAULT_TIMEOUT)
+
+
+# Глобальный реестр сессий
+node_sessions = NodeSessionRegistry()
@@ -0,0 +1,167 @@
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from database.connection import db_manager
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxService:
+    """Очередь операций с VPN серверами (добавление/удаление пользователей).
+
+    На пару (сервер, UUID) хранится не больше одной операции: новая операция
+    заменяет ожидающую, а противоположная отменяет ее, только если ожидающая
+    ни разу не выполнялась и сама ничего не заменяла (revision = 0). Иначе
+    состояние пользователя на сервере неизвестно и операция заменяется.
+    """
+
+    OP_ADD = 'add'
+    OP_REMOVE = 'remove'
+
+    @staticmethod
+    def enqueue_many(operations: Iterable[Tuple[Optional[int], int, str, Optional[str], str]]) -> int:
+        """Постановка операций (user_id, server_id, uuid, email, operation) в очередь.
+
+        Возвращает количество добавленных или замененных операций.
+        """
+        now = time.time()
+        queued = 0
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+
+            for user_id, server_id, user_uuid, email, operation in operations:
+                # Противоположная операция не выполнялась и ничего не заменяла - взаимно отменяем
+                cursor.execute('''
+                    DELETE FROM vpn_outbox
+                    WHERE server_id = ? AND user_uuid = ? AND operation != ?
+                      AND attempts = 0 AND revision = 0 AND locked_until <= ?
+                ''', (server_id, user_uuid, operation, now))
+                if cursor.rowcount:
+                    continue
+
+                cursor.execute('''
+                    INSERT INTO vpn_outbox (user_id, server_id, user_uuid, email, operation, next_attempt_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(server_id, user_uuid) DO UPDATE SET
+                        user_id = COALESCE(excluded.user_id, vpn_outbox.user_id),
+                        email = COALESCE(excluded.email, vpn_outbox.email),
+                        operation = excluded.operation,
+                        attempts = 0,
+                        next_attempt_at = excluded.next_attempt_at,
+                        last_error = NULL,
+                        revision = vpn_outbox.revision + 1
+                    WHERE vpn_outbox.operation != excluded.operation
+                       OR (vpn_outbox.user_id IS NULL AND excluded.user_id IS NOT NULL)
+                ''', (user_id, server_id, user_uuid, email, operation, now))
+                queued += cursor.rowcount
+
+            conn.commit()
+
+        return queued
+
+    @staticmethod
+    def _server_filter(exclude_servers: Iterable[int], only_servers: Optional[Iterable[int]]) -> Tuple[str, list]:
+        """Условие отбора операций по серверам и его параметры"""
+        exclude = list(exclude_servers)
+        sql = f"AND server_id NOT IN ({','.join('?' * len(exclude))})" if exclude else ""
+        if only_servers is None:
+            return sql, exclude
+
+        only = list(only_servers)
+        return sql + f" AND server_id IN ({','.join('?' * len(only))})", exclude + only
+
+    @staticmethod
+    def claim_due(limit: int, exclude_servers: Iterable[int] = (),
+                  only_servers: Optional[Iterable[int]] = None) -> List[Dict]:
+        """Захват готовых к выполнению операций с арендой на OUTBOX_LEASE_SECONDS.
+
+        only_servers ограничивает захват серверами, закрепленными за процессом.
+        """
+        if only_servers is not None and not only_servers:
+            return []
+
+        now = time.time()
+        server_filter, server_params = OutboxService._server_filter(exclude_servers, only_servers)
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE vpn_outbox SET locked_until = ?
+                WHERE id IN (
+                    SELECT id FROM vpn_outbox
+                    WHERE next_attempt_at <= ? AND locked_until <= ? {server_filter}
+                    ORDER BY next_attempt_at
+                    LIMIT ?
+                )
+                RETURNING *
+            ''', [now + Config.OUTBOX_LEASE_SECONDS, now, now] + server_params + [limit])
+            rows = [dict(row) for row in cursor.fetchall()]
+            conn.commit()
+
+        # Порядок постановки в пределах сервера
+        rows.sort(key=lambda row: row['id'])
+        return rows
+
+    @staticmethod
+    def complete(operation: Dict):
+        """Удаление выполненной операции (если ее не заменили за время выполнения)"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM vpn_outbox WHERE id = ? AND revision = ?",
+                           (operation['id'], operation['revision']))
+            if cursor.rowcount == 0:
+                cursor.execute("UPDATE vpn_outbox SET locked_until = 0 WHERE id = ?", (operation['id'],))
+            conn.commit()
+
+    @staticmethod
+    def fail(operation: Dict, error: str):
+        """Перенос неудачной операции с экспоненциальной задержкой"""
+        attempts = operation['attempts'] + 1
+        delay = min(Config.OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), Config.OUTBOX_RETRY_MAX_SECONDS)
+        delay *= random.uniform(0.9, 1.1)
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE vpn_outbox
+                SET attempts = ?, next_attempt_at = ?, last_error = ?, locked_until = 0
+                WHERE id = ? AND revision = ?
+            ''', (attempts, time.time() + delay, error, operation['id'], operation['revision']))
+            if cursor.rowcount == 0:
+                cursor.execute("UPDATE vpn_outbox SET locked_until = 0 WHERE id = ?", (operation['id'],))
+            conn.commit()
+
+        logger.warning(f"Операция {operation['operation']} для {operation['user_uuid']} "
+                       f"на сервере {operation['server_id']} не выполнена (попытка {attempts}), "
+                       f"повтор через {delay:.0f} с: {error}")
+
+    @staticmethod
+    def next_attempt_at(exclude_servers: Iterable[int] = (),
+                        only_servers: Optional[Iterable[int]] = None) -> Optional[float]:
+        """Время ближайшей незахваченной операции в очереди"""
+        if only_servers is not None and not only_servers:
+            return None
+
+        server_filter, server_params = OutboxService._server_filter(exclude_servers, only_servers)
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT next_attempt_at FROM vpn_outbox
+                WHERE locked_until <= ? {server_filter}
+                ORDER BY next_attempt_at
+                LIMIT 1
+            ''', [time.time()] + server_params)
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    @staticmethod
+    def get_pending_count() -> int:
+        """Количество операций в очереди"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM vpn_outbox")
+            return cursor.fetchone()[0]
@@ -0,0 +1,109 @@
+from typing import Dict, Iterable, Optional
+from database.connection import db_manager
+from services.server_service import ServerService
+from services.outbox_service import OutboxService
+from utils.helpers import now_timestamp
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileService:
+    """Сверка списка пользователей VPN сервера с БД"""
+
+    @staticmethod
+    def reconcile_server(server: Dict) -> Optional[Dict]:
+        """Сверка одного сервера: один запрос списка клиентов вместо запроса на каждого пользователя.
+
+        Недостающие активные пользователи ставятся в очередь на добавление,
+        на удаление - истекшие пользователи сервера и оставшиеся на нем
+        пользователи других серверов (кроме ожидающих переноса на этот сервер).
+        Клиенты, UUID которых нет в БД, удаляются при RECONCILE_REMOVE_UNKNOWN.
+        Возвращает статистику сверки или None, если список получить не удалось.
+        """
+        clients = ServerService.list_vpn_server_clients(server)
+        if clients is None:
+            return None
+
+        node_uuids = {client.get('id') or client.get('uuid') for client in clients} - {None}
+
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, uuid, email, subscription_end > ? AS is_active
+                FROM users
+                WHERE server_id = ?
+            ''', (now_timestamp(), server['id']))
+            users = [dict(row) for row in cursor.fetchall()]
+
+        users_by_uuid = {user['uuid']: user for user in users}
+        desired = {user['uuid']: user for user in users if user['is_active']}
+
+        operations = [(user['id'], server['id'], user_uuid, user['email'], OutboxService.OP_ADD)
+                      for user_uuid, user in desired.items() if user_uuid not in node_uuids]
+        added = len(operations)
+
+        extra_uuids = node_uuids - desired.keys()
+        foreign_uuids = extra_uuids - users_by_uuid.keys()
+        foreign = ReconcileService._get_foreign_clients(server['id'], foreign_uuids) if foreign_uuids else {}
+
+        for user_uuid in extra_uuids:
+            user = users_by_uuid.get(user_uuid)
+            if user is None:
+                if user_uuid in foreign:
+                    # Пользователь перенесен на сервер после выборки или переносится на него
+                    if foreign[user_uuid]:
+                        continue
+                elif not Config.RECONCILE_REMOVE_UNKNOWN:
+                    continue
+
+            # Для пользователей других серверов user_id не передается: удаление
+            # не должно менять их состояние на собственном сервере
+            operations.append((user['id'] if user else None, server['id'], user_uuid, None,
+                               OutboxService.OP_REMOVE))
+        removed = len(operations) - added
+
+        batch_size = Config.RECONCILE_BATCH_SIZE
+        for start in range(0, len(operations), batch_size):
+            OutboxService.enqueue_many(operations[start:start + batch_size])
+
+        if operations:
+            logger.info(f"Сверка сервера {server['name']}: {added} на добавление, {removed} на удаление")
+
+        return {
+            'server_id': server['id'],
+            'server_name': server['name'],
+            'on_server': len(node_uuids),
+            'expected': len(desired),
+            'added': added,
+            'removed': removed,
+            'user_ids': {user['id'] for user in users},
+            'active_user_ids': {user['id'] for user in desired.values()}
+        }
+
+    @staticmethod
+    def _get_foreign_clients(server_id: int, uuids: Iterable[str], chunk_size: int = 500) -> Dict[str, bool]:
+        """Клиенты сервера, принадлежащие пользователям БД не из его выборки.
+
+        Возвращает {uuid: нужно ли оставить клиента}: оставляются пользователи,
+        уже перенесенные на этот сервер, и пользователи с ожидающим переносом
+        на него (миграция добавляет их на новый сервер до смены server_id).
+        Текущий сервер и перенос проверяются одним запросом - согласованно.
+        """
+        uuids = list(uuids)
+        clients = {}
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(uuids), chunk_size):
+                chunk = uuids[start:start + chunk_size]
+                cursor.execute(f'''
+                    SELECT u.uuid, u.server_id = ? OR EXISTS (
+                        SELECT 1 FROM migration_moves m
+                        WHERE m.user_id = u.id AND m.to_server_id = ? AND m.status = 'pending'
+                    ) AS keep
+                    FROM users u
+                    WHERE u.uuid IN ({','.join('?' * len(chunk))})
+                ''', [server_id, server_id] + chunk)
+                clients.update((row[0], bool(row[1])) for row in cursor.fetchall())
+        return clients
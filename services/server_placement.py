@@ -0,0 +1,158 @@
+import heapq
+import threading
+import time
+from typing import Dict, List, Optional
+from database.connection import db_manager
+from services.circuit_breaker import CircuitBreaker, circuit_breakers
+from services.migration_service import MigrationService
+from services.status_cache import server_status_cache
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ServerPlacement:
+    """Выбор сервера для новых пользователей.
+
+    Рейтинг серверов хранится в памяти процесса в виде кучи: выбор берет
+    вершину, а изменение числа пользователей сервера добавляет в кучу новую
+    запись (старые отбрасываются по версии). Счетчики пользователей ведут
+    триггеры БД (servers.user_count), рейтинг перечитывается из БД раз в
+    PLACEMENT_REFRESH_INTERVAL секунд вместе со здоровьем и нагрузкой серверов.
+    Серверы, освобождаемые миграцией, в рейтинг не попадают.
+    """
+
+    TIER_AVAILABLE = 0
+    TIER_FULL = 1
+    TIER_UNHEALTHY = 2
+
+    def __init__(self):
+        self._servers: Dict[int, Dict] = {}
+        self._versions: Dict[int, int] = {}
+        self._heap: List[tuple] = []
+        self._loaded_at = 0.0
+        self._last_tier = self.TIER_AVAILABLE
+        self._lock = threading.Lock()
+
+    def pick(self, reserve: bool = False) -> Optional[Dict]:
+        """Сервер с лучшим рейтингом. reserve учитывает нового пользователя сразу"""
+        with self._lock:
+            if time.monotonic() - self._loaded_at > Config.PLACEMENT_REFRESH_INTERVAL:
+                self._reload()
+
+            while self._heap:
+                tier, _, server_id, version = self._heap[0]
+                if self._versions.get(server_id) == version:
+                    break
+                heapq.heappop(self._heap)
+            else:
+                return None
+
+            server = self._servers[server_id]
+            if tier != self._last_tier:
+                if tier == self.TIER_FULL:
+                    logger.warning(f"Все исправные серверы заполнены, выбран {server['name']} "
+                                   f"({server['user_count']}/{server['capacity']} пользователей)")
+                elif tier == self.TIER_UNHEALTHY:
+                    logger.warning(f"Нет исправных серверов, выбран {server['name']}: {server['health_issue']}")
+            self._last_tier = tier
+            if reserve:
+                self._adjust(server_id, 1)
+            return dict(server)
+
+    def release(self, server_id: Optional[int]):
+        """Учет удаления пользователя с сервера (или отмены резерва)"""
+        with self._lock:
+            self._adjust(server_id, -1)
+
+    def move(self, from_server_id: Optional[int], to_server_id: Optional[int]):
+        """Учет переноса пользователя между серверами"""
+        with self._lock:
+            self._adjust(from_server_id, -1)
+            self._adjust(to_server_id, 1)
+
+    def invalidate(self):
+        """Перечитать рейтинг при следующем выборе (после изменения серверов)"""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def get_ranking(self) -> List[Dict]:
+        """Текущий рейтинг активных серверов, от лучшего к худшему"""
+        with self._lock:
+            if time.monotonic() - self._loaded_at > Config.PLACEMENT_REFRESH_INTERVAL:
+                self._reload()
+            servers = [dict(server) for server in self._servers.values()]
+        servers.sort(key=lambda server: (server['tier'], server['score'], server['id']))
+        return servers
+
+    def _reload(self):
+        """Загрузка активных серверов, счетчиков и состояния одним запросом"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM servers WHERE is_active = TRUE")
+            rows = [dict(row) for row in cursor.fetchall()]
+
+        # С освобождаемых миграцией серверов пользователей переносят - новых туда не размещаем
+        draining = MigrationService.get_draining_server_ids()
+        rows = [server for server in rows if server['id'] not in draining]
+
+        self._servers = {}
+        self._heap = []
+        for server in rows:
+            server['capacity'] = server.get('capacity') or Config.SERVER_DEFAULT_CAPACITY
+            server['health_issue'], server['cpu'] = self._health(server['id'])
+            server['healthy'] = server['health_issue'] is None
+            self._servers[server['id']] = server
+            self._heap.append(self._rank(server))
+
+        heapq.heapify(self._heap)
+        self._loaded_at = time.monotonic()
+
+    def _adjust(self, server_id: Optional[int], delta: int):
+        server = self._servers.get(server_id)
+        if server is None:
+            return
+        server['user_count'] = max(0, server['user_count'] + delta)
+        heapq.heappush(self._heap, self._rank(server))
+
+    def _rank(self, server: Dict) -> tuple:
+        """Пересчет рейтинга сервера. Возвращает запись для кучи с новой версией"""
+        if not server['healthy']:
+            tier = self.TIER_UNHEALTHY
+        elif server['user_count'] >= server['capacity']:
+            tier = self.TIER_FULL
+        else:
+            tier = self.TIER_AVAILABLE
+
+        fill = (server['user_count'] + 1) / server['capacity']
+        score = fill * (1 + Config.PLACEMENT_CPU_WEIGHT * (server['cpu'] or 0) / 100)
+        server['tier'], server['score'] = tier, round(score, 4)
+
+        version = self._versions.get(server['id'], 0) + 1
+        self._versions[server['id']] = version
+        return tier, score, server['id'], version
+
+    @staticmethod
+    def _health(server_id: int):
+        """Причина недоступности сервера (None - исправен) и загрузка CPU
+        по последней проверке статуса и автомату защиты"""
+        breaker = circuit_breakers.snapshot(server_id)
+        if breaker and breaker['state'] == CircuitBreaker.STATE_OPEN:
+            return f"автомат защиты разомкнут (пробный запрос через {breaker['retry_in']} с)", None
+
+        entry = server_status_cache.peek(server_id)
+        if entry is None or time.time() - entry['checked_at'] > Config.SERVER_STATUS_STALE_AFTER:
+            return None, None
+        if entry['status'].get('error'):
+            return f"проверка статуса: {entry['status']['error']}", None
+
+        cpu = (entry['status'].get('system') or {}).get('cpu', {}).get('percent')
+        try:
+            return None, min(max(float(cpu), 0.0), 100.0)
+        except (TypeError, ValueError):
+            return None, None
+
+
+# Глобальный рейтинг серверов (в памяти процесса)
+server_placement = ServerPlacement()
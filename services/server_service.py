@@ -1,7 +1,11 @@
-import requests
 import json
 from typing import Dict, List, Optional, Tuple
 from database.connection import db_manager
+from services.circuit_breaker import circuit_breakers
+from services.node_client import node_client
+from services.node_sessions import node_sessions
+from services.server_placement import server_placement
+from services.status_cache import server_status_cache
 from utils.helpers import generate_user_email, generate_uuid
 import logging
 
@@ -14,7 +18,7 @@ class ServerService:
     @staticmethod
     def get_all_servers() -> List[Dict]:
         """Получение списка всех серверов"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM servers ORDER BY name")
             return [dict(row) for row in cursor.fetchall()]
@@ -22,7 +26,7 @@ class ServerService:
     @staticmethod
     def get_active_servers() -> List[Dict]:
         """Получение списка активных серверов"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM servers WHERE is_active = TRUE ORDER BY name")
             return [dict(row) for row in cursor.fetchall()]
@@ -30,23 +34,25 @@ class ServerService:
     @staticmethod
     def get_server_by_id(server_id: int) -> Optional[Dict]:
         """Получение сервера по ID"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM servers WHERE id = ?", (server_id,))
             row = cursor.fetchone()
             return dict(row) if row else None
 
     @staticmethod
-    def create_server(name: str, domain: str, api_url: str, api_token: str) -> Tuple[bool, str]:
-        """Создание нового сервера"""
+    def create_server(name: str, domain: str, api_url: str, api_token: str,
+                      capacity: int = 0) -> Tuple[bool, str]:
+        """Создание нового сервера (capacity 0 - емкость по умолчанию)"""
         try:
             with db_manager.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO servers (name, domain, api_url, api_token)
-                    VALUES (?, ?, ?, ?)
-                ''', (name, domain, api_url, api_token))
+                    INSERT INTO servers (name, domain, api_url, api_token, capacity)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (name, domain, api_url, api_token, capacity))
                 conn.commit()
+                server_placement.invalidate()
                 logger.info(f"Создан новый сервер: {name}")
                 return True, "Сервер успешно создан"
         except Exception as e:
@@ -54,21 +60,30 @@ class ServerService:
             return False, str(e)
 
     @staticmethod
-    def update_server(server_id: int, name: str, domain: str, api_url: str, api_token: str) -> Tuple[bool, str]:
-        """Обновление сервера"""
+    def update_server(server_id: int, name: str, domain: str, api_url: str, api_token: str,
+                      capacity: Optional[int] = None) -> Tuple[bool, str]:
+        """Обновление сервера (capacity None - не изменять).
+
+        Смена домена или адреса API сбрасывает сохраненные ссылки пользователей сервера.
+        """
         try:
             with db_manager.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE servers 
-                    SET name = ?, domain = ?, api_url = ?, api_token = ?
+                    SET name = ?, domain = ?, api_url = ?, api_token = ?, capacity = COALESCE(?, capacity),
+                        links_version = links_version + (domain != ? OR api_url != ?)
                     WHERE id = ?
-                ''', (name, domain, api_url, api_token, server_id))
+                ''', (name, domain, api_url, api_token, capacity, domain, api_url, server_id))
 
                 if cursor.rowcount == 0:
                     return False, "Сервер не найден"
 
                 conn.commit()
+                node_sessions.invalidate(server_id)
+                server_status_cache.invalidate(server_id)
+                circuit_breakers.remove(server_id)
+                server_placement.invalidate()
                 logger.info(f"Обновлен сервер ID {server_id}")
                 return True, "Сервер успешно обновлен"
         except Exception as e:
@@ -87,7 +102,8 @@ class ServerService:
                 user_count = cursor.fetchone()[0]
 
                 if user_count > 0:
-                    return False, f"Нельзя удалить сервер с {user_count} пользователями"
+                    return False, (f"Нельзя удалить сервер с {user_count} пользователями - "
+                                   "сначала перенесите их миграцией")
 
                 cursor.execute("DELETE FROM servers WHERE id = ?", (server_id,))
 
@@ -95,6 +111,10 @@ class ServerService:
                     return False, "Сервер не найден"
 
                 conn.commit()
+                node_sessions.invalidate(server_id)
+                server_status_cache.invalidate(server_id)
+                circuit_breakers.remove(server_id)
+                server_placement.invalidate()
                 logger.info(f"Удален сервер ID {server_id}")
                 return True, "Сервер успешно удален"
         except Exception as e:
@@ -117,6 +137,7 @@ class ServerService:
                 new_status = not row['is_active']
                 cursor.execute("UPDATE servers SET is_active = ? WHERE id = ?", (new_status, server_id))
                 conn.commit()
+                server_placement.invalidate()
 
                 status_text = "активирован" if new_status else "деактивирован"
                 logger.info(f"Сервер ID {server_id} {status_text}")
@@ -126,26 +147,14 @@ class ServerService:
             return False, str(e)
 
     @staticmethod
-    def get_least_loaded_server() -> Optional[Dict]:
-        """Получение наименее загруженного активного сервера"""
-        try:
-            servers = ServerService.get_active_servers()
-            if not servers:
-                return None
-
-            server_loads = []
-
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
+    def get_least_loaded_server(reserve: bool = False) -> Optional[Dict]:
+        """Получение наименее загруженного активного сервера с учетом емкости, здоровья и нагрузки.
 
-                for server in servers:
-                    cursor.execute("SELECT COUNT(*) FROM users WHERE server_id = ?", (server['id'],))
-                    user_count = cursor.fetchone()[0]
-                    server_loads.append((server, user_count))
-
-            # Сортируем по загрузке и возвращаем наименее загруженный
-            server_loads.sort(key=lambda x: x[1])
-            return server_loads[0][0] if server_loads else None
+        reserve=True сразу учитывает на выбранном сервере нового пользователя,
+        чтобы одновременные регистрации распределялись по серверам.
+        """
+        try:
+            return server_placement.pick(reserve)
 
         except Exception as e:
             logger.error(f"Ошибка получения наименее загруженного сервера: {e}")
@@ -154,91 +163,29 @@ class ServerService:
     @staticmethod
     def get_server_status(server: Dict) -> Dict:
         """Получение статуса сервера через API"""
-        try:
-            response = requests.get(
-                f"{server['api_url']}/api/server/status",
-                headers={"X-API-Token": server['api_token']},
-                timeout=10
-            )
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"error": f"HTTP {response.status_code}"}
-
-        except requests.exceptions.ConnectionError:
-            return {"error": "Сервер недоступен"}
-        except requests.exceptions.Timeout:
-            return {"error": "Таймаут соединения"}
-        except Exception as e:
-            return {"error": f"Ошибка: {str(e)}"}
+        return node_client.run(node_client.get_server_status(server))
 
     @staticmethod
     def add_user_to_vpn_server(server: Dict, user_uuid: str, email: str) -> Optional[Dict]:
         """Добавление пользователя на VPN сервер"""
-        try:
-            response = requests.post(
-                f"{server['api_url']}/api/clients/generate",
-                headers={
-                    "X-API-Token": server['api_token'],
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "email": email,
-                    "id": user_uuid,
-                    "flow": "xtls-rprx-vision"
-                },
-                timeout=10
-            )
-
-            if response.status_code == 200:
-                logger.info(f"Пользователь {email} добавлен на сервер {server['name']}")
-                return response.json()
-            else:
-                logger.error(f"Ошибка добавления пользователя {email}: HTTP {response.status_code}")
-                return None
+        return node_client.run(node_client.add_user_to_vpn_server(server, user_uuid, email))
 
-        except Exception as e:
-            logger.error(f"Исключение при добавлении пользователя {email}: {e}")
-            return None
+    @staticmethod
+    def ensure_user_on_vpn_server(server: Dict, user_uuid: str, email: str) -> Optional[Dict]:
+        """Получение пользователя с VPN сервера с добавлением, если его там нет"""
+        return node_client.run(node_client.ensure_user_on_vpn_server(server, user_uuid, email))
 
     @staticmethod
     def remove_user_from_vpn_server(server: Dict, user_uuid: str) -> bool:
         """Удаление пользователя с VPN сервера"""
-        try:
-            response = requests.delete(
-                f"{server['api_url']}/api/clients/{user_uuid}",
-                headers={"X-API-Token": server['api_token']},
-                timeout=10
-            )
-
-            success = response.status_code == 200
-            if success:
-                logger.info(f"Пользователь {user_uuid} удален с сервера {server['name']}")
-            else:
-                logger.error(f"Ошибка удаления пользователя {user_uuid}: HTTP {response.status_code}")
-
-            return success
-
-        except Exception as e:
-            logger.error(f"Исключение при удалении пользователя {user_uuid}: {e}")
-            return False
+        return node_client.run(node_client.remove_user_from_vpn_server(server, user_uuid))
 
     @staticmethod
     def get_user_from_vpn_server(server: Dict, user_uuid: str) -> Optional[Dict]:
         """Получение информации о пользователе с VPN сервера"""
-        try:
-            response = requests.get(
-                f"{server['api_url']}/api/clients/{user_uuid}",
-                headers={"X-API-Token": server['api_token']},
-                timeout=10
-            )
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return None
+        return node_client.run(node_client.get_user_from_vpn_server(server, user_uuid))
 
-        except Exception as e:
-            logger.error(f"Исключение при получении пользователя {user_uuid}: {e}")
-            return None
\ No newline at end of file
+    @staticmethod
+    def list_vpn_server_clients(server: Dict) -> Optional[List[Dict]]:
+        """Получение полного списка пользователей VPN сервера"""
+        return node_client.run(node_client.list_vpn_server_clients(server))
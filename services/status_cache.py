@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from services.node_client import node_client
+from services.metrics_service import server_metrics
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ServerStatusCache:
+    """Кэш статусов VPN серверов.
+
+    Статусы обновляет фоновый опрос (background/status_prober.py), чтение
+    никогда не ждет сети: устаревший статус возвращается сразу с пометкой
+    is_stale, а его обновление запускается в фоне (stale-while-revalidate).
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, Dict] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, server: Dict) -> Dict:
+        """Статус сервера из кэша (без запросов к серверу)"""
+        with self._lock:
+            entry = self._entries.get(server['id'])
+
+        if entry is None or entry['api_url'] != server['api_url']:
+            self.refresh_in_background(server)
+            return {"error": "Статус еще не получен", "checked_at": None, "age_seconds": None, "is_stale": True}
+
+        age = time.time() - entry['checked_at']
+        is_stale = age > Config.SERVER_STATUS_STALE_AFTER
+        if is_stale:
+            self.refresh_in_background(server)
+
+        status = dict(entry['status'])
+        status.update({
+            "checked_at": datetime.fromtimestamp(entry['checked_at']).isoformat(),
+            "age_seconds": round(age),
+            "is_stale": is_stale
+        })
+        return status
+
+    def peek(self, server_id: int) -> Optional[Dict]:
+        """Последняя проверка сервера (status, checked_at) без запуска обновления"""
+        with self._lock:
+            entry = self._entries.get(server_id)
+            return dict(entry) if entry else None
+
+    def get_response_time(self, server_id: int) -> Optional[float]:
+        """Время ответа сервера при последней проверке, мс"""
+        with self._lock:
+            entry = self._entries.get(server_id)
+            return entry['response_time'] if entry else None
+
+    def refresh(self, servers: Iterable[Dict]) -> Tuple[int, int]:
+        """Параллельная проверка серверов с ожиданием результата. Возвращает (онлайн, оффлайн)"""
+        servers = list(servers)
+        if not servers:
+            return 0, 0
+
+        statuses = node_client.run(self._probe_all(servers))
+        online = sum(1 for status in statuses if not status.get('error'))
+        return online, len(statuses) - online
+
+    def refresh_in_background(self, server: Dict):
+        """Проверка сервера в фоне (не более одной одновременной проверки на сервер)"""
+        with self._lock:
+            if server['id'] in self._refreshing:
+                return
+            self._refreshing.add(server['id'])
+
+        node_client.submit(self._probe(server))
+
+    def invalidate(self, server_id: int):
+        """Удаление статуса сервера из кэша (после изменения или удаления сервера)"""
+        with self._lock:
+            self._entries.pop(server_id, None)
+
+    async def _probe_all(self, servers: List[Dict]) -> List[Dict]:
+        return await asyncio.gather(*(self._probe(server) for server in servers))
+
+    async def _probe(self, server: Dict) -> Dict:
+        """Запрос статуса сервера с сохранением в кэш"""
+        try:
+            started = time.monotonic()
+            status = await node_client.get_server_status(server)
+            response_time = round((time.monotonic() - started) * 1000, 2)
+            server_metrics.record_status(server, status)
+
+            with self._lock:
+                self._entries[server['id']] = {
+                    'status': status,
+                    'checked_at': time.time(),
+                    'response_time': None if status.get('error') else response_time,
+                    'api_url': server['api_url']
+                }
+            return status
+        finally:
+            with self._lock:
+                self._refreshing.discard(server['id'])
+
+
+# Глобальный кэш статусов серверов (в памяти процесса)
+server_status_cache = ServerStatusCache()
@@ -13,7 +13,7 @@ class SubscriptionService:
     @staticmethod
     def get_all_promocodes() -> List[Dict]:
         """Получение всех промокодов"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM promocodes ORDER BY created_at DESC")
             return [dict(row) for row in cursor.fetchall()]
@@ -21,7 +21,7 @@ class SubscriptionService:
     @staticmethod
     def get_active_promocodes() -> List[Dict]:
         """Получение активных промокодов"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT * FROM promocodes 
@@ -193,7 +193,7 @@ class SubscriptionService:
             if not user:
                 return []
 
-            with db_manager.get_connection() as conn:
+            with db_manager.get_read_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     SELECT p.code, p.duration_seconds, pa.activated_at
@@ -0,0 +1,136 @@
+from typing import Dict, List, Optional
+from database.connection import db_manager
+from utils.helpers import now_timestamp
+from utils.id_bitmap import IdBitmap
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SyncStateService:
+    """Сервис для хранения желаемого и примененного состояния пользователей на VPN серверах"""
+
+    STATE_ACTIVE = 'active'
+    STATE_INACTIVE = 'inactive'
+    STATE_DELETED = 'deleted'
+    STATE_UNKNOWN = 'unknown'
+
+    @staticmethod
+    def desired_state_for(subscription_end: int) -> str:
+        """Желаемое состояние пользователя по дате окончания подписки (секунды Unix)"""
+        if subscription_end > now_timestamp():
+            return SyncStateService.STATE_ACTIVE
+        return SyncStateService.STATE_INACTIVE
+
+    @staticmethod
+    def mark_dirty(cursor, user_id: int, desired_state: str):
+        """Пометка пользователя для синхронизации монитором.
+
+        Выполняется курсором вызывающего кода, чтобы пометка попала
+        в ту же транзакцию, что и изменение подписки.
+        """
+        cursor.execute('''
+            INSERT INTO user_vpn_state
+                (user_id, applied_server_id, applied_state, user_uuid, desired_state, dirty)
+            SELECT id, server_id, ?, uuid, ?, 1 FROM users WHERE id = ?
+            ON CONFLICT(user_id) DO UPDATE SET
+                user_uuid = excluded.user_uuid,
+                desired_state = excluded.desired_state,
+                dirty = 1
+        ''', (SyncStateService.STATE_UNKNOWN, desired_state, user_id))
+
+    @staticmethod
+    def take_dirty_users(limit: int) -> List[Dict]:
+        """Выборка помеченных пользователей со снятием пометки"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            # Выборка и снятие пометки одним запросом, чтобы не потерять параллельную пометку
+            cursor.execute('''
+                UPDATE user_vpn_state SET dirty = 0
+                WHERE user_id IN (SELECT user_id FROM user_vpn_state WHERE dirty = 1 LIMIT ?)
+                RETURNING user_id, applied_server_id, applied_state, user_uuid, desired_state
+            ''', (limit,))
+            rows = [dict(row) for row in cursor.fetchall()]
+            conn.commit()
+
+            return rows
+
+    @staticmethod
+    def has_dirty_users() -> bool:
+        """Есть ли помеченные пользователи (дешевая проверка по частичному индексу)"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM user_vpn_state WHERE dirty = 1 LIMIT 1")
+            return cursor.fetchone() is not None
+
+    @staticmethod
+    def get_state(user_id: int) -> Optional[Dict]:
+        """Сохраненное состояние пользователя"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM user_vpn_state WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_applied_active_user_ids() -> IdBitmap:
+        """Пользователи, добавленные монитором на их текущий сервер"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT s.user_id
+                FROM user_vpn_state s
+                JOIN users u ON u.id = s.user_id
+                WHERE s.applied_state = ? AND s.applied_server_id = u.server_id
+            ''', (SyncStateService.STATE_ACTIVE,))
+            return IdBitmap(row[0] for row in cursor)
+
+    @staticmethod
+    def record_state(user_id: int, server_id: Optional[int], state: str, user_uuid: str = None):
+        """Сохранение примененного на сервере состояния пользователя"""
+        try:
+            with db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO user_vpn_state
+                        (user_id, applied_server_id, applied_state, user_uuid, desired_state, synced_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        applied_server_id = excluded.applied_server_id,
+                        applied_state = excluded.applied_state,
+                        user_uuid = COALESCE(excluded.user_uuid, user_vpn_state.user_uuid),
+                        desired_state = CASE WHEN user_vpn_state.dirty THEN user_vpn_state.desired_state
+                                             ELSE excluded.desired_state END,
+                        synced_at = excluded.synced_at
+                ''', (user_id, server_id, state, user_uuid, state, now_timestamp()))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния пользователя {user_id}: {e}")
+
+    @staticmethod
+    def record_removal(user_id: int, server_id: int, user_uuid: str) -> bool:
+        """Фиксация удаления пользователя с сервера.
+
+        Для пользователя, удаленного из БД, состояние удаляется целиком
+        (возвращает True), для остальных сохраняется как неактивное.
+        """
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM user_vpn_state
+                WHERE user_id = ? AND desired_state = ? AND dirty = 0
+            ''', (user_id, SyncStateService.STATE_DELETED))
+            deleted = cursor.rowcount > 0
+            conn.commit()
+
+        if not deleted:
+            SyncStateService.record_state(user_id, server_id, SyncStateService.STATE_INACTIVE, user_uuid)
+        return deleted
+
+    @staticmethod
+    def delete_state(user_id: int):
+        """Удаление состояния пользователя, убранного со всех серверов"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM user_vpn_state WHERE user_id = ? AND dirty = 0", (user_id,))
+            conn.commit()
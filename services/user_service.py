@@ -1,8 +1,13 @@
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 from database.connection import db_manager
 from services.server_service import ServerService
-from utils.helpers import generate_user_email, generate_uuid
+from services.server_placement import server_placement
+from services.sync_state_service import SyncStateService
+from services.vpn_link_service import VpnLinkService
+from services.count_cache import user_count_cache
+from utils.event_bus import event_bus, EVENT_SUBSCRIPTION_CHANGED
+from utils.helpers import generate_user_email, generate_uuid, now_timestamp, format_timestamp, \
+    encode_cursor, decode_cursor
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,7 +19,7 @@ class UserService:
     @staticmethod
     def get_all_users() -> List[Dict]:
         """Получение списка всех пользователей с информацией о серверах"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT u.*, s.name as server_name, s.domain as server_domain
@@ -26,7 +31,7 @@ class UserService:
             users = []
             for row in cursor.fetchall():
                 user = dict(row)
-                user['is_subscription_active'] = user['subscription_end'] > datetime.now()
+                user['is_subscription_active'] = user['subscription_end'] > now_timestamp()
                 users.append(user)
 
             return users
@@ -34,7 +39,7 @@ class UserService:
     @staticmethod
     def get_user_by_telegram_id(telegram_id: str) -> Optional[Dict]:
         """Получение пользователя по Telegram ID"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT u.*, s.name as server_name, s.domain as server_domain,
@@ -47,14 +52,14 @@ class UserService:
             row = cursor.fetchone()
             if row:
                 user = dict(row)
-                user['is_subscription_active'] = user['subscription_end'] > datetime.now()
+                user['is_subscription_active'] = user['subscription_end'] > now_timestamp()
                 return user
             return None
 
     @staticmethod
     def get_user_by_id(user_id: int) -> Optional[Dict]:
         """Получение пользователя по ID"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT u.*, s.name as server_name, s.domain as server_domain,
@@ -67,27 +72,29 @@ class UserService:
             row = cursor.fetchone()
             if row:
                 user = dict(row)
-                user['is_subscription_active'] = user['subscription_end'] > datetime.now()
+                user['is_subscription_active'] = user['subscription_end'] > now_timestamp()
                 return user
             return None
 
     @staticmethod
     def create_user(telegram_id: str, subscription_seconds: int = 0) -> Tuple[bool, str, Optional[Dict]]:
         """Создание нового пользователя"""
+        reserved_server_id = None
         try:
             # Проверяем существование пользователя
             if UserService.get_user_by_telegram_id(telegram_id):
                 return False, "Пользователь уже существует", None
 
-            # Получаем наименее загруженный сервер
-            server = ServerService.get_least_loaded_server()
+            # Выбираем сервер и сразу учитываем на нем нового пользователя
+            server = ServerService.get_least_loaded_server(reserve=True)
             if not server:
                 return False, "Нет доступных серверов", None
+            reserved_server_id = server['id']
 
             # Генерируем данные пользователя
             email = generate_user_email(telegram_id)
             user_uuid = generate_uuid()
-            subscription_end = datetime.now() + timedelta(seconds=subscription_seconds)
+            subscription_end = now_timestamp() + subscription_seconds
 
             with db_manager.get_connection() as conn:
                 cursor = conn.cursor()
@@ -106,13 +113,15 @@ class UserService:
                     VALUES (?, ?, ?)
                 ''', (user_id, "USER_CREATED", f"Server: {server['name']}"))
 
+                # Добавление на VPN сервер выполнит монитор через очередь операций
+                if subscription_seconds > 0:
+                    SyncStateService.mark_dirty(cursor, user_id, SyncStateService.STATE_ACTIVE)
+
                 conn.commit()
+                reserved_server_id = None
+                user_count_cache.invalidate()
 
-                # Если есть подписка, добавляем на VPN сервер
-                if subscription_seconds > 0:
-                    vpn_result = ServerService.add_user_to_vpn_server(server, user_uuid, email)
-                    if not vpn_result:
-                        logger.warning(f"Не удалось добавить пользователя {email} на VPN сервер")
+                event_bus.publish(EVENT_SUBSCRIPTION_CHANGED, user_id=user_id)
 
                 user_data = UserService.get_user_by_id(user_id)
                 logger.info(f"Создан пользователь {telegram_id} на сервере {server['name']}")
@@ -122,6 +131,9 @@ class UserService:
         except Exception as e:
             logger.error(f"Ошибка создания пользователя: {e}")
             return False, str(e), None
+        finally:
+            if reserved_server_id is not None:
+                server_placement.release(reserved_server_id)
 
     @staticmethod
     def update_subscription(telegram_id: str, additional_seconds: int) -> Tuple[bool, str]:
@@ -132,31 +144,31 @@ class UserService:
                 return False, "Пользователь не найден"
 
             # Рассчитываем новую дату окончания подписки
-            current_end = user['subscription_end']
-            if current_end < datetime.now():
-                new_end = datetime.now() + timedelta(seconds=additional_seconds)
-            else:
-                new_end = current_end + timedelta(seconds=additional_seconds)
+            new_end = max(user['subscription_end'], now_timestamp()) + additional_seconds
 
             with db_manager.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE users 
-                    SET subscription_end = ?, updated_at = CURRENT_TIMESTAMP
+                    SET subscription_end = ?, updated_at = ?
                     WHERE telegram_id = ?
-                ''', (new_end, telegram_id))
+                ''', (new_end, now_timestamp(), telegram_id))
 
                 # Логируем продление
                 cursor.execute('''
                     INSERT INTO user_activity_log (user_id, action, details)
                     VALUES (?, ?, ?)
                 ''', (user['id'], "SUBSCRIPTION_EXTENDED",
-                      f"Added {additional_seconds} seconds, new end: {new_end}"))
+                      f"Added {additional_seconds} seconds, new end: {format_timestamp(new_end, '%Y-%m-%d %H:%M:%S')}"))
+
+                SyncStateService.mark_dirty(cursor, user['id'], SyncStateService.desired_state_for(new_end))
 
                 conn.commit()
 
-                logger.info(f"Подписка пользователя {telegram_id} продлена до {new_end}")
-                return True, f"Подписка продлена до {new_end.strftime('%Y-%m-%d %H:%M:%S')}"
+                event_bus.publish(EVENT_SUBSCRIPTION_CHANGED, user_id=user['id'])
+
+                logger.info(f"Подписка пользователя {telegram_id} продлена до {format_timestamp(new_end)}")
+                return True, f"Подписка продлена до {format_timestamp(new_end, '%Y-%m-%d %H:%M:%S')}"
 
         except Exception as e:
             logger.error(f"Ошибка продления подписки: {e}")
@@ -170,28 +182,29 @@ class UserService:
             if not user:
                 return False, "Пользователь не найден"
 
-            # Удаляем с VPN сервера если есть доступ
-            if user['server_id'] and user['api_url']:
-                server = {
-                    'name': user['server_name'],
-                    'api_url': user['api_url'],
-                    'api_token': user['api_token']
-                }
-                ServerService.remove_user_from_vpn_server(server, user['uuid'])
-
             with db_manager.get_connection() as conn:
                 cursor = conn.cursor()
 
+                # Удаление с VPN сервера выполнит монитор по сохраненному состоянию
+                SyncStateService.mark_dirty(cursor, user_id, SyncStateService.STATE_DELETED)
+
                 # Удаляем активации промокодов
                 cursor.execute("DELETE FROM promocode_activations WHERE user_id = ?", (user_id,))
 
                 # Удаляем логи активности
                 cursor.execute("DELETE FROM user_activity_log WHERE user_id = ?", (user_id,))
 
+                # Удаляем сохраненные ссылки подключения
+                cursor.execute("DELETE FROM user_vpn_links WHERE user_id = ?", (user_id,))
+
                 # Удаляем пользователя
                 cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
 
                 conn.commit()
+                server_placement.release(user['server_id'])
+                user_count_cache.invalidate()
+
+                event_bus.publish(EVENT_SUBSCRIPTION_CHANGED, user_id=user_id)
 
                 logger.info(f"Удален пользователь {user['telegram_id']}")
                 return True, "Пользователь успешно удален"
@@ -214,25 +227,27 @@ class UserService:
             if not user['server_id']:
                 return False, "Сервер не назначен", None
 
-            server = {
-                'name': user['server_name'],
-                'api_url': user['api_url'],
-                'api_token': user['api_token']
-            }
-
-            # Получаем конфигурацию с сервера
-            vpn_data = ServerService.get_user_from_vpn_server(server, user['uuid'])
+            # Ссылки, сохраненные при добавлении на сервер
+            vpn_data = VpnLinkService.get(user['id'], user['server_id'], user['uuid'])
 
             if not vpn_data:
-                # Если пользователя нет на сервере, добавляем его
-                vpn_data = ServerService.add_user_to_vpn_server(server, user['uuid'], user['email'])
+                server = {
+                    'id': user['server_id'],
+                    'name': user['server_name'],
+                    'api_url': user['api_url'],
+                    'api_token': user['api_token']
+                }
+
+                # Сохраненных ссылок нет или они устарели - получаем конфигурацию с сервера
+                # (если пользователя нет на сервере, он будет добавлен)
+                vpn_data = ServerService.ensure_user_on_vpn_server(server, user['uuid'], user['email'])
                 if not vpn_data:
                     return False, "Не удалось получить VPN конфигурацию", None
 
+                VpnLinkService.save(user['id'], user['server_id'], user['uuid'], vpn_data)
+
             # Извлекаем ключ конфигурации
-            vless_key = (vpn_data.get('link_xtls') or
-                         vpn_data.get('link_ws') or
-                         vpn_data.get('link', ''))
+            vless_key = VpnLinkService.extract_key(vpn_data)
 
             if not vless_key:
                 return False, "VPN ключ недоступен", None
@@ -243,13 +258,31 @@ class UserService:
             logger.error(f"Ошибка получения VPN конфигурации: {e}")
             return False, str(e), None
 
+    @staticmethod
+    def get_users_sync_info(user_ids: Iterable[int], chunk_size: int = 500) -> List[Dict]:
+        """Данные пользователей, нужные для операций на VPN серверах (без данных серверов)"""
+        user_ids = list(user_ids)
+        users = []
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                cursor.execute(f'''
+                    SELECT id, telegram_id, uuid, email, server_id
+                    FROM users
+                    WHERE id IN ({",".join("?" * len(chunk))})
+                ''', chunk)
+                users.extend(dict(row) for row in cursor.fetchall())
+
+        return users
+
     @staticmethod
     def get_users_by_subscription_status(active: bool) -> List[Dict]:
         """Получение пользователей по статусу подписки"""
-        with db_manager.get_connection() as conn:
+        with db_manager.get_read_connection() as conn:
             cursor = conn.cursor()
 
-            now = datetime.now()
+            now = now_timestamp()
             if active:
                 cursor.execute('''
                     SELECT u.*, s.name as server_name, s.api_url, s.api_token
@@ -265,4 +298,138 @@ class UserService:
                     WHERE u.subscription_end <= ?
                 ''', (now,))
 
-            return [dict(row) for row in cursor.fetchall()]
\ No newline at end of file
+            return [dict(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def list_users(search: str = '', status: str = '', server_id: Optional[int] = None,
+                   after: Optional[str] = None, before: Optional[str] = None, limit: int = 20) -> Dict:
+        """Страница списка пользователей (новые первыми) с курсорами соседних страниц.
+
+        Страница выбирается по ключу (created_at, id) через индекс
+        idx_users_created_at, а не через OFFSET, поэтому запрос не замедляется
+        к концу списка. after - курсор next_cursor предыдущего ответа (следующая
+        страница), before - курсор prev_cursor (предыдущая страница).
+        Некорректный курсор - первая страница.
+        """
+        conditions, params = UserService._list_filters(search, status, server_id)
+
+        key = decode_cursor(before) if before else decode_cursor(after) if after else None
+        backward = bool(before) and key is not None
+        if key:
+            conditions.append(f"(u.created_at, u.id) {'>' if backward else '<'} (?, ?)")
+            params.extend(key)
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = 'ASC' if backward else 'DESC'
+
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT u.*, s.name as server_name, s.domain as server_domain
+                FROM users u
+                LEFT JOIN servers s ON u.server_id = s.id
+                {where_clause}
+                ORDER BY u.created_at {order}, u.id {order}
+                LIMIT ?
+            ''', params + [limit + 1])
+            users = [dict(row) for row in cursor.fetchall()]
+
+        # Лишняя строка показывает, есть ли страница дальше в направлении выборки
+        has_more = len(users) > limit
+        users = users[:limit]
+        if backward:
+            users.reverse()
+
+        now = now_timestamp()
+        for user in users:
+            user['is_subscription_active'] = user['subscription_end'] > now
+
+        has_next = True if backward else has_more
+        has_prev = has_more if backward else key is not None
+        return {
+            'users': users,
+            'next_cursor': encode_cursor(users[-1]['created_at'], users[-1]['id']) if users and has_next else None,
+            'prev_cursor': encode_cursor(users[0]['created_at'], users[0]['id']) if users and has_prev else None
+        }
+
+    @staticmethod
+    def count_users(search: str = '', status: str = '', server_id: Optional[int] = None) -> int:
+        """Количество пользователей по фильтрам списка.
+
+        Без фильтров и с фильтром только по серверу итог берется из счетчиков
+        servers.user_count, для остальных фильтров - COUNT(*) из кэша
+        (user_count_cache, может отставать на USERS_COUNT_CACHE_TTL секунд).
+        """
+        if not search and not status:
+            with db_manager.get_read_connection() as conn:
+                cursor = conn.cursor()
+                if server_id is not None:
+                    cursor.execute("SELECT user_count FROM servers WHERE id = ?", (server_id,))
+                    row = cursor.fetchone()
+                    return row[0] if row else 0
+
+                cursor.execute('''
+                    SELECT (SELECT COALESCE(SUM(user_count), 0) FROM servers)
+                         + (SELECT COUNT(*) FROM users WHERE server_id IS NULL)
+                ''')
+                return cursor.fetchone()[0]
+
+        def count() -> int:
+            conditions, params = UserService._list_filters(search, status, server_id)
+            with db_manager.get_read_connection() as conn:
+                cursor = conn.cursor()
+                where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+                cursor.execute(f"SELECT COUNT(*) FROM users u {where_clause}", params)
+                return cursor.fetchone()[0]
+
+        return user_count_cache.get(('users', search, status, server_id), count)
+
+    @staticmethod
+    def get_subscription_stats() -> Dict:
+        """Количество активных, истекших и истекающих в ближайшие сутки подписок (из кэша)"""
+
+        def count() -> Dict:
+            now = now_timestamp()
+            with db_manager.get_read_connection() as conn:
+                cursor = conn.cursor()
+                # Отдельные запросы проходят только по индексу idx_users_subscription_end
+                cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end > ?", (now,))
+                active_count = cursor.fetchone()[0]
+
+                cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end <= ?", (now,))
+                expired_count = cursor.fetchone()[0]
+
+                cursor.execute("SELECT COUNT(*) FROM users WHERE subscription_end BETWEEN ? AND ?",
+                               (now, now + 24 * 3600))
+                expiring_soon = cursor.fetchone()[0]
+
+            return {
+                'active_count': active_count,
+                'expired_count': expired_count,
+                'expiring_soon': expiring_soon
+            }
+
+        return user_count_cache.get(('subscription_stats',), count)
+
+    @staticmethod
+    def _list_filters(search: str, status: str, server_id: Optional[int]) -> Tuple[List[str], List]:
+        """Условия WHERE и параметры для фильтров списка пользователей"""
+        conditions = []
+        params = []
+
+        if search:
+            conditions.append("(u.telegram_id LIKE ? OR u.email LIKE ?)")
+            params.extend([f'%{search}%', f'%{search}%'])
+
+        if status == 'active':
+            conditions.append("u.subscription_end > ?")
+            params.append(now_timestamp())
+        elif status == 'expired':
+            conditions.append("u.subscription_end <= ?")
+            params.append(now_timestamp())
+
+        if server_id is not None:
+            conditions.append("u.server_id = ?")
+            params.append(server_id)
+
+        return conditions, params
@@ -0,0 +1,86 @@
+import time
+from typing import Dict, Optional
+from database.connection import db_manager
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class VpnLinkService:
+    """Ссылки подключения пользователей, сохраненные при добавлении на VPN сервер.
+
+    Ссылка действительна, пока пользователь на том же сервере с тем же UUID и
+    версия ссылок сервера (servers.links_version) не менялась: версия
+    увеличивается при смене домена или адреса сервера и при перевыпуске ключей.
+    """
+
+    LINK_FIELDS = ('link_xtls', 'link_ws', 'link')
+
+    @staticmethod
+    def save(user_id: Optional[int], server_id: int, user_uuid: str, vpn_data: Optional[Dict]) -> bool:
+        """Сохранение ссылок из ответа сервера. Возвращает True, если ссылки были в ответе"""
+        if user_id is None or not vpn_data:
+            return False
+
+        links = [vpn_data.get(field) or None for field in VpnLinkService.LINK_FIELDS]
+        if not any(links):
+            return False
+
+        try:
+            with db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO user_vpn_links
+                        (user_id, server_id, user_uuid, link_xtls, link_ws, link, links_version, refreshed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, (SELECT links_version FROM servers WHERE id = ?), ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        server_id = excluded.server_id,
+                        user_uuid = excluded.user_uuid,
+                        link_xtls = excluded.link_xtls,
+                        link_ws = excluded.link_ws,
+                        link = excluded.link,
+                        links_version = excluded.links_version,
+                        refreshed_at = excluded.refreshed_at
+                ''', (user_id, server_id, user_uuid, *links, server_id, time.time()))
+                conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения ссылок пользователя {user_id}: {e}")
+            return False
+
+    @staticmethod
+    def get(user_id: int, server_id: int, user_uuid: str) -> Optional[Dict]:
+        """Действительные ссылки пользователя или None, если их нужно получить с сервера"""
+        with db_manager.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT l.link_xtls, l.link_ws, l.link, l.refreshed_at
+                FROM user_vpn_links l
+                JOIN servers s ON s.id = l.server_id
+                WHERE l.user_id = ? AND l.server_id = ? AND l.user_uuid = ?
+                  AND l.links_version = s.links_version
+            ''', (user_id, server_id, user_uuid))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def delete(user_id: int):
+        """Удаление ссылок пользователя"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM user_vpn_links WHERE user_id = ?", (user_id,))
+            conn.commit()
+
+    @staticmethod
+    def invalidate_server(server_id: int) -> bool:
+        """Сброс сохраненных ссылок всех пользователей сервера (после перевыпуска ключей)"""
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE servers SET links_version = links_version + 1 WHERE id = ?", (server_id,))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    @staticmethod
+    def extract_key(links: Dict) -> str:
+        """Ключ подключения: XTLS, затем WebSocket, затем общая ссылка"""
+        return links.get('link_xtls') or links.get('link_ws') or links.get('link') or ''
@@ -0,0 +1,191 @@
+"""
+Локальная замена API VPN сервера для тестов и нагрузочного тестирования.
+
+Реализует тот же контракт, что и настоящий сервер (/api/server/status,
+/api/clients/generate, /api/clients/<uuid>, /api/clients), хранит
+клиентов в памяти и умеет добавлять задержку, разброс и ошибки.
+
+Запуск пяти серверов на портах 9001-9005:
+    python -m tools.fake_node --count 5 --port 9001 --latency-ms 50 --jitter-ms 20 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class FakeNode:
+    """Поддельный VPN сервер на localhost"""
+
+    def __init__(self, port: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0, token: Optional[str] = None, name: str = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.token = token
+
+        self.clients: Dict[str, Dict] = {}
+        self.added_at: Dict[str, float] = {}
+        self.removed_at: Dict[str, float] = {}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self._server.daemon_threads = True
+        self.name = name or f"fake-{self.port}"
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> 'FakeNode':
+        """Запуск сервера в фоновом потоке"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name=self.name)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Остановка сервера"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_DELETE(self):
+                self._handle('DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self, method: str):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                code, data = node.handle(method, self.path, self.headers.get('X-API-Token'), body)
+
+                payload = json.dumps(data).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def handle(self, method: str, path: str, token: Optional[str], body: bytes):
+        """Обработка запроса. Возвращает (код ответа, JSON)"""
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        with self.lock:
+            self.requests[method] += 1
+
+        if self.token and token != self.token:
+            return 401, {"error": "Неверный токен"}
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {"error": "Внутренняя ошибка (имитация)"}
+
+        if method == 'GET' and path == '/api/server/status':
+            return 200, self._status()
+
+        if method == 'GET' and path == '/api/clients':
+            with self.lock:
+                return 200, {"clients": list(self.clients.values())}
+
+        if method == 'POST' and path == '/api/clients/generate':
+            data = json.loads(body or b'{}')
+            client = self._client(data['id'], data.get('email', ''))
+            with self.lock:
+                self.clients[data['id']] = client
+                self.added_at.setdefault(data['id'], time.time())
+            return 200, client
+
+        if path.startswith('/api/clients/'):
+            user_uuid = path.rsplit('/', 1)[1]
+            with self.lock:
+                if method == 'GET':
+                    client = self.clients.get(user_uuid)
+                    return (200, client) if client else (404, {"error": "Клиент не найден"})
+
+                if method == 'DELETE':
+                    if self.clients.pop(user_uuid, None) is None:
+                        return 404, {"error": "Клиент не найден"}
+                    self.removed_at[user_uuid] = time.time()
+                    return 200, {"success": True}
+
+        return 404, {"error": "Неизвестный путь"}
+
+    def _client(self, user_uuid: str, email: str) -> Dict:
+        host = f"127.0.0.1:{self.port}"
+        return {
+            "id": user_uuid,
+            "email": email,
+            "link_xtls": f"vless://{user_uuid}@{host}?security=reality&flow=xtls-rprx-vision#{email}",
+            "link_ws": f"vless://{user_uuid}@{host}?type=ws#{email}",
+            "link": f"vless://{user_uuid}@{host}#{email}"
+        }
+
+    def _status(self) -> Dict:
+        with self.lock:
+            clients = len(self.clients)
+        return {
+            "status": "ok",
+            "clients": clients,
+            "system": {
+                "cpu": {"percent": round(random.uniform(5, 60), 1)},
+                "memory": {"percent": round(random.uniform(20, 70), 1)},
+                "uptime": "1d 0h"
+            }
+        }
+
+
+def start_fake_nodes(count: int, base_port: int = 0, **options) -> List[FakeNode]:
+    """Запуск нескольких поддельных серверов (base_port 0 - свободные порты)"""
+    return [FakeNode(port=base_port + index if base_port else 0, **options).start() for index in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поддельные VPN серверы для тестов")
+    parser.add_argument('--count', type=int, default=1, help="Количество серверов")
+    parser.add_argument('--port', type=int, default=9001, help="Порт первого сервера (0 - свободные порты)")
+    parser.add_argument('--latency-ms', type=float, default=0, help="Задержка ответа, мс")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Разброс задержки, мс")
+    parser.add_argument('--error-rate', type=float, default=0, help="Доля ответов 500 (0..1)")
+    parser.add_argument('--token', help="Требуемый X-API-Token (по умолчанию не проверяется)")
+    args = parser.parse_args()
+
+    nodes = start_fake_nodes(args.count, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                             error_rate=args.error_rate, token=args.token)
+    for node in nodes:
+        print(f"{node.name}: {node.url}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for node in nodes:
+            node.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Нагрузочный тест монитора подписок и API на поддельных VPN серверах.
+
+Создает временную БД, запускает N поддельных серверов (tools/fake_node.py)
+и измеряет:
+  - добавление: время от пометки пользователей до их появления на серверах;
+  - истечение: задержку удаления с серверов после окончания подписки;
+  - API: пропускную способность /api/users/vpn-config при параллельных запросах.
+
+Пример:
+    python -m tools.load_test --nodes 5 --users 2000 --latency-ms 30 --jitter-ms 10 --error-rate 0.01
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from tools.fake_node import start_fake_nodes
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def describe(values: List[float]) -> str:
+    if not values:
+        return "нет данных"
+    return (f"p50 {percentile(values, 50):.2f} с, p95 {percentile(values, 95):.2f} с, "
+            f"макс. {max(values):.2f} с")
+
+
+def wait_until(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return condition()
+
+
+def node_calls(nodes) -> int:
+    return sum(sum(node.requests.values()) for node in nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест синхронизации с VPN серверами")
+    parser.add_argument('--nodes', type=int, default=3, help="Количество поддельных серверов")
+    parser.add_argument('--users', type=int, default=1000, help="Количество пользователей")
+    parser.add_argument('--latency-ms', type=float, default=20, help="Задержка ответа сервера, мс")
+    parser.add_argument('--jitter-ms', type=float, default=5, help="Разброс задержки, мс")
+    parser.add_argument('--error-rate', type=float, default=0, help="Доля ответов 500 (0..1)")
+    parser.add_argument('--expire', type=int, default=None, help="Сколько подписок истечет (по умолчанию половина)")
+    parser.add_argument('--api-requests', type=int, default=2000, help="Запросов к API")
+    parser.add_argument('--api-concurrency', type=int, default=16, help="Параллельных запросов к API")
+    parser.add_argument('--timeout', type=float, default=300, help="Предельное время каждого этапа, с")
+    parser.add_argument('--db', help="Файл БД (по умолчанию временный)")
+    args = parser.parse_args()
+
+    # БД теста задается до импорта сервисов, чтобы не затронуть рабочую. Рабочий каталог
+    # тоже временный: хранилище задач планировщика (jobs.db) создается в текущем каталоге
+    work_dir = tempfile.mkdtemp(prefix='vpn-load-')
+    Config.DATABASE_PATH = os.path.abspath(args.db) if args.db else os.path.join(work_dir, 'load.db')
+    os.chdir(work_dir)
+
+    import logging
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    from database.connection import db_manager
+    from database.models import DatabaseInitializer
+    from services.server_service import ServerService
+    from services.sync_state_service import SyncStateService
+    from background.subscription_monitor import subscription_monitor
+    from utils.helpers import generate_user_email, generate_uuid, now_timestamp
+
+    DatabaseInitializer.init_database()
+
+    nodes = start_fake_nodes(args.nodes, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                             error_rate=args.error_rate)
+    for node in nodes:
+        ServerService.create_server(node.name, 'localhost', node.url, 'load-test-token')
+    servers = ServerService.get_active_servers()
+    print(f"БД: {Config.DATABASE_PATH}")
+    print(f"Серверов: {len(nodes)}, задержка {args.latency_ms}±{args.jitter_ms} мс, ошибок {args.error_rate:.1%}")
+
+    # Пользователи с активной подпиской, помеченные для синхронизации
+    subscription_end = now_timestamp() + 30 * 86400
+    with db_manager.get_connection() as conn:
+        cursor = conn.cursor()
+        for index in range(args.users):
+            telegram_id = str(10_000_000 + index)
+            cursor.execute('''
+                INSERT INTO users (telegram_id, email, uuid, server_id, subscription_end)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (telegram_id, generate_user_email(telegram_id), generate_uuid(),
+                  servers[index % len(servers)]['id'], subscription_end))
+            SyncStateService.mark_dirty(cursor, cursor.lastrowid, SyncStateService.STATE_ACTIVE)
+        conn.commit()
+
+    def clients_on_nodes() -> int:
+        return sum(len(node.clients) for node in nodes)
+
+    # Этап 1: добавление пользователей на серверы
+    calls_before = node_calls(nodes)
+    started = time.time()
+    subscription_monitor.start()
+    try:
+        completed = wait_until(lambda: clients_on_nodes() >= args.users, args.timeout)
+        elapsed = time.time() - started
+        calls = node_calls(nodes) - calls_before
+        lags = [added - started for node in nodes for added in node.added_at.values()]
+        print(f"\nДобавление: {clients_on_nodes()}/{args.users} за {elapsed:.1f} с"
+              f"{'' if completed else ' (не завершено)'}")
+        print(f"  запросов к серверам: {calls} ({calls / elapsed:.0f}/с)")
+        print(f"  задержка синхронизации: {describe(lags)}")
+
+        # Этап 2: истечение подписок
+        expire_count = args.users // 2 if args.expire is None else min(args.expire, args.users)
+        if expire_count:
+            deadline = now_timestamp() + 2
+            with db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id FROM users ORDER BY id LIMIT ?", (expire_count,))
+                user_ids = [row[0] for row in cursor.fetchall()]
+                for user_id in user_ids:
+                    cursor.execute("UPDATE users SET subscription_end = ? WHERE id = ?", (deadline, user_id))
+                    SyncStateService.mark_dirty(cursor, user_id, SyncStateService.STATE_ACTIVE)
+                conn.commit()
+
+            calls_before = node_calls(nodes)
+            expected = args.users - expire_count
+            completed = wait_until(lambda: clients_on_nodes() <= expected, args.timeout)
+            lags = [removed - deadline for node in nodes for removed in node.removed_at.values()]
+            calls = node_calls(nodes) - calls_before
+            print(f"\nИстечение: удалено {args.users - clients_on_nodes()}/{expire_count}"
+                  f"{'' if completed else ' (не завершено)'}")
+            print(f"  запросов к серверам: {calls}")
+            print(f"  задержка после окончания подписки: {describe(lags)}")
+    finally:
+        subscription_monitor.stop()
+
+    # Этап 3: API конфигурации пользователей
+    if args.api_requests:
+        from app import create_app
+        app = create_app()
+
+        with db_manager.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT telegram_id FROM users WHERE subscription_end > ?", (now_timestamp(),))
+            telegram_ids = [row[0] for row in cursor.fetchall()]
+
+        if telegram_ids:
+            latencies, errors = [], []
+            lock = threading.Lock()
+
+            def request_config(index: int):
+                client = app.test_client()
+                request_started = time.perf_counter()
+                response = client.get(f"/api/users/vpn-config/{telegram_ids[index % len(telegram_ids)]}")
+                with lock:
+                    latencies.append(time.perf_counter() - request_started)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+
+            calls_before = node_calls(nodes)
+            started = time.time()
+            with ThreadPoolExecutor(max_workers=args.api_concurrency) as executor:
+                list(executor.map(request_config, range(args.api_requests)))
+            elapsed = time.time() - started
+
+            print(f"\nAPI vpn-config: {args.api_requests} запросов за {elapsed:.1f} с "
+                  f"({args.api_requests / elapsed:.0f}/с), ошибок {len(errors)}")
+            print(f"  время ответа: p50 {statistics.median(latencies) * 1000:.1f} мс, "
+                  f"p95 {percentile(latencies, 95) * 1000:.1f} мс")
+            print(f"  запросов к серверам: {node_calls(nodes) - calls_before}")
+
+    for node in nodes:
+        node.stop()
+
+
+if __name__ == '__main__':
+    main()
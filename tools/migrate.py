@@ -0,0 +1,51 @@
+"""
+Состояние и применение версионных миграций схемы БД (database/migrations.py).
+
+Пример:
+    python -m tools.migrate                  # список миграций и версия схемы
+    python -m tools.migrate --apply          # применить ожидающие
+    python -m tools.migrate --db other.db    # другой файл БД
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('--apply', action='store_true', help="Применить ожидающие миграции")
+    parser.add_argument('--db', help="Файл БД (по умолчанию из config.py)")
+    args = parser.parse_args()
+
+    # БД задается до импорта модулей работы с ней
+    if args.db:
+        Config.DATABASE_PATH = os.path.abspath(args.db)
+
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from database.connection import db_manager
+    from database.migrations import MIGRATIONS, SchemaMigrator
+
+    if args.apply:
+        # Базовые таблицы создаются при инициализации, миграции меняют их дальше
+        from database.models import DatabaseInitializer
+        DatabaseInitializer.init_database()
+        with db_manager.get_connection() as conn:
+            SchemaMigrator.migrate(conn)
+
+    status = SchemaMigrator.get_status()
+    print(f"БД: {db_manager.db_path}")
+    print(f"Версия схемы: {status['version']} из {status['latest']}")
+    for version, description, _ in MIGRATIONS:
+        mark = 'ожидает' if version in status['pending'] else 'применена'
+        print(f"  {version:>3}  {mark:<10} {description}")
+
+
+if __name__ == '__main__':
+    main()
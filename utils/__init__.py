@@ -2,10 +2,19 @@
 Утилиты и вспомогательные функции
 """
 
-from .helpers import generate_user_email, generate_uuid, format_duration, seconds_to_human_readable
+from .helpers import generate_user_email, generate_uuid, format_duration, seconds_to_human_readable, \
+    now_timestamp, to_timestamp, from_timestamp, format_timestamp, decode_timestamps, \
+    encode_cursor, decode_cursor, server_key
 from .validators import validate_telegram_id, validate_subscription_duration, validate_server_data, validate_promocode_data
+from .event_bus import event_bus, EventBus, EVENT_SUBSCRIPTION_CHANGED, EVENT_OUTBOX_CHANGED, \
+    EVENT_MIGRATION_CHANGED
+from .id_bitmap import IdBitmap
 
 __all__ = [
     'generate_user_email', 'generate_uuid', 'format_duration', 'seconds_to_human_readable',
-    'validate_telegram_id', 'validate_subscription_duration', 'validate_server_data', 'validate_promocode_data'
+    'now_timestamp', 'to_timestamp', 'from_timestamp', 'format_timestamp', 'decode_timestamps',
+    'encode_cursor', 'decode_cursor', 'server_key',
+    'validate_telegram_id', 'validate_subscription_duration', 'validate_server_data', 'validate_promocode_data',
+    'event_bus', 'EventBus', 'EVENT_SUBSCRIPTION_CHANGED', 'EVENT_OUTBOX_CHANGED', 'EVENT_MIGRATION_CHANGED',
+    'IdBitmap'
 ]
\ No newline at end of file
@@ -0,0 +1,53 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Подписка пользователя изменена (продление, промокод, оплата, ручная правка, удаление)
+EVENT_SUBSCRIPTION_CHANGED = 'subscription_changed'
+# В очередь vpn_outbox добавлены операции в обход монитора (например, сверкой сервера)
+EVENT_OUTBOX_CHANGED = 'outbox_changed'
+# Миграция пользователей между серверами создана или возобновлена
+EVENT_MIGRATION_CHANGED = 'migration_changed'
+
+
+class EventBus:
+    """Шина событий внутри процесса.
+
+    Обработчики вызываются синхронно в потоке публикации, поэтому должны
+    быть быстрыми (например, только будить фоновый поток). Ошибка обработчика
+    не влияет на публикующий код.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, event: str, handler: Callable):
+        """Подписка обработчика на событие"""
+        with self._lock:
+            if handler not in self._handlers[event]:
+                self._handlers[event].append(handler)
+
+    def unsubscribe(self, event: str, handler: Callable):
+        """Отписка обработчика от события"""
+        with self._lock:
+            if handler in self._handlers[event]:
+                self._handlers[event].remove(handler)
+
+    def publish(self, event: str, **data):
+        """Публикация события всем подписанным обработчикам"""
+        with self._lock:
+            handlers = list(self._handlers.get(event, ()))
+
+        for handler in handlers:
+            try:
+                handler(event, **data)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика события {event}: {e}")
+
+
+# Глобальный экземпляр шины событий
+event_bus = EventBus()
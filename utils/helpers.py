@@ -1,6 +1,10 @@
+import base64
 import uuid
 import random
 import string
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
 from config import Config
 
 
@@ -20,6 +24,62 @@ def generate_uuid() -> str:
     return str(uuid.uuid4())
 
 
+def server_key(server: Dict):
+    """Ключ сервера в реестрах по серверам: id, для еще не сохраненного сервера - api_url"""
+    return server.get('id') or server['api_url']
+
+
+def now_timestamp() -> int:
+    """Текущее время в секундах Unix - формат хранения дат в БД"""
+    return int(time.time())
+
+
+def to_timestamp(value: datetime) -> int:
+    """Преобразование datetime (локальное время) в секунды Unix"""
+    return int(value.timestamp())
+
+
+def from_timestamp(value: Optional[float]) -> Optional[datetime]:
+    """Преобразование секунд Unix из БД в datetime (для API и шаблонов)"""
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+def format_timestamp(value: Optional[float], fmt: str = '%d.%m.%Y %H:%M:%S') -> str:
+    """Форматирование секунд Unix из БД в читаемую дату"""
+    return datetime.fromtimestamp(value).strftime(fmt) if value is not None else ''
+
+
+# Колонки дат в БД (секунды Unix)
+TIMESTAMP_FIELDS = ('subscription_end', 'created_at', 'updated_at', 'activated_at', 'timestamp',
+                    'synced_at', 'started_at', 'finished_at')
+
+
+def decode_timestamps(row: Optional[Dict], fields: Iterable[str] = TIMESTAMP_FIELDS) -> Optional[Dict]:
+    """Замена дат в секундах Unix на datetime в строке из БД (для ответов API)"""
+    if row:
+        for field in fields:
+            value = row.get(field)
+            if value is not None:
+                row[field] = datetime.fromtimestamp(value)
+    return row
+
+
+def encode_cursor(*values: int) -> str:
+    """Курсор постраничного вывода: ключ строки в непрозрачном для клиента виде"""
+    raw = ':'.join(str(int(value)) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, size: int = 2) -> Optional[Tuple[int, ...]]:
+    """Разбор курсора из encode_cursor. Некорректный курсор - None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        values = tuple(int(value) for value in raw.split(':'))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return values if len(values) == size else None
+
+
 def format_duration(seconds: int) -> str:
     """Форматирование продолжительности в читаемый вид"""
     if seconds < 60: